@@ -0,0 +1,185 @@
+"""
+Admission control for chat turns.
+
+- RateLimiter: token buckets per key (client IP, session). A key gets `rate`
+  turns per second on average and bursts of up to `burst`; past that,
+  take() returns how long until the next token, which becomes the 429's
+  Retry-After.
+- AdmissionController: at most max_in_flight turns run at once and at most
+  max_queue wait for a slot. While every slot is taken, turns are rejected
+  up front, not after they have waited, when the queue is full or when the
+  estimated wait (queue position x recent turn time / slots) plus a turn's
+  own time would pass the deadline. The caller answers those with 503 +
+  Retry-After. A turn that finds a free slot is always admitted, and the
+  recent turn time decays back toward its initial value while no turn
+  finishes, so a burst of slow turns can't keep an idle server rejecting.
+
+While the controller is saturated, main.py first tries to answer without
+a slot, from the clinic facts or the semantic cache (see shed_answer()), so
+a traffic spike degrades to cached answers instead of a growing queue.
+"""
+import math
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+import metrics
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000):
+        """
+        rate: tokens per second (0 disables the limiter). Buckets of keys
+        beyond max_keys are dropped least recently used first; a dropped key
+        starts again with a full bucket.
+        """
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, now=None) -> float:
+        """
+        Takes a token for key. Returns 0 if one was available, else the
+        seconds until there will be one.
+        """
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+class AdmissionController:
+    def __init__(self, max_in_flight=32, max_queue=64, deadline=20.0, initial_turn_seconds=1.0):
+        """
+        deadline: seconds a client waits for a reply (queueing included).
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self.initial_turn_seconds = initial_turn_seconds
+        # Moving average of how long an admitted turn holds its slot, as of
+        # the last turn that finished (see turn_seconds)
+        self._turn_seconds = initial_turn_seconds
+        self._turn_finished = time.monotonic()
+        self.in_flight = 0
+        self.waiting = 0
+        self._slots = None
+        self.counts = {}
+
+    def _count(self, outcome):
+        self.counts[outcome] = self.counts.get(outcome, 0) + 1
+        metrics.admissions.inc(outcome=outcome)
+
+    @property
+    def saturated(self) -> bool:
+        """
+        True when a new turn would have to queue.
+        """
+        return self.in_flight + self.waiting >= self.max_in_flight
+
+    @property
+    def queued(self) -> int:
+        """
+        Turns waiting for a slot beyond those about to take a free one.
+        """
+        return max(0, self.in_flight + self.waiting - self.max_in_flight)
+
+    @property
+    def turn_seconds(self) -> float:
+        """
+        The moving average, decayed toward initial_turn_seconds with a
+        half-life of `deadline` seconds since the last turn finished.
+        """
+        idle = time.monotonic() - self._turn_finished
+        weight = 0.5 ** (idle / self.deadline) if self.deadline > 0 else 0.0
+        return self.initial_turn_seconds + (self._turn_seconds - self.initial_turn_seconds) * weight
+
+    def estimated_wait(self) -> float:
+        if not self.saturated:
+            return 0.0
+        return (self.queued + 1) * self.turn_seconds / self.max_in_flight
+
+    def check(self):
+        """
+        Raises Overloaded if a turn arriving now should be turned away. Only
+        a turn that would have to queue is: one that finds a free slot runs.
+        """
+        if self.max_in_flight <= 0 or not self.saturated:
+            return
+        turn_seconds = self.turn_seconds
+        wait = (self.queued + 1) * turn_seconds / self.max_in_flight
+        if self.queued >= self.max_queue:
+            self._count("rejected_queue_full")
+            raise Overloaded("queue_full", wait)
+        if wait + turn_seconds > self.deadline:
+            self._count("rejected_deadline")
+            raise Overloaded("deadline", wait)
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Holds one of the max_in_flight slots for a turn. Raises Overloaded
+        if the turn is rejected or can't get a slot in time.
+        """
+        if self.max_in_flight <= 0:
+            yield
+            return
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        self.check()
+        self.waiting += 1
+        try:
+            if self._slots.locked():
+                # A turn that starts later than this wouldn't finish before the deadline
+                await asyncio.wait_for(self._slots.acquire(), max(0.0, self.deadline - self.turn_seconds))
+            else:
+                await self._slots.acquire()
+        except asyncio.TimeoutError:
+            self._count("timed_out")
+            raise Overloaded("timeout", self.estimated_wait() or self.turn_seconds)
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self._count("admitted")
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+            self._turn_seconds = 0.9 * self.turn_seconds + 0.1 * (time.perf_counter() - started)
+            self._turn_finished = time.monotonic()
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "deadline_seconds": self.deadline,
+            "turn_seconds": round(self.turn_seconds, 3),
+            "estimated_wait_seconds": round(self.estimated_wait(), 3),
+            "counts": dict(self.counts),
+        }
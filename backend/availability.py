@@ -0,0 +1,258 @@
+"""
+Appointment availability: normalized request times and free-slot search.
+
+normalize() turns what users type or the date picker sends ("tomorrow at 5",
+"Tue, Feb 17, 2026, 10:30 AM", "10 pm") into a datetime, or None when there
+is no recognizable time or the date is relative in a way it can't resolve
+("in two days"), rather than guessing today.
+
+Calendar keeps every upcoming request in an interval index: per day, a
+sorted list of start minutes for each service and one for the whole clinic.
+Every appointment lasts slot_minutes, so a new request overlaps an existing
+one exactly when their starts are less than slot_minutes apart, which is two
+bisects. A time is free when its service has no overlapping request and the
+clinic has fewer than `capacity`. next_free() walks the slot grid within
+opening hours and checks each candidate in O(log n).
+
+The index is built from the store at startup and updated by this worker's
+own bookings; with several workers, a slot taken through another worker is
+only seen after a restart (the office confirms every request anyway).
+"""
+import re
+import threading
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta, time as dtime
+
+from dateutil import parser as date_parser
+
+ALL_SERVICES = "*"
+
+RELATIVE_DAY_RE = re.compile(r"\b(today|tonight|tomorrow)\b")
+# "at 5" would otherwise parse as the 5th of the month
+AT_HOUR_RE = re.compile(r"\bat (\d{1,2})(?::(\d{2}))?\b(?![\d:]|\s*(?:am|pm|a\.m|p\.m))")
+MERIDIEM_RE = re.compile(r"\d\s*(?:am|pm|a\.m|p\.m)|\bmorning\b")
+PM_WORDS_RE = re.compile(r"\b(?:afternoon|evening|tonight)\b")
+# Relative dates dateutil skips over with fuzzy=True, leaving today's date:
+# "in two days", "3 weeks from now", "next Tuesday", "the day after tomorrow"
+UNREADABLE_RELATIVE_RE = re.compile(
+    r"\b(?:in|after|within)\s+(?:\d+|an?|one|two|three|four|five|six|seven|eight|nine|ten|"
+    r"(?:a\s+)?few|(?:a\s+)?couple(?:\s+of)?)\s+(?:hours?|days?|weeks?|months?)\b"
+    r"|\b(?:days?|weeks?|months?)\s+(?:from|later|after)\b"
+    r"|\bnext\s+[a-z]|\bthis\s+(?:week|weekend|month)\b"
+)
+
+DAY_NAMES = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+MONTH_NAMES = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+def format_slot(dt: datetime) -> str:
+    """
+    Same format as the frontend date picker: "Tue, Feb 17, 2026, 10:30 AM".
+    Built by hand: strftime's unpadded %-d / %-I are glibc-only and its
+    names follow the locale.
+    """
+    hour = dt.hour % 12 or 12
+    meridiem = "AM" if dt.hour < 12 else "PM"
+    return f"{DAY_NAMES[dt.weekday()]}, {MONTH_NAMES[dt.month - 1]} {dt.day}, {dt.year}, {hour}:{dt.minute:02d} {meridiem}"
+
+def _parse(text, default):
+    try:
+        return date_parser.parse(text, default=default, fuzzy=True)
+    except (ValueError, OverflowError):
+        return None
+
+def normalize(text, now=None):
+    """
+    Returns the datetime `text` refers to, or None if it has no time of day
+    or a relative date other than today / tonight / tomorrow, so the user is
+    asked again. Relative words resolve against `now` (a stored request's
+    created_at).
+    A time without a date is its next occurrence, and an hour from 1 to 7
+    without AM/PM (or "morning") is taken as afternoon, as is any hour
+    before noon said with "afternoon", "evening" or "tonight".
+    """
+    if not text:
+        return None
+    now = now or datetime.now()
+    text = " ".join(re.sub(r"\bnoon\b", "12:00 pm", str(text).lower()).split())
+    if UNREADABLE_RELATIVE_RE.search(text):
+        return None
+
+    base = now.date()
+    relative = RELATIVE_DAY_RE.search(text)
+    if relative:
+        base += timedelta(days=1 if relative.group(1) == "tomorrow" else 0)
+        text = RELATIVE_DAY_RE.sub(" ", text)
+    text = AT_HOUR_RE.sub(lambda m: f"at {m.group(1)}:{m.group(2) or '00'}", text)
+
+    # Parsing with two different defaults shows which parts the text gave
+    first = _parse(text, datetime.combine(base, dtime(0, 0)))
+    second = _parse(text, datetime.combine(base + timedelta(days=1), dtime(1, 0)))
+    if first is None or second is None or first.hour != second.hour:
+        return None
+    dt = first.replace(second=0, microsecond=0, tzinfo=None)
+
+    pm_words = PM_WORDS_RE.search(text) or (relative and relative.group(1) == "tonight")
+    if not MERIDIEM_RE.search(text) and (1 <= dt.hour <= 7 or pm_words and dt.hour < 12):
+        dt += timedelta(hours=12)
+    if not relative and first.date() != second.date() and dt < now:
+        # Only a time of day (or a weekday that resolved to today): the next occurrence
+        dt += timedelta(days=7 if first.weekday() == second.weekday() else 1)
+    return dt
+
+def plain_service(service) -> str:
+    return " ".join(str(service).lower().split())
+
+class Calendar:
+    def __init__(self, hours, slot_minutes=30, capacity=2, horizon_days=60, service_key=None):
+        """
+        hours: [open, close] minutes or None per weekday, Monday first (facts.json).
+        capacity: requests the clinic takes at the same time, across services.
+        service_key: maps a booking's service text to the treatment it is
+        indexed under, so "botox please" and "Botox Cosmetic" overlap
+        (default: lowercased).
+        """
+        self.hours = hours
+        self._service_key = service_key or plain_service
+        self.slot_minutes = slot_minutes
+        self.capacity = capacity
+        self.horizon_days = horizon_days
+        self._starts = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def service_key(self, service) -> str:
+        return (self._service_key(service) if service else "") or "unknown"
+
+    def load(self, records, now=None):
+        """
+        Indexes stored appointment records that are still in the future.
+        """
+        now = now or datetime.now()
+        for record in records:
+            starts_at = record.get("starts_at")
+            if starts_at:
+                dt = datetime.fromisoformat(starts_at)
+            else:
+                created_at = record.get("created_at")
+                try:
+                    created = datetime.fromisoformat(created_at) if created_at else now
+                except ValueError:
+                    created = now
+                dt = normalize(record.get("date"), created)
+            if dt is not None and dt >= now:
+                self.add(dt, record.get("service"))
+
+    def _insert(self, dt: datetime, service_key):
+        minute = dt.hour * 60 + dt.minute
+        for key in (service_key, ALL_SERVICES):
+            insort(self._starts.setdefault((dt.date(), key), []), minute)
+        self.requests += 1
+
+    def add(self, dt: datetime, service):
+        key = self.service_key(service)
+        with self._lock:
+            self._insert(dt, key)
+
+    def reserve(self, dt: datetime, service) -> bool:
+        """
+        Adds a request for dt if the time is still free, in one step, so two
+        sessions confirming the same time can't both get it. Returns False
+        if it was taken. release() undoes it if the booking isn't stored.
+        """
+        key = self.service_key(service)
+        with self._lock:
+            if not self._free(dt, key):
+                return False
+            self._insert(dt, key)
+            return True
+
+    def release(self, dt: datetime, service):
+        minute = dt.hour * 60 + dt.minute
+        service_key = self.service_key(service)
+        with self._lock:
+            removed = False
+            for key in (service_key, ALL_SERVICES):
+                starts = self._starts.get((dt.date(), key))
+                if starts:
+                    i = bisect_left(starts, minute)
+                    if i < len(starts) and starts[i] == minute:
+                        del starts[i]
+                        removed = True
+            if removed:
+                self.requests -= 1
+
+    def _overlapping(self, day, key, minute) -> int:
+        starts = self._starts.get((day, key))
+        if not starts:
+            return 0
+        return bisect_left(starts, minute + self.slot_minutes) - bisect_right(starts, minute - self.slot_minutes)
+
+    def _free(self, dt: datetime, service_key) -> bool:
+        day, minute = dt.date(), dt.hour * 60 + dt.minute
+        return (
+            self._overlapping(day, service_key, minute) == 0
+            and self._overlapping(day, ALL_SERVICES, minute) < self.capacity
+        )
+
+    def is_free(self, dt: datetime, service) -> bool:
+        key = self.service_key(service)
+        with self._lock:
+            return self._free(dt, key)
+
+    def _open(self, dt: datetime) -> bool:
+        hours = self.hours[dt.weekday()]
+        minute = dt.hour * 60 + dt.minute
+        return bool(hours) and hours[0] <= minute <= hours[1] - self.slot_minutes
+
+    def check(self, dt: datetime, service, now=None):
+        """
+        (True, "") if dt can be requested, else (False, reason).
+        """
+        now = now or datetime.now()
+        if dt < now:
+            return False, "That time has already passed."
+        if dt > now + timedelta(days=self.horizon_days):
+            return False, f"We take requests up to {self.horizon_days} days ahead."
+        if not self._open(dt):
+            return False, "We are not open for appointments at that time."
+        if not self.is_free(dt, service):
+            return False, "That time has already been requested."
+        return True, ""
+
+    def next_free(self, service, n=5, after=None, now=None):
+        """
+        The first n free slot start times at or after `after` (default now),
+        on the slot grid within opening hours.
+        """
+        now = now or datetime.now()
+        after = max(after or now, now)
+        key = self.service_key(service)
+        slots = []
+        day = after.date()
+        last_day = now.date() + timedelta(days=self.horizon_days)
+        while len(slots) < n and day <= last_day:
+            hours = self.hours[day.weekday()]
+            if hours:
+                first = hours[0]
+                if day == after.date():
+                    # Round up to the grid
+                    elapsed = max(0, after.hour * 60 + after.minute + (1 if after.second else 0) - hours[0])
+                    first = hours[0] + -(-elapsed // self.slot_minutes) * self.slot_minutes
+                for minute in range(first, hours[1] - self.slot_minutes + 1, self.slot_minutes):
+                    dt = datetime.combine(day, dtime(minute // 60, minute % 60))
+                    with self._lock:
+                        free = self._free(dt, key)
+                    if free:
+                        slots.append(dt)
+                        if len(slots) == n:
+                            break
+            day += timedelta(days=1)
+        return slots
+
+    def stats(self):
+        return {
+            "slot_minutes": self.slot_minutes,
+            "capacity": self.capacity,
+            "horizon_days": self.horizon_days,
+            "indexed_requests": self.requests,
+        }
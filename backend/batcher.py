@@ -0,0 +1,82 @@
+"""
+Async micro-batching for CPU-bound retrieval work.
+
+Concurrent turns each need one query embedding and one vector search. A
+MicroBatcher collects the requests that arrive within `max_wait_ms` of the
+first one (or until `max_batch` are waiting), runs them as a single call on
+the retrieval executor, and resolves each caller's future with its own result.
+One MiniLM forward pass over 16 queries, or one matrix product against the
+index, costs far less than 16 separate ones.
+"""
+import asyncio
+
+import metrics
+
+class MicroBatcher:
+    def __init__(self, fn, executor=None, max_batch=32, max_wait_ms=2.0, name="batch"):
+        """
+        fn takes a list of items and returns a list of results in the same order.
+        """
+        self.fn = fn
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self._pending = []
+        self._timer = None
+        self.batches = 0
+        self.items = 0
+        self.largest = 0
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        if self.max_batch <= 1:
+            return (await loop.run_in_executor(self.executor, self._run, [item]))[0]
+
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _run(self, items):
+        self.batches += 1
+        self.items += len(items)
+        self.largest = max(self.largest, len(items))
+        metrics.batch_size.observe(len(items), stage=self.name)
+        return self.fn(items)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_soon(self._flush)
+        if batch:
+            asyncio.ensure_future(self._resolve(batch))
+
+    async def _resolve(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, self._run, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest,
+        }
@@ -0,0 +1,329 @@
+"""
+Offline benchmark / load test for the chat API.
+
+Runs the FastAPI app in-process (no network, no Gemini) with a deterministic
+fake LLM that has configurable latency, and drives scripted multi-turn
+conversations (booking, interruption/resume, edit, cancel, fallback) at a
+configurable concurrency. Reports p50/p95/p99 turn latency, throughput, LLM
+calls per turn and memory growth, and exits non-zero if a conversation broke
+or a latency budget was exceeded.
+
+    cd backend
+    python benchmark.py --concurrency 50 --iterations 4 --llm-latency-ms 400
+    python benchmark.py --json --max-p95-ms 1500   # CI regression gate
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+FALLBACK_ANSWER = (
+    "Good question — this actually depends on a few details.\n"
+    "Instead of guessing, I can connect you with the right person who can guide you properly.\n"
+    "Shall I arrange a quick call?"
+)
+RAG_ANSWER = (
+    "CN Medical Aesthetics & Wellness is located in Park Ridge, IL. We offer injectables such as "
+    "BOTOX®, Dysport® and Jeuveau, dermal fillers, laser treatments, facials and wellness services. "
+    "Call us at (847) 693-4663 for details."
+)
+UNKNOWN_TOPICS = ("insurance", "price", "cost", "discount")
+
+class FakeLLM:
+    """
+    Deterministic stand-in for ChatGoogleGenerativeAI. Recognizes the prompts
+    main.py builds (extraction, interruption check, RAG answer) and answers them
+    after a seeded, jittered delay.
+    """
+    def __init__(self, latency_ms=300.0, jitter_ms=100.0, token_delay_ms=5.0, seed=0):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.token_delay = token_delay_ms / 1000
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    def _delay(self):
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def respond(self, prompt: str) -> str:
+        if "Extract booking details" in prompt:
+            message = prompt.rsplit("User message:", 1)[-1]
+            service = re.search(r"\b(botox|filler|facial|kybella|microneedling)\b", message + prompt, re.IGNORECASE)
+            return json.dumps({
+                "name": None, "phone": None, "email": None,
+                "service": service.group(1).lower() if service else None, "date": None,
+            })
+        if "Is the user's message providing the requested information" in prompt:
+            message = prompt.split("User Message:", 1)[1].split("\n", 1)[0]
+            return "True" if "?" in message else "False"
+        question = prompt.rsplit("Question:", 1)[-1].lower()
+        if any(topic in question for topic in UNKNOWN_TOPICS):
+            return FALLBACK_ANSWER
+        return RAG_ANSWER
+
+    def _usage(self, prompt, content):
+        input_tokens, output_tokens = len(prompt) // 4, len(content) // 4
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    async def ainvoke(self, prompt, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self._delay())
+        content = self.respond(prompt)
+        return AIMessage(content=content, usage_metadata=self._usage(prompt, content))
+
+    async def astream(self, prompt, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self._delay())
+        content = self.respond(prompt)
+        words = content.split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.token_delay)
+            last = i == len(words) - 1
+            yield AIMessageChunk(
+                content=word + ("" if last else " "),
+                usage_metadata=self._usage(prompt, content) if last else None,
+            )
+
+    def invoke(self, prompt, **kwargs):
+        self.calls += 1
+        time.sleep(self._delay())
+        content = self.respond(prompt)
+        return AIMessage(content=content, usage_metadata=self._usage(prompt, content))
+
+# Stands for a time picked from the slots the bot offered, like the frontend picker
+SLOT = object()
+
+def scenarios():
+    """
+    name -> list of (message, expected substring of the reply or None).
+    """
+    return {
+        "booking": [
+            ("I'd like to book an appointment", "name"),
+            ("Jane Doe", "phone"),
+            ("555-123-4567", "email"),
+            ("jane@example.com", "service"),
+            ("botox", "when would you like"),
+            (SLOT, "please confirm"),
+            ("yes", "submitted"),
+        ],
+        "interruption": [
+            ("book an appointment", "name"),
+            ("Jane Doe", "phone"),
+            ("Where is the clinic located?", "park ridge"),
+            ("555-123-4567", "email"),
+        ],
+        "edit": [
+            ("I want to book botox", "name"),
+            ("Jane Doe", "phone"),
+            ("555-123-4567", "email"),
+            ("jane@example.com", "when would you like"),
+            (SLOT, "please confirm"),
+            ("I need to change the date", "when would you like"),
+            (SLOT, "please confirm"),
+            ("yes", "submitted"),
+        ],
+        "cancel": [
+            ("book an appointment", "name"),
+            ("Jane Doe", "phone"),
+            ("cancel", "reason"),
+            ("found a cheaper option", "cancelled"),
+        ],
+        "fallback": [
+            ("Do you take insurance?", "arrange a quick call"),
+            ("yes", "name"),
+            ("Jane Doe", "phone"),
+        ],
+        "faq": [
+            ("What services do you offer?", None),
+            ("Where are you located?", "park ridge"),
+        ],
+    }
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def rss_mb():
+    """
+    Current resident set size, from /proc where available (Linux), else peak RSS.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+async def run_benchmark(args):
+    import httpx
+    import main
+    from cache import SemanticCache
+
+    fake = FakeLLM(args.llm_latency_ms, args.llm_jitter_ms, args.token_delay_ms, seed=args.seed)
+    main.llm = fake
+    if args.no_cache:
+        main.tenant().semantic_cache = SemanticCache(max_entries=0)
+
+    script = scenarios()
+    selected = args.scenarios.split(",") if args.scenarios else list(script)
+    latencies = {name: [] for name in selected}
+    failures = []
+    endpoint = "/chat/stream" if args.stream else "/chat"
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        async def send(session_id, message):
+            payload = {"message": message, "session_id": session_id}
+            if not args.stream:
+                response = await client.post(endpoint, json=payload)
+                response.raise_for_status()
+                return response.json()
+            data = None
+            async with client.stream("POST", endpoint, json=payload) as response:
+                response.raise_for_status()
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event:"):
+                        event = line[6:].strip()
+                    elif line.startswith("data:") and event in ("done", "error"):
+                        data = json.loads(line[5:])
+            return data or {"reply": ""}
+
+        # Slot labels picked by any user in this run
+        picked = set()
+
+        async def user(user_id):
+            for iteration in range(args.iterations):
+                name = selected[(user_id + iteration) % len(selected)]
+                session_id = f"bench-{user_id}-{iteration}"
+                offered = []
+                for turn, (message, expected) in enumerate(script[name]):
+                    if message is SLOT:
+                        if not offered:
+                            failures.append(f"{name}#{turn}: no free slots offered")
+                            break
+                        # Concurrent users pick different slots, as real users mostly would:
+                        # every user starts at its own offset and skips slots another
+                        # user already picked, since the offered list shifts as slots go
+                        labels = [slot["label"] for slot in offered]
+                        start = user_id % len(labels)
+                        free = [label for label in labels[start:] + labels[:start] if label not in picked]
+                        if not free:
+                            failures.append(f"{name}#{turn}: every offered slot was already picked")
+                            break
+                        message = free[0]
+                        picked.add(message)
+                    started = time.perf_counter()
+                    try:
+                        data = await send(session_id, message)
+                    except Exception as e:
+                        failures.append(f"{name}#{turn} {message!r}: {e}")
+                        break
+                    latencies[name].append(time.perf_counter() - started)
+                    reply = data.get("reply") or ""
+                    offered = data.get("slots") or offered
+                    if expected and expected not in reply.lower():
+                        failures.append(f"{name}#{turn} {message!r}: expected {expected!r} in {reply[:120]!r}")
+                        break
+
+        # Load the models and run a warm-up turn so startup doesn't count against the first users
+        await main.start_warmup()
+        await send("bench-warmup", "Where are you located?")
+        fake.calls = 0
+        rss_before = rss_mb()
+        started = time.perf_counter()
+        await asyncio.gather(*(user(i) for i in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        rss_after = rss_mb()
+
+    all_latencies = [v for values in latencies.values() for v in values]
+    turns = len(all_latencies)
+
+    def summary(values):
+        return {
+            "turns": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 1),
+            "p95_ms": round(percentile(values, 95) * 1000, 1),
+            "p99_ms": round(percentile(values, 99) * 1000, 1),
+        }
+
+    return {
+        "config": {
+            "endpoint": endpoint,
+            "concurrency": args.concurrency,
+            "iterations": args.iterations,
+            "llm_latency_ms": args.llm_latency_ms,
+            "semantic_cache": not args.no_cache,
+        },
+        "overall": dict(
+            summary(all_latencies),
+            seconds=round(elapsed, 2),
+            turns_per_second=round(turns / elapsed, 1) if elapsed else 0.0,
+            llm_calls_per_turn=round(fake.calls / turns, 3) if turns else 0.0,
+            rss_before_mb=round(rss_before, 1),
+            rss_after_mb=round(rss_after, 1),
+            rss_growth_mb=round(rss_after - rss_before, 1),
+        ),
+        "scenarios": {name: summary(values) for name, values in latencies.items()},
+        "failures": failures,
+    }
+
+def print_report(report):
+    overall = report["overall"]
+    print(f"Config: {report['config']}")
+    print(
+        f"{overall['turns']} turns in {overall['seconds']}s "
+        f"({overall['turns_per_second']} turns/s), "
+        f"{overall['llm_calls_per_turn']} LLM calls/turn, "
+        f"RSS {overall['rss_before_mb']} -> {overall['rss_after_mb']} MB"
+    )
+    print(f"{'scenario':<14}{'turns':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = list(report["scenarios"].items()) + [("overall", overall)]
+    for name, s in rows:
+        print(f"{name:<14}{s['turns']:>7}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}")
+    for failure in report["failures"]:
+        print(f"FAIL: {failure}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline chat benchmark with a stubbed LLM")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent simulated users")
+    parser.add_argument("--iterations", type=int, default=3, help="Conversations per user")
+    parser.add_argument("--scenarios", default="", help="Comma-separated subset of scenarios")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=100.0)
+    parser.add_argument("--token-delay-ms", type=float, default=5.0, help="Delay between streamed tokens")
+    parser.add_argument("--stream", action="store_true", help="Drive /chat/stream instead of /chat")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the semantic cache")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--max-p95-ms", type=float, default=0, help="Exit non-zero if overall p95 exceeds this")
+    args = parser.parse_args()
+
+    # Keep benchmark bookings/sessions out of data/ and never call the real API
+    os.environ.setdefault("STORAGE_DIR", tempfile.mkdtemp(prefix="cnbot-bench-"))
+    os.environ.setdefault("SESSION_BACKEND", "memory")
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark-offline")
+    # Every simulated user shares one IP and sends its turns back-to-back
+    os.environ.setdefault("RATE_LIMIT_IP_RPS", "0")
+    os.environ.setdefault("RATE_LIMIT_SESSION_RPS", "0")
+
+    report = asyncio.run(run_benchmark(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    over_budget = args.max_p95_ms and report["overall"]["p95_ms"] > args.max_p95_ms
+    sys.exit(1 if report["failures"] or over_budget else 0)
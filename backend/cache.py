@@ -0,0 +1,278 @@
+"""
+Semantic response cache for RAG answers.
+
+Answers are keyed by the normalized query embedding. A lookup is a hit when the
+cosine similarity to a cached query is above the threshold, so near-duplicate
+FAQ questions ("what are your hours?" / "what are the hours") share one Gemini
+generation. Entries expire after a TTL, the least recently used entry is evicted
+when full, and everything is dropped when the vector index version changes.
+
+EmbeddingCache sits one step earlier: normalized query text -> query
+embedding, so repeated short queries skip the encoder forward pass. Text
+that normalizes to nothing (emoji, punctuation) is always encoded.
+"""
+import os
+import re
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+def normalize_text(text: str) -> str:
+    """
+    Case- and punctuation-insensitive key for exact repeats. Letters and
+    digits of every script are kept, so "你好吗" and "¿qué tal?" get keys of
+    their own; text with none (emoji, punctuation) gets "" and isn't cached
+    by text.
+    """
+    return re.sub(r"[^\w ]+|_", "", " ".join(text.casefold().split())).strip()
+
+class SemanticCache:
+    def __init__(self, max_entries=1000, threshold=0.95, ttl_seconds=86400):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.version = None
+
+        # Row i of _vectors holds the unit-length query embedding for slot i
+        self._vectors = None
+        self._valid = np.zeros(max_entries, dtype=bool)
+        # slot -> (normalized text, answer, created_at); order = LRU order
+        self._entries = OrderedDict()
+        # normalized text -> slot, for exact repeats without a vector scan
+        self._by_text = {}
+        self._free = list(range(max_entries - 1, -1, -1))
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def check_version(self, version):
+        """
+        Drops every entry if the index the answers were generated from has changed.
+        """
+        if version != self.version:
+            if self.version is not None:
+                self.clear()
+                self.invalidations += 1
+            self.version = version
+
+    def clear(self):
+        self._valid[:] = False
+        self._entries.clear()
+        self._by_text.clear()
+        self._free = list(range(self.max_entries - 1, -1, -1))
+
+    def _remove(self, slot):
+        text, _, _ = self._entries.pop(slot)
+        self._by_text.pop(text, None)
+        self._valid[slot] = False
+        self._free.append(slot)
+
+    def _fresh(self, slot):
+        _, _, created_at = self._entries[slot]
+        if time.time() - created_at > self.ttl_seconds:
+            self._remove(slot)
+            self.expirations += 1
+            return False
+        return True
+
+    def _hit(self, slot):
+        self._entries.move_to_end(slot)
+        self.hits += 1
+        return self._entries[slot][1]
+
+    def get_text(self, text: str):
+        """
+        Exact-match lookup on the normalized query text. Doesn't count a miss,
+        since the caller falls through to get_vector().
+        """
+        key = normalize_text(text)
+        if not self.enabled or not key:
+            return None
+        slot = self._by_text.get(key)
+        if slot is not None and self._fresh(slot):
+            return self._hit(slot)
+        return None
+
+    def get_vector(self, vector):
+        if not self.enabled or not self._entries:
+            self.misses += 1
+            return None
+
+        query = _unit(vector)
+        sims = self._vectors @ query
+        sims[~self._valid] = -1.0
+        slot = int(np.argmax(sims))
+        if sims[slot] >= self.threshold and self._fresh(slot):
+            return self._hit(slot)
+
+        self.misses += 1
+        return None
+
+    def put(self, text: str, vector, answer: str):
+        if not self.enabled:
+            return
+        query = _unit(vector)
+        if self._vectors is None:
+            self._vectors = np.zeros((self.max_entries, query.shape[0]), dtype=np.float32)
+
+        key = normalize_text(text)
+        if key and key in self._by_text:
+            self._remove(self._by_text[key])
+        if not self._free:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+        slot = self._free.pop()
+        self._vectors[slot] = query
+        self._valid[slot] = True
+        self._entries[slot] = (key, answer, time.time())
+        if key:
+            self._by_text[key] = slot
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "index_version": self.version,
+        }
+
+def _unit(vector):
+    v = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm > 0 else v
+
+class EmbeddingCache:
+    """
+    LRU + TTL cache of normalized query text -> embedding. Vectors live in one
+    preallocated float32 pool sized from a memory budget (allocated on the
+    first put, once the dimension is known). With a path, the cache is loaded
+    at startup and save() writes it back, so it survives restarts; entries
+    from a different embedding model are ignored.
+    """
+    def __init__(self, budget_mb=16.0, ttl_seconds=86400, path=None, model=""):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.model = model
+        self.max_entries = 0
+
+        self._vectors = None
+        # normalized text -> (slot, created_at); order = LRU order
+        self._entries = OrderedDict()
+        self._free = []
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    @property
+    def enabled(self):
+        return self.budget_bytes > 0
+
+    def _allocate(self, dim):
+        self.max_entries = max(1, self.budget_bytes // (dim * 4))
+        self._vectors = np.zeros((self.max_entries, dim), dtype=np.float32)
+        self._free = list(range(self.max_entries - 1, -1, -1))
+
+    def get(self, text: str):
+        key = normalize_text(text)
+        if not self.enabled or not key:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        slot, created_at = entry
+        if time.time() - created_at > self.ttl_seconds:
+            del self._entries[key]
+            self._free.append(slot)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._vectors[slot].copy()
+
+    def put(self, text: str, vector, created_at=None):
+        key = normalize_text(text)
+        if not self.enabled or not key:
+            return
+        vector = np.asarray(vector, dtype=np.float32)
+        if self._vectors is None:
+            self._allocate(vector.shape[0])
+        if key in self._entries:
+            slot, _ = self._entries.pop(key)
+        else:
+            if not self._free:
+                _, (oldest, _) = self._entries.popitem(last=False)
+                self._free.append(oldest)
+                self.evictions += 1
+            slot = self._free.pop()
+        self._vectors[slot] = vector
+        self._entries[key] = (slot, created_at or time.time())
+
+    def save(self):
+        """
+        Writes the live entries (oldest first) to path, atomically.
+        """
+        if not self.path or self._vectors is None:
+            return
+        keys = list(self._entries)
+        slots = [self._entries[k][0] for k in keys]
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                model=np.array(self.model),
+                keys=np.array(keys, dtype=str),
+                created_at=np.array([self._entries[k][1] for k in keys], dtype=np.float64),
+                vectors=self._vectors[slots],
+            )
+        os.replace(tmp, self.path)
+
+    def load(self):
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if str(data["model"]) != self.model:
+                    return
+                now = time.time()
+                for key, created_at, vector in zip(data["keys"], data["created_at"], data["vectors"]):
+                    if now - created_at <= self.ttl_seconds:
+                        self.put(str(key), vector, created_at=float(created_at))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Embedding cache load error: {e}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "budget_bytes": self.budget_bytes,
+            "pool_bytes": self._vectors.nbytes if self._vectors is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "persistent": bool(self.path),
+        }
@@ -0,0 +1,134 @@
+"""
+Prompt-size budgeting for Gemini calls.
+
+- merge_chunks() drops retrieved chunks contained in another and stitches
+  chunks that overlap (the splitter repeats up to CHUNK_OVERLAP characters
+  between neighbours), so shared text is sent once.
+- build_rag_prompt() fits system prompt + context + question into a token
+  budget, dropping the lowest-ranked context first.
+- fold_history() keeps the last few history lines verbatim and folds older
+  ones, one turn at a time, into a short per-session summary of what the
+  user said; the extraction prompt gets summary + recent lines instead of raw
+  history.
+
+Token counts are estimates (about 4 characters per token); Gemini's own
+tokenizer isn't available offline and the estimate is only used for budgeting
+and for reporting savings.
+"""
+import re
+
+# Overlaps shorter than this are coincidence, not splitter overlap
+MIN_OVERLAP = 20
+MAX_OVERLAP = 200
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+def _overlap(a: str, b: str) -> int:
+    """
+    Length of the longest suffix of a that is a prefix of b.
+    """
+    for k in range(min(len(a), len(b), MAX_OVERLAP), MIN_OVERLAP - 1, -1):
+        if a.endswith(b[:k]):
+            return k
+    return 0
+
+def merge_chunks(texts):
+    """
+    Returns the chunks with duplicates and overlaps removed, in rank order.
+    """
+    merged = []
+    for text in texts:
+        text = text.strip()
+        if not text or any(text in kept for kept in merged):
+            continue
+        for i, kept in enumerate(merged):
+            k = _overlap(kept, text)
+            if k:
+                merged[i] = kept + text[k:]
+                break
+            k = _overlap(text, kept)
+            if k:
+                merged[i] = text + kept[k:]
+                break
+        else:
+            merged = [kept for kept in merged if kept not in text] + [text]
+    return merged
+
+def _truncate(text: str, tokens: int) -> str:
+    """
+    Cuts text to about `tokens` tokens, at a sentence or line boundary if possible.
+    """
+    limit = tokens * 4
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    boundary = max(cut.rfind(". "), cut.rfind("\n"))
+    return cut[:boundary + 1] if boundary > limit // 2 else cut
+
+def build_rag_prompt(system_prompt: str, chunks, question: str, budget_tokens: int):
+    """
+    Returns (prompt, raw_tokens, prompt_tokens). raw_tokens is the size the
+    prompt would have had with the chunks concatenated as retrieved.
+    """
+    template = "\n{system}\n\nContext:\n{context}\n\nQuestion: {question}\n"
+    raw = template.format(system=system_prompt, context="\n".join(chunks), question=question)
+
+    fixed = estimate_tokens(template.format(system=system_prompt, context="", question=question))
+    available = max(0, budget_tokens - fixed)
+    context = []
+    for text in merge_chunks(chunks):
+        cost = estimate_tokens(text) + 1
+        if cost > available:
+            # Keep at least part of the best chunk; drop lower-ranked ones
+            if not context and available > 0:
+                context.append(_truncate(text, available))
+            break
+        context.append(text)
+        available -= cost
+
+    prompt = template.format(system=system_prompt, context="\n".join(context), question=question)
+    return prompt, estimate_tokens(raw), estimate_tokens(prompt)
+
+# --- Conversation history ---
+
+SUMMARY_LINE_CHARS = 120
+BOT_LINE_CHARS = 300
+
+def _shorten(line: str, limit: int) -> str:
+    line = re.sub(r"\s+", " ", line).strip()
+    if len(line) > limit:
+        line = line[:limit].rsplit(" ", 1)[0] + "..."
+    return line
+
+def fold_history(session: dict, keep_lines: int = 4, max_summary_lines: int = 6):
+    """
+    Moves history lines beyond the last keep_lines into session["summary"].
+    Only user lines are kept, shortened; bot answers are already reflected in
+    what the user asked next. Called after every append, so each line is
+    folded exactly once.
+    """
+    history = session.get("history") or []
+    if len(history) <= keep_lines:
+        return
+    older, session["history"] = history[:-keep_lines], history[-keep_lines:]
+    summary = session.setdefault("summary", [])
+    for line in older:
+        if line.startswith("User:"):
+            summary.append(_shorten(line, SUMMARY_LINE_CHARS))
+    del summary[:-max_summary_lines]
+
+def conversation_context(session: dict, recent_lines: int = 4) -> str:
+    """
+    Context for the extraction prompt: earlier user turns (summarized), then
+    the recent lines, with long bot answers shortened.
+    """
+    lines = []
+    summary = session.get("summary")
+    if summary:
+        lines.append("Earlier in the conversation:")
+        lines.extend(summary)
+        lines.append("Recent:")
+    for line in (session.get("history") or [])[-recent_lines:]:
+        lines.append(_shorten(line, BOT_LINE_CHARS) if line.startswith("Bot:") else line)
+    return "\n".join(lines)
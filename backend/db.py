@@ -0,0 +1,590 @@
+"""
+Storage for appointment requests and cancellations.
+
+Two interchangeable backends, selected with STORAGE_BACKEND:
+- "sqlite" (default): SQLite in WAL mode with indexes on phone/email/created_at
+  and on the requested time (starts_at).
+- "jsonl": fsync'd append-only JSON Lines logs guarded by an exclusive file lock.
+
+Both keep the cost of a write constant as history grows (no read-modify-write of
+the whole file), and both import the legacy data/*.json files once on first open.
+
+Reads go through query(): one filtered page at a time, oldest first, with an
+opaque cursor (the last row id for SQLite, a byte offset for JSONL), so
+export() can walk any amount of history in constant memory.
+upcoming_appointments() reads only the requests that can still be ahead,
+and tail() resumes from a cursor saved with save_checkpoint(), so startup
+doesn't grow with the history either.
+"""
+import os
+import json
+import sqlite3
+import threading
+import fcntl
+from contextlib import contextmanager
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+DATA_DIR = os.path.join(project_root, "data")
+
+def _text(value):
+    """
+    Coerces an extracted booking field to a plain string for indexed columns.
+    The LLM occasionally returns lists or numbers for these.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return " ".join(str(v) for v in value)
+    return str(value)
+
+KINDS = ("appointments", "cancellations")
+# Record field holding the timestamp that date ranges filter on
+TIME_FIELDS = {"appointments": "created_at", "cancellations": "cancelled_at"}
+
+def booking_details(kind, record):
+    """
+    The booking details of a record; cancellations keep them under "data".
+    """
+    return (record.get("data") or {}) if kind == "cancellations" else record
+
+def matches(kind, record, filters) -> bool:
+    """
+    filters: since (inclusive) / before (exclusive) ISO timestamps, phone and
+    email (exact), service (case-insensitive substring).
+    """
+    stamp = record.get(TIME_FIELDS[kind]) or ""
+    if filters.get("since") and stamp < filters["since"]:
+        return False
+    if filters.get("before") and stamp >= filters["before"]:
+        return False
+    details = booking_details(kind, record)
+    for key in ("phone", "email"):
+        if filters.get(key) and _text(details.get(key)) != filters[key]:
+            return False
+    if filters.get("service") and filters["service"].lower() not in (_text(details.get("service")) or "").lower():
+        return False
+    return True
+
+def _load_legacy(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        try:
+            records = json.load(f)
+        except json.JSONDecodeError:
+            print(f"Skipping unreadable legacy file: {path}")
+            return []
+    return records if isinstance(records, list) else []
+
+class Store:
+    """
+    Interface for appointment/cancellation storage backends.
+    """
+    def save_appointment(self, record: dict) -> None:
+        raise NotImplementedError
+
+    def save_cancellation(self, record: dict) -> None:
+        raise NotImplementedError
+
+    def last_cancellation(self):
+        raise NotImplementedError
+
+    def appointments(self):
+        """
+        Yields every stored appointment record, oldest first.
+        """
+        raise NotImplementedError
+
+    def upcoming_appointments(self, starts_since, created_since):
+        """
+        Yields the appointment records requested for starts_since or later
+        (ISO timestamps), plus records without a starts_at (free-text dates
+        from before the calendar) created at created_since or later.
+        """
+        raise NotImplementedError
+
+    def query(self, kind, filters=None, cursor=None, limit=100):
+        """
+        Returns (records, next_cursor): up to `limit` records of `kind`
+        matching `filters` (see matches()), oldest first, starting after
+        `cursor`. next_cursor is None on the last page. Raises ValueError for
+        a malformed cursor.
+        """
+        raise NotImplementedError
+
+    def export(self, kind, filters=None, batch=500):
+        """
+        Yields every matching record, one page in memory at a time. Each page
+        is a separate query, so the generator can be resumed from any thread.
+        """
+        cursor = None
+        while True:
+            records, cursor = self.query(kind, filters, cursor, batch)
+            yield from records
+            if cursor is None:
+                return
+
+    def tail(self, kind, cursor=None, batch=500):
+        """
+        Yields (record, cursor) for every record of `kind` after `cursor`,
+        oldest first; the cursor is the position right after that record.
+        """
+        raise NotImplementedError
+
+    def load_checkpoint(self, name):
+        """
+        The state last saved under name (a JSON-serializable dict), or None.
+        """
+        raise NotImplementedError
+
+    def save_checkpoint(self, name, state) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+class SQLiteStore(Store):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS appointments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at TEXT NOT NULL,
+        name TEXT,
+        phone TEXT,
+        email TEXT,
+        service TEXT,
+        date TEXT,
+        starts_at TEXT,
+        ip_address TEXT,
+        record TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_appointments_phone ON appointments(phone);
+    CREATE INDEX IF NOT EXISTS idx_appointments_email ON appointments(email);
+    CREATE INDEX IF NOT EXISTS idx_appointments_created_at ON appointments(created_at);
+    -- idx_appointments_starts_at is created by _add_starts_at(), after the
+    -- column exists in databases from before it
+
+    CREATE TABLE IF NOT EXISTS cancellations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        cancelled_at TEXT NOT NULL,
+        reason TEXT,
+        name TEXT,
+        phone TEXT,
+        email TEXT,
+        service TEXT,
+        ip_address TEXT,
+        record TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_cancellations_phone ON cancellations(phone);
+    CREATE INDEX IF NOT EXISTS idx_cancellations_email ON cancellations(email);
+    CREATE INDEX IF NOT EXISTS idx_cancellations_cancelled_at ON cancellations(cancelled_at);
+
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        name TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS migrations (
+        name TEXT PRIMARY KEY,
+        applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # sqlite3 connections can't be shared across threads; writes come from
+        # the executor pool, so each thread gets its own connection. All of
+        # them are listed so close() can close every one.
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._connect().executescript(self.SCHEMA)
+        self._add_starts_at()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Only ever used by this thread; check_same_thread=False lets
+            # close() close it from another one
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            with self._connections_lock:
+                self._connections.append(conn)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        # IMMEDIATE takes the write lock up front, so concurrent writers
+        # (threads or worker processes) queue instead of losing updates.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _add_starts_at(self):
+        """
+        Adds and backfills the starts_at column in databases created before
+        it, once.
+        """
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM migrations WHERE name = 'appointments_starts_at'").fetchone():
+                return
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(appointments)")]
+            if "starts_at" not in columns:
+                conn.execute("ALTER TABLE appointments ADD COLUMN starts_at TEXT")
+            conn.execute("UPDATE appointments SET starts_at = json_extract(record, '$.starts_at') WHERE starts_at IS NULL")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_appointments_starts_at ON appointments(starts_at)")
+            conn.execute("INSERT INTO migrations (name) VALUES ('appointments_starts_at')")
+
+    def _insert_appointment(self, conn, record):
+        conn.execute(
+            "INSERT INTO appointments (created_at, name, phone, email, service, date, starts_at, ip_address, record) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                record.get("created_at", ""),
+                _text(record.get("name")),
+                _text(record.get("phone")),
+                _text(record.get("email")),
+                _text(record.get("service")),
+                _text(record.get("date")),
+                record.get("starts_at"),
+                record.get("ip_address"),
+                json.dumps(record),
+            ),
+        )
+
+    def _insert_cancellation(self, conn, record):
+        data = record.get("data") or {}
+        conn.execute(
+            "INSERT INTO cancellations (cancelled_at, reason, name, phone, email, service, ip_address, record) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                record.get("cancelled_at", ""),
+                _text(record.get("reason")),
+                _text(data.get("name")),
+                _text(data.get("phone")),
+                _text(data.get("email")),
+                _text(data.get("service")),
+                record.get("ip_address"),
+                json.dumps(record),
+            ),
+        )
+
+    def save_appointment(self, record):
+        with self._transaction() as conn:
+            self._insert_appointment(conn, record)
+
+    def save_cancellation(self, record):
+        with self._transaction() as conn:
+            self._insert_cancellation(conn, record)
+
+    def last_cancellation(self):
+        row = self._connect().execute(
+            "SELECT record FROM cancellations ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        return json.loads(row["record"]) if row else None
+
+    def appointments(self):
+        for row in self._connect().execute("SELECT record FROM appointments ORDER BY id"):
+            yield json.loads(row["record"])
+
+    def upcoming_appointments(self, starts_since, created_since):
+        # Two indexed range scans rather than one OR over both columns
+        rows = self._connect().execute(
+            "SELECT record FROM appointments WHERE starts_at >= ? "
+            "UNION ALL SELECT record FROM appointments WHERE starts_at IS NULL AND created_at >= ?",
+            (starts_since, created_since),
+        )
+        for row in rows:
+            yield json.loads(row["record"])
+
+    def query(self, kind, filters=None, cursor=None, limit=100):
+        filters = filters or {}
+        table, time_column = kind, TIME_FIELDS[kind]
+        where, params = ["id > ?"], [int(cursor or 0)]
+        if filters.get("since"):
+            where.append(f"{time_column} >= ?")
+            params.append(filters["since"])
+        if filters.get("before"):
+            where.append(f"{time_column} < ?")
+            params.append(filters["before"])
+        for column in ("phone", "email"):
+            if filters.get(column):
+                where.append(f"{column} = ?")
+                params.append(filters[column])
+        if filters.get("service"):
+            where.append("instr(lower(service), ?) > 0")
+            params.append(filters["service"].lower())
+        rows = self._connect().execute(
+            f"SELECT id, record FROM {table} WHERE {' AND '.join(where)} ORDER BY id LIMIT ?",
+            params + [limit + 1],
+        ).fetchall()
+        next_cursor = str(rows[limit - 1]["id"]) if len(rows) > limit else None
+        return [json.loads(row["record"]) for row in rows[:limit]], next_cursor
+
+    def tail(self, kind, cursor=None, batch=500):
+        last_id = int(cursor or 0)
+        while True:
+            rows = self._connect().execute(
+                f"SELECT id, record FROM {kind} WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch)
+            ).fetchall()
+            for row in rows:
+                last_id = row["id"]
+                yield json.loads(row["record"]), str(last_id)
+            if len(rows) < batch:
+                return
+
+    def load_checkpoint(self, name):
+        row = self._connect().execute("SELECT state FROM checkpoints WHERE name = ?", (name,)).fetchone()
+        return json.loads(row["state"]) if row else None
+
+    def save_checkpoint(self, name, state):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO checkpoints (name, state) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET state = excluded.state, updated_at = CURRENT_TIMESTAMP",
+                (name, json.dumps(state)),
+            )
+
+    def migrate_legacy(self, appointments_file, cancellations_file):
+        """
+        Imports the legacy JSON files once. Recorded in the migrations table so
+        restarts (and other workers) don't import twice.
+        """
+        with self._transaction() as conn:
+            for name, path, insert in [
+                ("legacy_appointments_json", appointments_file, self._insert_appointment),
+                ("legacy_cancellations_json", cancellations_file, self._insert_cancellation),
+            ]:
+                if conn.execute("SELECT 1 FROM migrations WHERE name = ?", (name,)).fetchone():
+                    continue
+                records = _load_legacy(path)
+                for record in records:
+                    insert(conn, record)
+                conn.execute("INSERT INTO migrations (name) VALUES (?)", (name,))
+                if records:
+                    print(f"Migrated {len(records)} records from {path}")
+
+    def close(self):
+        """
+        Closes the connections of every thread that used the store, so the
+        WAL is checkpointed and its files released.
+        """
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        # Threads reconnect on their next use rather than hit a closed connection
+        self._local = threading.local()
+
+class JsonlStore(Store):
+    """
+    Append-only JSON Lines logs. Every write appends one line under an exclusive
+    flock and fsyncs before releasing it, so concurrent writers never interleave.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.appointments_path = os.path.join(directory, "appointments.jsonl")
+        self.cancellations_path = os.path.join(directory, "cancellations.jsonl")
+
+    @contextmanager
+    def _locked(self, path):
+        with open(path, "a", encoding="utf-8") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield f
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _append(self, path, records):
+        with self._locked(path) as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def save_appointment(self, record):
+        self._append(self.appointments_path, [record])
+
+    def save_cancellation(self, record):
+        self._append(self.cancellations_path, [record])
+
+    def last_cancellation(self):
+        if not os.path.exists(self.cancellations_path):
+            return None
+        # Read backwards from the end so this stays cheap on large logs
+        with open(self.cancellations_path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            pos, tail = end, b""
+            while pos > 0 and tail.count(b"\n") < 2:
+                step = min(4096, pos)
+                pos -= step
+                f.seek(pos)
+                tail = f.read(step) + tail
+        lines = [line for line in tail.splitlines() if line.strip()]
+        return json.loads(lines[-1]) if lines else None
+
+    def appointments(self):
+        if not os.path.exists(self.appointments_path):
+            return
+        with open(self.appointments_path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def _created_offset(self, f, created_since):
+        """
+        Byte offset of the first appointment line created at created_since or
+        later, by bisecting the log (lines are appended in created_at order).
+        """
+        def line_start(pos):
+            # Start of the first line beginning at or after pos
+            if pos:
+                f.seek(pos - 1)
+                f.readline()
+            else:
+                f.seek(0)
+            return f.tell()
+
+        def at_or_after(pos):
+            line_start(pos)
+            line = f.readline()
+            while line.endswith(b"\n") and not line.strip():
+                line = f.readline()
+            return not line.endswith(b"\n") or json.loads(line).get("created_at", "") >= created_since
+
+        low, high = 0, f.seek(0, os.SEEK_END)
+        while low < high:
+            middle = (low + high) // 2
+            if at_or_after(middle):
+                high = middle
+            else:
+                low = middle + 1
+        return line_start(low)
+
+    def upcoming_appointments(self, starts_since, created_since):
+        # No index here: bisect to the requests made within reach of now
+        if not os.path.exists(self.appointments_path):
+            return
+        with open(self.appointments_path, "rb") as f:
+            f.seek(self._created_offset(f, created_since))
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                starts_at = record.get("starts_at")
+                if (starts_at >= starts_since) if starts_at else record.get("created_at", "") >= created_since:
+                    yield record
+
+    def query(self, kind, filters=None, cursor=None, limit=100):
+        filters = filters or {}
+        path = self.appointments_path if kind == "appointments" else self.cancellations_path
+        offset = int(cursor or 0)
+        if offset < 0:
+            raise ValueError(f"Invalid cursor: {cursor}")
+        if not os.path.exists(path):
+            return [], None
+        records = []
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while True:
+                start = f.tell()
+                line = f.readline()
+                # A line without its newline is still being appended
+                if not line.endswith(b"\n"):
+                    return records, None
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if not matches(kind, record, filters):
+                    continue
+                if len(records) == limit:
+                    return records, str(start)
+                records.append(record)
+
+    def tail(self, kind, cursor=None, batch=500):
+        path = self.appointments_path if kind == "appointments" else self.cancellations_path
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            f.seek(int(cursor or 0))
+            while True:
+                line = f.readline()
+                # A line without its newline is still being appended
+                if not line.endswith(b"\n"):
+                    return
+                if line.strip():
+                    yield json.loads(line), str(f.tell())
+
+    def _checkpoint_path(self, name):
+        return os.path.join(self.directory, f"{name}.checkpoint.json")
+
+    def load_checkpoint(self, name):
+        path = self._checkpoint_path(name)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_checkpoint(self, name, state):
+        # Written whole and renamed into place, so a reader never sees half of it
+        path = self._checkpoint_path(name)
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+
+    def migrate_legacy(self, appointments_file, cancellations_file):
+        for log_path, legacy_path in [
+            (self.appointments_path, appointments_file),
+            (self.cancellations_path, cancellations_file),
+        ]:
+            with self._locked(log_path) as f:
+                # Only an empty log is seeded; anything else was already migrated
+                if f.tell() > 0:
+                    continue
+                records = _load_legacy(legacy_path)
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+                if records:
+                    print(f"Migrated {len(records)} records from {legacy_path}")
+
+def open_store(backend=None, data_dir=None, migrate=True) -> Store:
+    """
+    Opens the configured storage backend (STORAGE_BACKEND env, default "sqlite")
+    in data_dir (STORAGE_DIR env, default data/) and runs the one-time
+    migration from the legacy JSON files.
+    """
+    backend = (backend or os.environ.get("STORAGE_BACKEND", "sqlite")).lower()
+    data_dir = data_dir or os.environ.get("STORAGE_DIR", DATA_DIR)
+    if backend == "sqlite":
+        store = SQLiteStore(os.path.join(data_dir, "bookings.db"))
+    elif backend == "jsonl":
+        store = JsonlStore(os.path.join(data_dir, "log"))
+    else:
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+    if migrate:
+        store.migrate_legacy(
+            os.path.join(data_dir, "appointments.json"),
+            os.path.join(data_dir, "cancellations.json"),
+        )
+    return store
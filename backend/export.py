@@ -0,0 +1,54 @@
+"""
+NDJSON and CSV encoding for the records export endpoints.
+
+Both encoders take an iterator of records (Store.export()) and yield one
+line at a time, so a StreamingResponse sends the export without holding it
+in memory.
+"""
+import io
+import csv
+import json
+import re
+
+from db import booking_details
+
+CSV_COLUMNS = {
+    "appointments": ["created_at", "name", "phone", "email", "service", "date", "starts_at", "ip_address"],
+    "cancellations": ["cancelled_at", "reason", "name", "phone", "email", "service", "date", "ip_address"],
+}
+
+# Spreadsheet apps run cells starting with these as formulas
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+PHONE_RE = re.compile(r"[+\-\d\s().]+")
+
+def _cell(value) -> str:
+    if value is None:
+        value = ""
+    elif isinstance(value, list):
+        value = " ".join(str(v) for v in value)
+    else:
+        value = str(value)
+    if value.startswith(FORMULA_PREFIXES) and not PHONE_RE.fullmatch(value):
+        return "'" + value
+    return value
+
+def ndjson_lines(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+def csv_lines(kind, records):
+    columns = CSV_COLUMNS[kind]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(row):
+        writer.writerow(row)
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    yield line(columns)
+    for record in records:
+        details = booking_details(kind, record)
+        yield line([_cell(record.get(c) if c in record else details.get(c)) for c in columns])
@@ -0,0 +1,252 @@
+"""
+Structured clinic facts: opening hours, phone, address and the services
+catalog.
+
+Built once from the scraped site text and the service URL hierarchy
+(scrapper.py writes data/facts.json after each crawl; main.py builds it from
+site.txt if the file is missing). Questions like "what are your hours?" or
+"what's your phone number?" are answered straight from here without
+retrieval or Gemini. The same hours drive appointment validation, and the
+catalog feeds the booking service picker.
+"""
+import os
+import re
+import json
+from collections import Counter
+
+from intent import service_lexicon, service_name
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+FACTS_PATH = os.path.join(project_root, "data", "facts.json")
+
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+# The hours the clinic gave us (previously hardcoded in main.py, prompts.py
+# and the frontend), as [open, close] minutes or None, Monday first
+CLINIC_HOURS = [[600, 1020], [600, 1020], [600, 1020], [660, 1140], [600, 1020], [540, 900], None]
+
+HOURS_LINE_RE = re.compile(
+    r"(Monday|Tuesday|Wednesday|Thursday|Friday|Saturday|Sunday):\s*"
+    r"(Closed|(\d{1,2})(?::(\d{2}))?\s*(AM|PM)\s*[-–]\s*(\d{1,2})(?::(\d{2}))?\s*(AM|PM))",
+    re.IGNORECASE,
+)
+PHONE_RE = re.compile(r"\(?(\d{3})\)?[\s.-]?(\d{3})-(\d{4})")
+
+# Deterministic question patterns. Anything longer than MAX_WORDS, or naming a
+# specific service, is left to retrieval.
+MAX_WORDS = 12
+# "hours" alone also shows up in questions about treatments ("how many hours
+# does a facial take"), so it has to be about the clinic's hours
+HOURS_RE = re.compile(
+    r"^hours\??$|\b(?:(?:your|the|clinic|office|opening|business|working|operating|weekend|"
+    r"(?:mon|tues|wednes|thurs|fri|satur|sun)day) hours|hours of operation|what hours|hours (?:on|today|tomorrow|this)"
+    r"|opening|closing|schedule|open (?:on|today|tomorrow|now|at|until|till|late|early|on weekends)"
+    r"|are you open|is the (?:clinic|office) open|closed on|what time do you (?:open|close))\b"
+)
+DURATION_RE = re.compile(r"\bhow (?:many|long|much)\b")
+PHONE_Q_RE = re.compile(r"\b(?:phone|telephone|call you|number to call|contact (?:number|info|details|you))\b")
+LOCATION_RE = re.compile(r"\b(?:address|located|location|directions|where are you|where is the (?:clinic|office)|where's the (?:clinic|office))\b")
+SERVICES_RE = re.compile(r"\b(?:services|treatments)\b")
+SERVICES_ASK_RE = re.compile(r"\b(?:what|which|list|all|offer|provide|information about)\b")
+
+def _minutes(hour, minute, meridiem):
+    hour = int(hour) % 12 + (12 if meridiem.upper() == "PM" else 0)
+    return hour * 60 + int(minute or 0)
+
+def format_minutes(minutes: int) -> str:
+    hour, minute = divmod(minutes, 60)
+    suffix = "AM" if hour < 12 else "PM"
+    hour = hour % 12 or 12
+    return f"{hour}:{minute:02d} {suffix}" if minute else f"{hour} {suffix}"
+
+def format_hours(hours) -> str:
+    return f"{format_minutes(hours[0])} - {format_minutes(hours[1])}" if hours else "Closed"
+
+def parse_hours(text: str, baseline=None, conflicts=None):
+    """
+    Returns [[open, close] minutes or None] for Monday..Sunday. The site repeats
+    the hours block on every page, occasionally with stale values, so each
+    day takes its most common value. With baseline (hours in the same form,
+    e.g. CLINIC_HOURS), a day keeps its baseline value while any page still
+    lists it, and days the site doesn't list keep theirs too: hours only
+    change when the whole site agrees on the new ones. Each day kept that
+    way is described in the `conflicts` list, if one is passed.
+    """
+    votes = {day: Counter() for day in DAYS}
+    for m in HOURS_LINE_RE.finditer(text):
+        day = m.group(1).capitalize()
+        if m.group(2).lower() == "closed":
+            votes[day][None] += 1
+        else:
+            votes[day][(_minutes(m.group(3), m.group(4), m.group(5)), _minutes(m.group(6), m.group(7), m.group(8)))] += 1
+    hours = []
+    for i, day in enumerate(DAYS):
+        known = tuple(baseline[i]) if baseline and baseline[i] else None
+        if not votes[day]:
+            value = known
+        else:
+            value = votes[day].most_common(1)[0][0]
+            if baseline and value != known and known in votes[day]:
+                if conflicts is not None:
+                    conflicts.append(f"{day}: the site lists {format_hours(value)} on {votes[day][value]} pages and "
+                                     f"{format_hours(known)} on {votes[day][known]}; keeping {format_hours(known)}")
+                value = known
+        hours.append(list(value) if value else None)
+    return hours
+
+def parse_phone(text: str):
+    counts = Counter(m.groups() for m in PHONE_RE.finditer(text))
+    if not counts:
+        return None
+    area, prefix, line = counts.most_common(1)[0][0]
+    return f"({area}) {prefix}-{line}"
+
+def parse_address(text: str):
+    """
+    The lines between "OUR LOCATION" and the phone number in the site footer,
+    e.g. "111 S Washington Ave #205, Park Ridge, IL 60068".
+    """
+    counts = Counter()
+    for m in re.finditer(r"OUR LOCATION\n(.*?)\n(?=\(?\d{3}\)?[\s.-]?\d{3}-\d{4})", text, re.DOTALL):
+        lines = [line.strip() for line in m.group(1).split("\n") if line.strip()]
+        # e.g. ["CN Medical ...", "111 S Washington Ave", "#205", "Park Ridge", ",", "IL", "60068"]
+        lines = [line for line in lines[1:] if line != ","]
+        if len(lines) >= 4:
+            street, city, state_zip = " ".join(lines[:-3]), lines[-3], " ".join(lines[-2:])
+            counts[f"{street}, {city}, {state_zip}"] += 1
+    return counts.most_common(1)[0][0] if counts else None
+
+def build_catalog(urls):
+    """
+    Services grouped by top-level category from the URL hierarchy
+    (/services/<category>/[<group>/]<service>/). Pages with children are
+    groups, not bookable services; a category without children is its own
+    service.
+    """
+    paths = []
+    for url in urls:
+        parts = [p for p in url.split("/") if p]
+        if "services" in parts:
+            path = parts[parts.index("services") + 1:]
+            if path:
+                paths.append(path)
+    parents = {tuple(path[:-1]) for path in paths}
+
+    categories = {}
+    for path in paths:
+        if tuple(path) in parents:
+            continue
+        category = categories.setdefault(path[0], {"category": service_name(path[0]), "services": []})
+        name = service_name(path[-1])
+        if name not in category["services"]:
+            category["services"].append(name)
+    return sorted(categories.values(), key=lambda c: c["category"])
+
+def build_facts(site_text: str, urls, baseline_hours=None, conflicts=None):
+    return {
+        "hours": parse_hours(site_text, baseline_hours, conflicts),
+        "phone": parse_phone(site_text),
+        "address": parse_address(site_text),
+        "catalog": build_catalog(urls),
+    }
+
+def write_facts(facts, path=FACTS_PATH):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(facts, f, indent=2)
+    os.replace(tmp, path)
+
+class ClinicFacts:
+    def __init__(self, facts, service_urls=()):
+        self.hours = facts["hours"]
+        self.phone = facts.get("phone")
+        self.address = facts.get("address")
+        self.catalog = facts.get("catalog", [])
+        aliases = service_lexicon(service_urls)
+        self._service_re = re.compile(
+            r"\b(" + "|".join(re.escape(a) for a in sorted(aliases, key=len, reverse=True)) + r")\b"
+        ) if aliases else None
+        self.answered = Counter()
+
+    def to_dict(self):
+        return {"hours": self.hours, "phone": self.phone, "address": self.address, "catalog": self.catalog}
+
+    # --- Hours ---
+
+    def day_hours(self, weekday: int) -> str:
+        return format_hours(self.hours[weekday])
+
+    def hours_markdown(self) -> str:
+        return "\n".join(f"- **{day}:** {self.day_hours(i)}" for i, day in enumerate(DAYS))
+
+    def check_open(self, dt):
+        """
+        (True, "") if dt falls within opening hours, else (False, reason).
+        """
+        hours = self.hours[dt.weekday()]
+        day = DAYS[dt.weekday()]
+        if not hours:
+            return False, f"We are closed on {day}s. Please choose another day."
+        minutes = dt.hour * 60 + dt.minute
+        if not hours[0] <= minutes < hours[1]:
+            return False, f"On {day}s we are open from {format_minutes(hours[0])} to {format_minutes(hours[1])}."
+        return True, ""
+
+    # --- Deterministic answers ---
+
+    def answer(self, message: str):
+        """
+        Returns a complete answer for hours / phone / address / services-list
+        questions, or None when the question needs retrieval.
+        """
+        text = " ".join(message.lower().replace("’", "'").split())
+        if len(text.split()) > MAX_WORDS:
+            return None
+        names_service = bool(self._service_re and self._service_re.search(text))
+
+        if HOURS_RE.search(text) and not DURATION_RE.search(text) and not names_service and any(self.hours):
+            days = [i for i, day in enumerate(DAYS) if re.search(rf"\b(?:{day.lower()}|{day.lower()[:3]})s?\b", text)]
+            self.answered["hours"] += 1
+            if len(days) == 1:
+                hours = self.day_hours(days[0])
+                if hours == "Closed":
+                    return f"We are closed on {DAYS[days[0]]}s."
+                return f"On {DAYS[days[0]]}s we are open **{hours}**."
+            return f"Our clinic hours are:\n{self.hours_markdown()}"
+
+        if LOCATION_RE.search(text) and self.address:
+            self.answered["location"] += 1
+            reply = f"We are located at **{self.address}**."
+            if self.phone:
+                reply += f" You can reach us at {self.phone}."
+            return reply
+
+        if PHONE_Q_RE.search(text) and self.phone:
+            self.answered["phone"] += 1
+            return f"You can reach us at **{self.phone}**."
+
+        if SERVICES_RE.search(text) and SERVICES_ASK_RE.search(text) and not names_service and self.catalog:
+            self.answered["services"] += 1
+            lines = ["Here are the services we offer:"]
+            for category in self.catalog:
+                lines.append(f"\n**{category['category']}**")
+                lines.extend(f"- {service}" for service in category["services"])
+            lines.append("\nWould you like to know more about any of these, or request an appointment?")
+            return "\n".join(lines)
+
+        return None
+
+    def stats(self):
+        return dict(self.answered)
+
+def load_facts(site_path, service_urls, path=FACTS_PATH, baseline_hours=None):
+    """
+    Loads data/facts.json, or builds the facts from site.txt if it is missing.
+    """
+    if os.path.exists(path):
+        with open(path) as f:
+            facts = json.load(f)
+    else:
+        with open(site_path) as f:
+            facts = build_facts(f.read(), service_urls, baseline_hours)
+    return ClinicFacts(facts, service_urls)
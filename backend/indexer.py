@@ -0,0 +1,210 @@
+"""
+Incremental ingestion pipeline for the FAISS index.
+
+Chunks are identified by a content hash. A run embeds only chunks that are not
+in the currently published index, deletes chunks that disappeared, and
+publishes the result as a new immutable version:
+
+    data/vectors/versions/<version>/   mmap index files + manifest.json (see vectorstore.py)
+    data/vectors/CURRENT               name of the live version
+
+CURRENT is swapped with os.replace, so readers (main.py polls it and
+hot-reloads) never see a half-written index. A plain data/vectors/index.faiss
+from before versioning is still served until the first publish, which
+converts it (and any pickled FAISS version) without re-embedding.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from lexical import bm25_current
+from vectorstore import MmapVectorStore, is_mmap_store, write_store
+
+# langchain is imported inside the functions that need it, so the API server
+# can import current_version() without paying for it at startup.
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+VECTORS_PATH = os.path.join(project_root, "data", "vectors")
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 100
+KEEP_VERSIONS = 3
+
+def chunk_id(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def current_version(vectors_path=VECTORS_PATH):
+    """
+    Returns (version, directory) of the published index. Falls back to the
+    legacy unversioned layout, versioned by file mtime.
+    """
+    pointer = os.path.join(vectors_path, "CURRENT")
+    if os.path.exists(pointer):
+        with open(pointer) as f:
+            version = f.read().strip()
+        return version, os.path.join(vectors_path, "versions", version)
+    legacy = os.path.join(vectors_path, "index.faiss")
+    return f"legacy-{os.path.getmtime(legacy):.0f}", vectors_path
+
+def split_documents(documents):
+    """
+    documents: iterable of (text, metadata). Returns a list of
+    (id, chunk_text, metadata) with duplicate chunks removed; boilerplate
+    shared by many pages (navigation menus) is kept once, under the first source.
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP
+    )
+    chunks = {}
+    for text, metadata in documents:
+        for chunk in splitter.split_text(text):
+            cid = chunk_id(chunk)
+            if cid not in chunks:
+                chunks[cid] = (chunk, metadata)
+    return [(cid, text, metadata) for cid, (text, metadata) in chunks.items()]
+
+# --- Parallel embedding ---
+
+_worker_embeddings = None
+
+def _init_worker():
+    global _worker_embeddings
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    _worker_embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+
+def _embed_batch(texts):
+    return _worker_embeddings.embed_documents(texts)
+
+def embed_texts(texts, embeddings, batch_size=64, workers=1):
+    """
+    Embeds texts in batches. With workers > 1 (and enough work to amortize
+    loading the model in each process) the batches are spread over a
+    process pool.
+    """
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    if workers <= 1 or len(batches) < 2 * workers:
+        vectors = []
+        for batch in batches:
+            vectors.extend(embeddings.embed_documents(batch))
+        return vectors
+
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker) as pool:
+        vectors = []
+        for batch_vectors in pool.map(_embed_batch, batches):
+            vectors.extend(batch_vectors)
+        return vectors
+
+# --- Build + publish ---
+
+def _load_manifest(directory):
+    path = os.path.join(directory, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def load_rows(directory, embeddings=None):
+    """
+    Returns {id: (text, metadata, vector)} for the index in directory, from
+    either the mmap format or a pickled FAISS index written before it (read
+    once here, offline, so upgrading doesn't re-embed anything).
+    """
+    if is_mmap_store(directory):
+        return {cid: (text, metadata, vector) for cid, text, metadata, vector in MmapVectorStore(directory).rows()}
+
+    from langchain_community.vectorstores import FAISS
+    db = FAISS.load_local(directory, embeddings, allow_dangerous_deserialization=True)
+    rows = {}
+    for i, docstore_id in db.index_to_docstore_id.items():
+        doc = db.docstore.search(docstore_id)
+        rows[chunk_id(doc.page_content)] = (doc.page_content, doc.metadata, db.index.reconstruct(int(i)))
+    return rows
+
+def _publish(ids, texts, metadatas, vectors, vectors_path, known_names=()):
+    now = time.time()
+    version = time.strftime("v%Y%m%d-%H%M%S", time.localtime(now)) + f"{int(now * 1000) % 1000:03d}-{os.getpid()}"
+    versions_dir = os.path.join(vectors_path, "versions")
+    staging = os.path.join(versions_dir, f".{version}.tmp")
+    os.makedirs(staging, exist_ok=True)
+
+    write_store(staging, ids, texts, metadatas, vectors, model=EMBEDDING_MODEL, known_names=known_names)
+    os.rename(staging, os.path.join(versions_dir, version))
+
+    pointer_tmp = os.path.join(vectors_path, "CURRENT.tmp")
+    with open(pointer_tmp, "w") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer_tmp, os.path.join(vectors_path, "CURRENT"))
+    return version
+
+def _prune(vectors_path, keep=KEEP_VERSIONS):
+    versions_dir = os.path.join(vectors_path, "versions")
+    live, _ = current_version(vectors_path)
+    versions = sorted(v for v in os.listdir(versions_dir) if not v.startswith("."))
+    for version in versions[:-keep]:
+        if version != live:
+            shutil.rmtree(os.path.join(versions_dir, version), ignore_errors=True)
+
+def build_index(documents, vectors_path=VECTORS_PATH, embeddings=None, full=False, batch_size=64, workers=1, known_names=()):
+    """
+    Upserts documents into the published index and publishes a new version.
+    Returns a summary dict. Nothing is published when the content and
+    known_names (service and product names for BM25, see lexical.py) are
+    unchanged.
+    """
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    started = time.time()
+    embeddings = embeddings or HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    chunks = split_documents(documents)
+    wanted = {cid for cid, _, _ in chunks}
+
+    rows, converted = {}, False
+    has_index = os.path.exists(os.path.join(vectors_path, "CURRENT")) or os.path.exists(os.path.join(vectors_path, "index.faiss"))
+    if not full and has_index:
+        _, directory = current_version(vectors_path)
+        manifest = _load_manifest(directory)
+        if manifest is None or manifest.get("model", EMBEDDING_MODEL) == EMBEDDING_MODEL:
+            rows = load_rows(directory, embeddings)
+            # Older versions are rewritten once in the current format (mmap + BM25)
+            converted = not is_mmap_store(directory) or not bm25_current(directory, known_names)
+
+    new_chunks = [(cid, text, metadata) for cid, text, metadata in chunks if cid not in rows]
+    removed = sorted(set(rows) - wanted)
+
+    if rows and not converted and not new_chunks and not removed:
+        return {"published": None, "added": 0, "removed": 0, "total": len(rows), "seconds": round(time.time() - started, 2)}
+
+    new_vectors = embed_texts([text for _, text, _ in new_chunks], embeddings, batch_size=batch_size, workers=workers)
+    for (cid, text, metadata), vector in zip(new_chunks, new_vectors):
+        rows[cid] = (text, metadata, vector)
+
+    ids = [cid for cid, _, _ in chunks]
+    version = _publish(
+        ids,
+        [rows[cid][0] for cid in ids],
+        [rows[cid][1] for cid in ids],
+        np.asarray([rows[cid][2] for cid in ids], dtype=np.float32),
+        vectors_path,
+        known_names
+    )
+    _prune(vectors_path)
+    return {
+        "published": version,
+        "added": len(new_chunks),
+        "removed": len(removed),
+        "total": len(ids),
+        "seconds": round(time.time() - started, 2),
+    }
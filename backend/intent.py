@@ -0,0 +1,299 @@
+"""
+Deterministic fast path for the booking state machine.
+
+Runs before the LLM calls (llm_interruption / extract_booking_details) and only
+escalates messages it can't decide with confidence:
+- Regex extractors for phone, email and dates, plus a service lexicon built
+  from the scraped service URLs.
+- A nearest-centroid model over the MiniLM embeddings we already load, with
+  "answer" and "question" prototypes. The confidence is the cosine margin
+  between the two centroids.
+"""
+import re
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+# value is None when the classifier defers to the LLM
+Decision = namedtuple("Decision", ["value", "confidence", "source"])
+
+PHONE_RE = re.compile(r"(?<!\w)(?:\+?1[\s.-]?)?\(?\d{3}\)?[\s.-]?\d{3}[\s.-]?\d{4}(?!\w)")
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+DATE_RE = re.compile(
+    r"\b(?:today|tonight|tomorrow|next\s+(?:week|mon|tue|wed|thu|fri|sat)\w*"
+    r"|(?:mon|tues?|wed(?:nes)?|thu(?:rs?)?|fri|sat(?:ur)?)(?:day)?|sunday"
+    r"|(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+\d{1,2}(?:st|nd|rd|th)?(?:,?\s+\d{4})?"
+    r"|\d{4}-\d{2}-\d{2}(?:t\d{2}:\d{2})?"
+    r"|\d{1,2}/\d{1,2}(?:/\d{2,4})?"
+    r"|(?:at\s+)?\d{1,2}(?::\d{2})?\s*(?:am|pm)"
+    r"|at\s+\d{1,2}(?::\d{2})?"
+    r"|morning|afternoon|evening|noon)\b(?:,?\s+\d{4})?",
+    re.IGNORECASE,
+)
+NAME_RE = re.compile(r"\bmy name is ([a-z][a-z'-]*(?: [a-z][a-z'-]*)?)", re.IGNORECASE)
+
+QUESTION_START_RE = re.compile(
+    r"^(?:what|where|when|who|whom|why|how|which|is|are|do|does|did|can|could|will|would|should|may)\b",
+    re.IGNORECASE,
+)
+# Asking to change or drop the booking ("can I change the date?") is phrased
+# as a question but is an answer to the flow: main.py's edit / cancel
+# handling takes it from there.
+EDIT_REQUEST_RE = re.compile(
+    r"\b(?:edit|change|modify|update|correct|wrong|cancel|stop|abort|quit)\b", re.IGNORECASE
+)
+# States whose question is itself about changing the booking; a question-form
+# reply there is left to the centroids / LLM
+REVIEW_STATES = {"CONFIRM", "ASK_EDIT_FIELD"}
+
+# Words that carry no booking information; anything else left over after
+# extraction means the message may say something we didn't understand.
+FILLER_WORDS = {
+    "i", "id", "im", "i'd", "i'm", "a", "an", "the", "to", "for", "me", "my", "please", "want", "would",
+    "like", "need", "can", "could", "you", "we", "book", "booking", "appointment", "appointments",
+    "schedule", "visit", "reservation", "make", "set", "up", "get", "on", "at", "in", "some",
+    "yes", "yeah", "yep", "sure", "ok", "okay", "y", "go", "ahead", "arrange", "call", "quick",
+    "consultation", "session", "and", "with", "of", "hi", "hello", "hey", "thanks", "thank",
+}
+
+# References that need conversation context to resolve ("book this")
+REFERENCE_WORDS = {"this", "that", "it", "these", "those", "same", "them"}
+
+ACRONYMS = {"ipl", "rh", "prp", "co2", "tmj", "iv", "rf", "pca"}
+
+# Slug words that are too generic to identify a service on their own
+GENERIC_WORDS = {
+    "services", "service", "laser", "lasers", "skin", "and", "facials", "facial", "treatments", "treatment",
+    "medical", "targeted", "concerns", "regenerative", "medicine", "wellness", "weight", "loss",
+    "fillers", "filler", "injectables", "injectable", "intense", "pulse", "light", "age", "sun",
+    "anti", "aging", "signature", "vitamin", "injections", "chemical", "hair", "for", "removal",
+    "lip", "damage", "spots", "therapy", "tightening", "dermal",
+}
+
+ANSWER_PROTOTYPES = [
+    "John Smith",
+    "my name is Sarah",
+    "it's 555 123 4567",
+    "you can reach me at john@example.com",
+    "tomorrow at 5 pm",
+    "next Monday morning works for me",
+    "I'd like botox please",
+    "a facial",
+    "lip filler",
+    "yes that's correct",
+    "the date is wrong",
+    "I found a cheaper option",
+    "I don't need it anymore",
+    "I want to change the service",
+]
+
+QUESTION_PROTOTYPES = [
+    "where is the clinic located",
+    "what are your hours",
+    "how much does botox cost",
+    "who are you",
+    "do you offer dermal fillers",
+    "what is microneedling",
+    "is the treatment painful",
+    "can you tell me about your services",
+    "how long does a facial take",
+    "do you accept insurance",
+    "what's the difference between botox and dysport",
+    "are there any side effects",
+]
+
+# Which slot regex answers which booking state
+STATE_SLOTS = {
+    "ASK_PHONE": PHONE_RE,
+    "ASK_EMAIL": EMAIL_RE,
+    "ASK_DATE": DATE_RE,
+}
+
+def service_name(slug: str) -> str:
+    """
+    "botox-cosmetic" -> "Botox Cosmetic", "intense-pulse-light-ipl" -> "Intense Pulse Light IPL".
+    """
+    return " ".join(w.upper() if w in ACRONYMS else w if w in ("and", "for") else w.capitalize() for w in slug.split("-"))
+
+def service_lexicon(urls):
+    """
+    Builds alias -> service name from service page URLs, e.g.
+    .../neuromodulators-toxins/botox-cosmetic/ -> {"botox cosmetic": "Botox Cosmetic", "botox": ...}.
+    Aliases shared by more than one service are dropped as ambiguous.
+    """
+    candidates = {}
+    for url in urls:
+        parts = [p for p in url.split("/") if p]
+        if "services" not in parts or parts[-1] == "services":
+            continue
+        words = parts[-1].split("-")
+        name = service_name(parts[-1])
+        aliases = {" ".join(words)}
+        distinct = [w for w in words if w not in GENERIC_WORDS and len(w) > 2]
+        if distinct:
+            aliases.add(distinct[0])
+        for alias in aliases:
+            candidates.setdefault(alias, set()).add(name)
+    return {alias: names.pop() for alias, names in candidates.items() if len(names) == 1}
+
+class IntentClassifier:
+    def __init__(self, embed_documents, service_urls=(), min_margin=0.1):
+        self.embed_documents = embed_documents
+        self.min_margin = min_margin
+        self.services = service_lexicon(service_urls)
+        # Longest alias first so "botox cosmetic" wins over "botox"
+        self._service_re = re.compile(
+            r"\b(" + "|".join(re.escape(a) for a in sorted(self.services, key=len, reverse=True)) + r")\b"
+        ) if self.services else None
+
+        self._centroids = None
+        self._centroid_lock = threading.Lock()
+        self.counts = {
+            "interruption": {"fast": 0, "escalated": 0},
+            "extraction": {"fast": 0, "escalated": 0},
+        }
+        self._confidence_sum = 0.0
+
+    # --- Slot extraction ---
+
+    def find_services(self, text: str):
+        if not self._service_re:
+            return []
+        found = []
+        for alias in self._service_re.findall(text.lower()):
+            name = self.services[alias]
+            if name not in found:
+                found.append(name)
+        return found
+
+    def extract_slots(self, message: str) -> dict:
+        slots = {}
+        email = EMAIL_RE.search(message)
+        if email:
+            slots["email"] = email.group(0)
+        # Mask the email first so digits inside it aren't read as a phone number
+        rest = EMAIL_RE.sub(" ", message)
+        phone = PHONE_RE.search(rest)
+        if phone:
+            slots["phone"] = phone.group(0).strip()
+            rest = rest.replace(phone.group(0), " ")
+        dates = [m.group(0).strip() for m in DATE_RE.finditer(rest)]
+        if dates:
+            slots["date"] = " ".join(dates)
+        name = NAME_RE.search(rest)
+        if name:
+            slots["name"] = name.group(1).title()
+        services = self.find_services(rest)
+        if len(services) == 1:
+            slots["service"] = services[0]
+        return slots
+
+    def _residual_words(self, message: str, slots: dict):
+        text = EMAIL_RE.sub(" ", message.lower())
+        text = PHONE_RE.sub(" ", text)
+        text = DATE_RE.sub(" ", text)
+        text = NAME_RE.sub(" ", text)
+        if self._service_re:
+            text = self._service_re.sub(" ", text)
+        return [w for w in re.findall(r"[a-z0-9']+", text) if w not in FILLER_WORDS]
+
+    def extract(self, message: str, context: str = "") -> Decision:
+        """
+        Extracts booking details without the LLM when every word of the message
+        is accounted for. References like "book this" fall back to the service
+        in the latest user turn of the context, if exactly one is named there.
+        """
+        slots = self.extract_slots(message)
+        residual = self._residual_words(message, slots)
+        references = [w for w in residual if w in REFERENCE_WORDS]
+        unknown = [w for w in residual if w not in REFERENCE_WORDS]
+
+        if unknown or len(self.find_services(message)) > 1:
+            return self._record("extraction", Decision(None, 0.0, "ambiguous"))
+
+        if "service" not in slots:
+            for line in reversed(context.split("\n")):
+                if not line.startswith("User:"):
+                    continue
+                services = self.find_services(line)
+                if len(services) > 1:
+                    return self._record("extraction", Decision(None, 0.0, "ambiguous_context"))
+                if services:
+                    slots["service"] = services[0]
+                    break
+            if references and "service" not in slots:
+                return self._record("extraction", Decision(None, 0.0, "unresolved_reference"))
+
+        result = {k: slots.get(k) for k in ("name", "phone", "email", "service", "date")}
+        return self._record("extraction", Decision(result, 1.0, "rules"))
+
+    # --- Interruption detection ---
+
+    def _ensure_centroids(self):
+        if self._centroids is None:
+            with self._centroid_lock:
+                if self._centroids is None:
+                    vectors = np.asarray(self.embed_documents(ANSWER_PROTOTYPES + QUESTION_PROTOTYPES), dtype=np.float32)
+                    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+                    answer = vectors[:len(ANSWER_PROTOTYPES)].mean(axis=0)
+                    question = vectors[len(ANSWER_PROTOTYPES):].mean(axis=0)
+                    self._centroids = np.stack([answer / np.linalg.norm(answer), question / np.linalg.norm(question)])
+        return self._centroids
+
+    def warm(self):
+        """
+        Builds the centroids ahead of the first booking turn.
+        """
+        self._ensure_centroids()
+
+    def interruption(self, message: str, state: str, use_embeddings: bool = True) -> Decision:
+        """
+        Decides whether an in-flow message is a side question (True) or the
+        answer to the current booking question (False). Rules first, then the
+        embedding centroids; value is None when the LLM should decide.
+        use_embeddings=False skips the centroid step (model not loaded yet).
+        """
+        text = message.strip()
+        slot_re = STATE_SLOTS.get(state)
+        asks = text.endswith("?") or bool(QUESTION_START_RE.match(text))
+
+        if slot_re and slot_re.search(text) and not asks:
+            return self._record("interruption", Decision(False, 1.0, "slot_match"))
+        if state == "ASK_SERVICE" and self.find_services(text) and not asks:
+            return self._record("interruption", Decision(False, 1.0, "service_match"))
+        if EDIT_REQUEST_RE.search(text):
+            return self._record("interruption", Decision(False, 0.9, "edit_request"))
+        if (asks and state not in REVIEW_STATES
+                and not (slot_re and slot_re.search(text)) and not self.find_services(text)):
+            return self._record("interruption", Decision(True, 0.9, "question_form"))
+        if not use_embeddings:
+            return self._record("interruption", Decision(None, 0.0, "model_cold"))
+
+        vector = np.asarray(self.embed_documents([text])[0], dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        answer_sim, question_sim = self._ensure_centroids() @ vector
+        margin = float(abs(question_sim - answer_sim))
+        if margin < self.min_margin:
+            return self._record("interruption", Decision(None, margin, "centroid"))
+        return self._record("interruption", Decision(bool(question_sim > answer_sim), margin, "centroid"))
+
+    # --- Stats ---
+
+    def _record(self, task, decision):
+        if decision.value is None:
+            self.counts[task]["escalated"] += 1
+        else:
+            self.counts[task]["fast"] += 1
+            self._confidence_sum += decision.confidence
+        return decision
+
+    def stats(self):
+        out = {}
+        fast_total = 0
+        for task, c in self.counts.items():
+            total = c["fast"] + c["escalated"]
+            fast_total += c["fast"]
+            out[task] = dict(c, escalation_rate=round(c["escalated"] / total, 4) if total else 0.0)
+        out["mean_fast_confidence"] = round(self._confidence_sum / fast_total, 4) if fast_total else 0.0
+        return out
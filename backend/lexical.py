@@ -0,0 +1,182 @@
+"""
+BM25 inverted index over the chunks of a published index version.
+
+Built by rag.py next to the vectors (see vectorstore.write_store) and
+memory-mapped the same way:
+
+    bm25_terms.json     avgdl, names -> rows, term -> [postings offset, document frequency]
+    bm25_rows.i32       row ids of all postings lists, concatenated
+    bm25_tf.u16         term frequency of each posting
+    bm25_doclen.i32     token count of each row
+
+Dense retrieval misses exact product names ("Jeuveau", "Kybella", "RH filler");
+BM25 catches them. Names come from the clinic's services catalog (rag.py
+passes them in) and from provider names ("Dr. Lutin"), keeping only words the
+site never writes in lowercase, so "removal" or "tightening" never count.
+For each name, only the chunks mentioning it outside lines repeated across
+the site (navigation menus, footers) are recorded. name_rows() lets the
+retriever short-circuit to the chunks that mention every name in the query.
+"""
+import os
+import re
+import json
+import math
+from collections import Counter
+
+import numpy as np
+
+TERMS_FILE = "bm25_terms.json"
+# Bumped when names are chosen differently, so indexer.py rewrites old versions
+NAMES_FORMAT = 2
+K1 = 1.2
+B = 0.75
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "with", "is", "are", "was", "be", "it",
+    "this", "that", "you", "your", "we", "our", "us", "i", "me", "my", "do", "does", "can", "what", "how",
+    "at", "by", "from", "as", "about", "if", "will", "any", "have", "has", "there", "which", "who", "where",
+    "when", "why", "get", "much", "many", "offer", "tell",
+}
+
+def tokenize(text: str):
+    return [t for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in STOPWORDS and (len(t) > 1 or t.isdigit())]
+
+PROVIDER_RE = re.compile(r"\b(?:Dr|Doctor|RN|NP|APRN)\.?\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)?)")
+LOWERCASE_WORD_RE = re.compile(r"\b[a-z][a-z0-9]*\b")
+
+def _lines(text):
+    return {line.strip() for line in text.split("\n") if line.strip()}
+
+def find_names(texts, postings, max_df, known=()):
+    """
+    Returns {name: rows}. Candidates are the words of `known` (service and
+    product names) and provider names; a candidate is a name if the texts
+    never write it in lowercase and at most max_df chunks contain it. Its
+    rows are the chunks that mention it in a line not repeated across the
+    site, so a navigation menu listing every product doesn't count.
+    """
+    candidates = {t for name in known for t in tokenize(name)}
+    lowercase = set()
+    for text in texts:
+        candidates.update(t for match in PROVIDER_RE.finditer(text) for t in tokenize(match.group(1)))
+        lowercase.update(LOWERCASE_WORD_RE.findall(text))
+    names = {
+        t for t in candidates
+        if t not in lowercase and not t.isdigit() and t in postings and len(postings[t]) <= max_df
+    }
+
+    row_lines = [_lines(text) for text in texts]
+    line_df = Counter(line for lines in row_lines for line in lines)
+    repeated = max(3, len(texts) // 100)
+    rows = {name: [] for name in names}
+    for row, lines in enumerate(row_lines):
+        content = {t for line in lines if line_df[line] < repeated for t in tokenize(line)}
+        for name in names & content:
+            rows[name].append(row)
+    return {name: rows[name] for name in sorted(names)}
+
+def write_bm25(directory, texts, known_names=()):
+    """
+    known_names: service and product names from the clinic's catalog.
+    """
+    postings = {}
+    doc_len = np.zeros(len(texts), dtype=np.int32)
+    for row, text in enumerate(texts):
+        tokens = tokenize(text)
+        doc_len[row] = len(tokens)
+        for term, tf in Counter(tokens).items():
+            postings.setdefault(term, []).append((row, tf))
+    names = find_names(texts, postings, max_df=max(2, len(texts) // 5), known=known_names)
+
+    terms, rows, tfs = {}, [], []
+    for term in sorted(postings):
+        terms[term] = [len(rows), len(postings[term])]
+        for row, tf in postings[term]:
+            rows.append(row)
+            tfs.append(min(tf, 65535))
+
+    np.asarray(rows, dtype=np.int32).tofile(os.path.join(directory, "bm25_rows.i32"))
+    np.asarray(tfs, dtype=np.uint16).tofile(os.path.join(directory, "bm25_tf.u16"))
+    doc_len.tofile(os.path.join(directory, "bm25_doclen.i32"))
+    avgdl = float(doc_len.mean()) if len(texts) else 0.0
+    with open(os.path.join(directory, TERMS_FILE), "w") as f:
+        json.dump({
+            "avgdl": avgdl, "names_format": NAMES_FORMAT, "known_names": sorted(set(known_names)),
+            "names": names, "terms": terms,
+        }, f)
+
+def has_bm25(directory) -> bool:
+    return os.path.exists(os.path.join(directory, TERMS_FILE))
+
+def bm25_current(directory, known_names=()) -> bool:
+    """
+    True if directory has a BM25 index whose names were found the current
+    way from the same known names.
+    """
+    if not has_bm25(directory):
+        return False
+    with open(os.path.join(directory, TERMS_FILE)) as f:
+        data = json.load(f)
+    return data.get("names_format") == NAMES_FORMAT and data.get("known_names") == sorted(set(known_names))
+
+def _map(path, dtype, count):
+    if not count:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+class BM25Index:
+    def __init__(self, directory, count):
+        with open(os.path.join(directory, TERMS_FILE)) as f:
+            data = json.load(f)
+        self.avgdl = data["avgdl"] or 1.0
+        self.terms = data["terms"]
+        # name -> rows mentioning it outside boilerplate; older versions
+        # stored a list of names, whose rows are all their postings
+        names = data.get("names", {})
+        self.names = names if isinstance(names, dict) else {name: None for name in names}
+        self.count = count
+        postings = sum(df for _, df in self.terms.values())
+        self.rows = _map(os.path.join(directory, "bm25_rows.i32"), np.int32, postings)
+        self.tf = _map(os.path.join(directory, "bm25_tf.u16"), np.uint16, postings)
+        self.doc_len = _map(os.path.join(directory, "bm25_doclen.i32"), np.int32, count)
+
+    def _postings(self, term):
+        offset, df = self.terms[term]
+        return self.rows[offset:offset + df], self.tf[offset:offset + df]
+
+    def scores(self, query: str):
+        """
+        BM25 score of every row for the query (dense array, one entry per row).
+        """
+        scores = np.zeros(self.count, dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term not in self.terms:
+                continue
+            rows, tf = self._postings(term)
+            df = len(rows)
+            idf = math.log(1 + (self.count - df + 0.5) / (df + 0.5))
+            tf = tf.astype(np.float32)
+            norm = K1 * (1 - B + B * self.doc_len[rows] / self.avgdl)
+            scores[rows] += idf * tf * (K1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query: str, k: int = 4):
+        scores = self.scores(query)
+        hits = np.flatnonzero(scores)
+        top = hits[np.argsort(-scores[hits])][:k]
+        return [(int(row), float(scores[row])) for row in top]
+
+    def name_rows(self, query: str, scores=None):
+        """
+        Rows mentioning every name in the query ("Jeuveau", "Kybella"), best
+        BM25 score first. Empty when the query names nothing.
+        """
+        names = [t for t in set(tokenize(query)) if t in self.names]
+        if not names:
+            return []
+        scores = self.scores(query) if scores is None else scores
+        rows = None
+        for term in names:
+            term_rows = self._postings(term)[0] if self.names[term] is None else np.asarray(self.names[term], dtype=np.int32)
+            rows = term_rows if rows is None else np.intersect1d(rows, term_rows)
+        return [int(row) for row in rows[np.argsort(-scores[rows])]]
@@ -0,0 +1,399 @@
+"""
+Gateway for every Gemini call.
+
+main.py never calls the model directly; llm_ainvoke() and the streaming
+endpoint go through LLMGateway, which adds:
+- per-call-site deadlines, and a timeout on each attempt within them;
+- retries with full-jitter exponential backoff, for transient failures only
+  (timeouts, connection errors, 408/429/5xx);
+- optional hedging: when an attempt is slower than the call site's recent
+  p95, a second identical request is sent and the first answer wins;
+- a circuit breaker that, after consecutive failures, rejects calls for a
+  while and lets one probe through to test recovery. Callers that pass a
+  `fallback` get it back as a degraded response instead of an exception;
+- the concurrency limit (LLM_CONCURRENCY) and per-call-site metrics.
+
+GeminiClient talks to the generateContent REST API over one pooled
+httpx.AsyncClient. It has the same ainvoke/astream interface as the
+LangChain chat model, so either can sit behind the gateway, and its base URL
+can point at a local fake server (see verify_llm_gateway.py).
+"""
+import json
+import time
+import random
+import asyncio
+from collections import deque
+
+import httpx
+
+import metrics
+from metrics import span
+
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com"
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+class LLMHTTPError(Exception):
+    def __init__(self, status_code, body=""):
+        super().__init__(f"HTTP {status_code}: {body[:200]}")
+        self.status_code = status_code
+
+class LLMUnavailable(Exception):
+    """
+    The circuit is open, or the call failed after all retries.
+    """
+
+class LLMResponse:
+    """
+    A reply (or streamed chunk) with the attributes main.py reads from
+    LangChain messages: content and usage_metadata.
+    """
+    def __init__(self, content, usage_metadata=None, degraded=False):
+        self.content = content
+        self.usage_metadata = usage_metadata
+        self.degraded = degraded
+
+    def __add__(self, other):
+        # Gemini reports cumulative usage on each streamed chunk
+        return LLMResponse(self.content + other.content, other.usage_metadata or self.usage_metadata, self.degraded)
+
+def is_retryable(error) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    # LLMHTTPError, and google.api_core errors from the LangChain client
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS
+    return not isinstance(error, (LLMUnavailable, ValueError, TypeError))
+
+# --- Gemini REST client ---
+
+def _parse_response(data) -> LLMResponse:
+    text = []
+    for candidate in (data.get("candidates") or [])[:1]:
+        for part in (candidate.get("content") or {}).get("parts") or []:
+            if not part.get("thought"):
+                text.append(part.get("text", ""))
+    usage = data.get("usageMetadata")
+    if usage:
+        input_tokens = usage.get("promptTokenCount", 0)
+        output_tokens = usage.get("candidatesTokenCount", 0) + usage.get("thoughtsTokenCount", 0)
+        usage = {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+    return LLMResponse("".join(text), usage)
+
+class GeminiClient:
+    def __init__(self, model, api_key, base_url=GEMINI_BASE_URL, temperature=0, max_connections=64, timeout=60.0):
+        self.model = model
+        self.api_key = api_key
+        self.base_url = base_url
+        self.temperature = temperature
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._client = None
+
+    @property
+    def client(self):
+        # Created on first use so it binds to the server's event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"x-goog-api-key": self.api_key or ""},
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                timeout=httpx.Timeout(self.timeout, connect=5.0),
+            )
+        return self._client
+
+    def _body(self, prompt):
+        return {
+            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+            "generationConfig": {"temperature": self.temperature},
+        }
+
+    async def ainvoke(self, prompt, **kwargs):
+        r = await self.client.post(f"/v1beta/models/{self.model}:generateContent", json=self._body(prompt))
+        if r.status_code >= 400:
+            raise LLMHTTPError(r.status_code, r.text)
+        return _parse_response(r.json())
+
+    async def astream(self, prompt, **kwargs):
+        async with self.client.stream(
+            "POST", f"/v1beta/models/{self.model}:streamGenerateContent", params={"alt": "sse"}, json=self._body(prompt)
+        ) as r:
+            if r.status_code >= 400:
+                raise LLMHTTPError(r.status_code, (await r.aread()).decode("utf-8", "replace"))
+            async for line in r.aiter_lines():
+                if line.startswith("data:"):
+                    yield _parse_response(json.loads(line[5:]))
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+# --- Circuit breaker ---
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failed attempts. After
+    `reset_seconds` it is half-open: one probe attempt is let through, and
+    its outcome closes or re-opens the circuit.
+    """
+    def __init__(self, failure_threshold=5, reset_seconds=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.opens = 0
+        self._probe_at = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open":
+            # One probe at a time; a probe that never reports back expires
+            now = time.monotonic()
+            if self._probe_at is None or now - self._probe_at >= self.reset_seconds:
+                self._probe_at = now
+                return True
+        return False
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self._probe_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._probe_at is not None:
+                self.opens += 1
+            self.opened_at = time.monotonic()
+            self._probe_at = None
+
+# --- Gateway ---
+
+class LLMGateway:
+    def __init__(self, get_client, concurrency=64, deadline=30.0, deadlines=None, attempt_timeout=15.0,
+                 retries=2, backoff=0.25, backoff_cap=2.0, hedge=False, hedge_min_samples=20, breaker=None):
+        """
+        get_client returns the model client (GeminiClient or a LangChain chat
+        model); it is called on every attempt, so the client can be swapped.
+        deadlines overrides the overall deadline (seconds) per call site.
+        """
+        self.get_client = get_client
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.deadlines = dict(deadlines or {})
+        self.attempt_timeout = attempt_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_cap = backoff_cap
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self._latencies = {}
+        self._semaphore = None
+
+    def semaphore(self):
+        # Created lazily so it binds to the server's running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    def deadline_for(self, call_site: str) -> float:
+        return self.deadlines.get(call_site, self.deadline)
+
+    def hedge_delay(self, call_site: str):
+        """
+        p95 of the call site's recent successful attempts, or None when
+        hedging is off or there are too few samples.
+        """
+        samples = self._latencies.get(call_site)
+        if not self.hedge or not samples or len(samples) < self.hedge_min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_cap, self.backoff * 2 ** attempt))
+
+    async def _attempt(self, prompt, call_site, kind, timeout):
+        started = time.perf_counter()
+        try:
+            res = await asyncio.wait_for(self.get_client().ainvoke(prompt), timeout)
+        except asyncio.CancelledError:
+            metrics.llm_attempts.inc(call_site=call_site, kind=kind, outcome="cancelled")
+            raise
+        except asyncio.TimeoutError:
+            self.breaker.failure()
+            metrics.llm_attempts.inc(call_site=call_site, kind=kind, outcome="timeout")
+            raise
+        except Exception as e:
+            if is_retryable(e):
+                self.breaker.failure()
+            metrics.llm_attempts.inc(call_site=call_site, kind=kind, outcome="error")
+            raise
+        self.breaker.success()
+        self._latencies.setdefault(call_site, deque(maxlen=200)).append(time.perf_counter() - started)
+        metrics.llm_attempts.inc(call_site=call_site, kind=kind, outcome="ok")
+        return res
+
+    async def _hedged(self, prompt, call_site, kind, timeout):
+        delay = self.hedge_delay(call_site)
+        if delay is None or delay >= timeout:
+            return await self._attempt(prompt, call_site, kind, timeout)
+
+        primary = asyncio.ensure_future(self._attempt(prompt, call_site, kind, timeout))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not self.breaker.allow():
+            return await primary
+
+        pending = {primary, asyncio.ensure_future(self._attempt(prompt, call_site, "hedge", timeout - delay))}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _call(self, prompt, call_site):
+        deadline = time.perf_counter() + self.deadline_for(call_site)
+        error = None
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                raise LLMUnavailable(f"circuit open ({call_site})") from error
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                return await self._hedged(prompt, call_site, "retry" if attempt else "primary", min(self.attempt_timeout, remaining))
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                error = e
+            if attempt < self.retries:
+                pause = self._backoff(attempt)
+                if time.perf_counter() + pause >= deadline:
+                    break
+                await asyncio.sleep(pause)
+        raise LLMUnavailable(f"{call_site} failed: {error!r}") from error
+
+    async def invoke(self, prompt: str, call_site: str = "rag_answer", fallback: str = None):
+        """
+        One logical LLM call. With a fallback, failures return
+        LLMResponse(fallback, degraded=True) instead of raising.
+        """
+        async with self.semaphore():
+            with span(f"llm:{call_site}"):
+                try:
+                    res = await self._call(prompt, call_site)
+                except Exception as e:
+                    if fallback is None:
+                        metrics.record_llm_call(call_site, outcome="rejected" if isinstance(e, LLMUnavailable) else "error")
+                        raise
+                    print(f"LLM call {call_site} degraded: {e}")
+                    metrics.record_llm_call(call_site, outcome="degraded")
+                    return LLMResponse(fallback, degraded=True)
+        metrics.record_llm_call(call_site, response=res)
+        return res
+
+    async def _first_chunk(self, prompt, call_site, deadline):
+        """
+        Opens a stream and waits for its first chunk, retrying like _call().
+        Returns (stream, first chunk or None if the stream was empty).
+        """
+        error = None
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                raise LLMUnavailable(f"circuit open ({call_site})") from error
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            kind = "retry" if attempt else "primary"
+            stream = self.get_client().astream(prompt)
+            try:
+                first = await asyncio.wait_for(stream.__anext__(), min(self.attempt_timeout, remaining))
+            except StopAsyncIteration:
+                first = None
+            except Exception as e:
+                await stream.aclose()
+                if not isinstance(e, asyncio.TimeoutError) and not is_retryable(e):
+                    metrics.llm_attempts.inc(call_site=call_site, kind=kind, outcome="error")
+                    raise
+                self.breaker.failure()
+                metrics.llm_attempts.inc(call_site=call_site, kind=kind, outcome="timeout" if isinstance(e, asyncio.TimeoutError) else "error")
+                error = e
+                if attempt < self.retries:
+                    pause = self._backoff(attempt)
+                    if time.perf_counter() + pause >= deadline:
+                        break
+                    await asyncio.sleep(pause)
+                continue
+            self.breaker.success()
+            metrics.llm_attempts.inc(call_site=call_site, kind=kind, outcome="ok")
+            return stream, first
+        raise LLMUnavailable(f"{call_site} failed: {error!r}") from error
+
+    async def stream(self, prompt: str, call_site: str = "rag_answer", fallback: str = None):
+        """
+        Yields the chunks of a streamed reply. Retries only until the first
+        chunk arrives (nothing has reached the user yet); after that each
+        chunk must arrive before the call's deadline. Not hedged.
+        """
+        deadline = time.perf_counter() + self.deadline_for(call_site)
+        async with self.semaphore():
+            with span(f"llm:{call_site}"):
+                try:
+                    stream, chunk = await self._first_chunk(prompt, call_site, deadline)
+                except Exception as e:
+                    if fallback is None:
+                        metrics.record_llm_call(call_site, outcome="rejected" if isinstance(e, LLMUnavailable) else "error")
+                        raise
+                    print(f"LLM stream {call_site} degraded: {e}")
+                    metrics.record_llm_call(call_site, outcome="degraded")
+                    yield LLMResponse(fallback, degraded=True)
+                    return
+
+                merged = None
+                try:
+                    while chunk is not None:
+                        # Merging chunks accumulates usage metadata for token counts
+                        merged = chunk if merged is None else merged + chunk
+                        yield chunk
+                        try:
+                            chunk = await asyncio.wait_for(stream.__anext__(), max(0.0, deadline - time.perf_counter()))
+                        except StopAsyncIteration:
+                            chunk = None
+                except Exception:
+                    metrics.record_llm_call(call_site, outcome="error")
+                    raise
+                finally:
+                    await stream.aclose()
+        metrics.record_llm_call(call_site, response=merged)
+
+    def stats(self):
+        hedge_delays = {}
+        for call_site in self._latencies:
+            delay = self.hedge_delay(call_site)
+            if delay is not None:
+                hedge_delays[call_site] = round(delay * 1000, 1)
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "circuit_opens": self.breaker.opens,
+            "hedge_delay_ms": hedge_delays,
+        }
@@ -1,15 +1,40 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from pydantic import BaseModel
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from prompts import SYSTEM_PROMPT
+from db import open_store
+from export import ndjson_lines, csv_lines
+from cache import SemanticCache, EmbeddingCache
+from intent import IntentClassifier
+from scrapper import URLS, SITE_PATH
+from facts import CLINIC_HOURS, load_facts
+from availability import Calendar, normalize, format_slot, plain_service
+from rollups import ReasonClusters, CancellationRollups, UNCLASSIFIED
+from tenants import Tenant, TenantRegistry, IndexPool, UnknownTenant, DEFAULT_TENANT
+from admission import RateLimiter, AdmissionController, Overloaded, retry_after_header
+from context import build_rag_prompt, conversation_context, fold_history
+from planner import build_planner_prompt, parse_plan
+from sessions import open_session_store
+from indexer import EMBEDDING_MODEL
+from vectorstore import MmapVectorStore, is_mmap_store
+from batcher import MicroBatcher
+from llm_gateway import LLMGateway, GeminiClient, CircuitBreaker, GEMINI_BASE_URL
+import metrics
+from metrics import span
 import os
+import hmac
 import json
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 import re
 import random
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 app = FastAPI()
@@ -20,6 +45,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # So the widget can honor 429/503 backoff
+    expose_headers=["Retry-After"],
 )
 
 # Construct absolute path to data/vectors
@@ -32,24 +59,399 @@ load_dotenv(os.path.join(project_root, ".env"))
 if not os.environ.get("GOOGLE_API_KEY") and os.environ.get("GEMINI_API_KEY"):
     os.environ["GOOGLE_API_KEY"] = os.environ.get("GEMINI_API_KEY")
 
-embeddings = HuggingFaceEmbeddings(
-    model_name="all-MiniLM-L6-v2"
+# --- Lazily loaded components ---
+# The embedding model, the default tenant's index and the Gemini client are not
+# built at import time, so the server accepts requests immediately. warm_up()
+# loads them in the background on startup (or on the first request that needs
+# them) and `readiness` reports their state at GET /ready. Other tenants'
+# indexes load on their first question (see tenants.py).
+
+embeddings = None
+llm = None
+
+readiness = {"embeddings": "pending", "index": "pending", "warmup": "pending"}
+_embeddings_lock = threading.Lock()
+_warmup_task = None
+
+# Run a dummy embed + search (and build the intent centroids) before reporting ready
+PREWARM = os.environ.get("PREWARM", "1") == "1"
+# How long a request that needs the index waits for it before getting a 503
+READY_WAIT_SECONDS = float(os.environ.get("READY_WAIT_SECONDS", "10"))
+
+def load_embeddings():
+    global embeddings
+    with _embeddings_lock:
+        if embeddings is None:
+            readiness["embeddings"] = "loading"
+            from langchain_community.embeddings import HuggingFaceEmbeddings
+            embeddings = HuggingFaceEmbeddings(
+                model_name=EMBEDDING_MODEL
+            )
+            readiness["embeddings"] = "ready"
+    return embeddings
+
+def open_index(directory):
+    """
+    Opens a published index. Versions written by rag.py are memory-mapped
+    (see vectorstore.py); only the legacy pickled FAISS layout still needs
+    unsafe deserialization, until the next rag.py run converts it.
+    """
+    if is_mmap_store(directory):
+        return MmapVectorStore.load(directory)
+    print(f"Loading legacy pickled index from {directory}; run rag.py to convert it")
+    from langchain_community.vectorstores import FAISS
+    return FAISS.load_local(
+        directory,
+        load_embeddings(),
+        allow_dangerous_deserialization=True
+    )
+
+# Resident tenant indexes, least recently used evicted beyond INDEX_POOL_MB.
+# Each entry's version identifies the loaded index; cached answers are dropped
+# when it changes. rag.py publishes new versions and reload_index_loop() swaps
+# them in.
+index_pool = IndexPool(open_index, budget_mb=float(os.environ.get("INDEX_POOL_MB", "1024")))
+
+def load_index():
+    """
+    Loads the default tenant's index at warm-up.
+    """
+    load_embeddings()
+    if readiness["index"] != "ready":
+        readiness["index"] = "loading"
+    entry = index_pool.load(DEFAULT_TENANT, vectors_path)
+    readiness["index"] = "ready"
+    return entry.index
+
+# LLM client behind the gateway: "rest" (pooled REST client, see llm_gateway.py)
+# or "langchain" (ChatGoogleGenerativeAI, with its own retries turned off)
+LLM_CLIENT = os.environ.get("LLM_CLIENT", "rest")
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
+
+def get_llm():
+    global llm
+    if llm is None:
+        if LLM_CLIENT == "langchain":
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            llm = ChatGoogleGenerativeAI(
+                model=GEMINI_MODEL,
+                temperature=0,
+                max_retries=0
+            )
+        else:
+            llm = GeminiClient(
+                GEMINI_MODEL,
+                os.environ.get("GOOGLE_API_KEY"),
+                base_url=os.environ.get("GEMINI_BASE_URL", GEMINI_BASE_URL),
+                temperature=0,
+                max_connections=LLM_CONCURRENCY
+            )
+    return llm
+
+def prewarm():
+    """
+    Touches every cold path once so the first real user doesn't pay for it.
+    """
+    vector = embeddings.embed_query("What are your clinic hours?")
+    load_index().similarity_search_by_vector(vector, k=1)
+    intent_classifier.warm()
+    reason_clusters.warm()
+    get_llm()
+
+async def warm_up():
+    loop = asyncio.get_running_loop()
+    started = time.time()
+    try:
+        await loop.run_in_executor(retrieval_executor, load_index)
+        if PREWARM:
+            readiness["warmup"] = "running"
+            await loop.run_in_executor(retrieval_executor, prewarm)
+            readiness["warmup"] = "done"
+        else:
+            readiness["warmup"] = "skipped"
+        print(f"Components ready in {time.time() - started:.1f}s")
+    except Exception as e:
+        print(f"Warm-up error: {e}")
+        for component, state in readiness.items():
+            if state != "ready" and state != "done":
+                readiness[component] = f"error: {e}"
+
+def start_warmup():
+    global _warmup_task
+    if _warmup_task is None:
+        _warmup_task = asyncio.create_task(warm_up())
+    return _warmup_task
+
+class IndexNotReady(Exception):
+    pass
+
+# tenant key -> task loading its index, shared by the requests waiting for it
+_index_loads = {}
+
+async def load_tenant_index(t):
+    await start_warmup()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(retrieval_executor, index_pool.load, t.key, t.vectors_path)
+
+async def wait_for_index(timeout: float = READY_WAIT_SECONDS):
+    """
+    Returns the current tenant's index PoolEntry, loading it if needed. Holds
+    the request until it is loaded; raises IndexNotReady after timeout.
+    """
+    t = tenant()
+    entry = index_pool.get(t.key)
+    if entry is not None and embeddings is not None:
+        return entry
+    task = _index_loads.get(t.key)
+    if task is None:
+        task = _index_loads[t.key] = asyncio.ensure_future(load_tenant_index(t))
+        task.add_done_callback(lambda _: _index_loads.pop(t.key, None))
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), timeout)
+    except asyncio.TimeoutError:
+        raise IndexNotReady()
+
+def new_semantic_cache():
+    """
+    Semantic cache for one tenant's RAG answers (see cache.py).
+    SEMANTIC_CACHE_SIZE=0 disables it.
+    """
+    return SemanticCache(
+        max_entries=int(os.environ.get("SEMANTIC_CACHE_SIZE", "1000")),
+        threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+        ttl_seconds=float(os.environ.get("SEMANTIC_CACHE_TTL", "86400"))
+    )
+
+# Hours, phone, address and services catalog (see facts.py). Matching questions
+# are answered without retrieval or Gemini; FACTS_ANSWERS=0 turns that off.
+FACTS_ANSWERS = os.environ.get("FACTS_ANSWERS", "1") == "1"
+# Canned reply when Gemini is unavailable (circuit open or retries exhausted)
+DEGRADED_ANSWER = "I'm having trouble looking that up right now. Please try again in a moment, or call us at {phone}."
+
+# Local intent/slot classifier that runs before the LLM (see intent.py).
+# INTENT_FAST_PATH=0 sends every decision to Gemini as before.
+INTENT_FAST_PATH = os.environ.get("INTENT_FAST_PATH", "1") == "1"
+intent_classifier = IntentClassifier(
+    lambda texts: load_embeddings().embed_documents(texts),
+    service_urls=URLS,
+    min_margin=float(os.environ.get("INTENT_MIN_MARGIN", "0.1"))
 )
 
-db = FAISS.load_local(
-    vectors_path,
-    embeddings,
-    allow_dangerous_deserialization=True
+# --- Concurrency limits ---
+# Max number of Gemini calls in flight across all sessions of this worker.
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "64"))
+# Threads reserved for CPU-bound embedding + vector search, so retrieval never
+# competes with Starlette's default threadpool.
+RETRIEVAL_WORKERS = int(os.environ.get("RETRIEVAL_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+
+# --- LLM gateway (see llm_gateway.py) ---
+# Overall deadline per call; the classification calls get shorter ones, since
+# their callers have a local fallback. LLM_DEADLINES overrides them, e.g.
+# "is_interruption=4,rag_answer=20".
+LLM_DEADLINE_SECONDS = float(os.environ.get("LLM_DEADLINE_SECONDS", "30"))
+LLM_DEADLINES = {"is_interruption": 8.0, "extract_booking_details": 10.0}
+for _item in filter(None, os.environ.get("LLM_DEADLINES", "").split(",")):
+    _site, _seconds = _item.split("=")
+    LLM_DEADLINES[_site.strip()] = float(_seconds)
+
+llm_gateway = LLMGateway(
+    get_llm,
+    concurrency=LLM_CONCURRENCY,
+    deadline=LLM_DEADLINE_SECONDS,
+    deadlines=LLM_DEADLINES,
+    attempt_timeout=float(os.environ.get("LLM_ATTEMPT_TIMEOUT_SECONDS", "15")),
+    retries=int(os.environ.get("LLM_RETRIES", "2")),
+    # Send a second request when one is slower than the call site's recent p95
+    hedge=os.environ.get("LLM_HEDGE", "0") == "1",
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.environ.get("LLM_BREAKER_FAILURES", "5")),
+        reset_seconds=float(os.environ.get("LLM_BREAKER_RESET_SECONDS", "30"))
+    )
 )
 
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash",
-    temperature=0
+async def llm_ainvoke(prompt: str, call_site: str = "rag_answer", fallback: str = None):
+    """
+    Calls the LLM through the gateway: deadline, retries, hedging, circuit
+    breaker and LLM_CONCURRENCY. call_site labels the call in metrics and
+    traces. With a fallback, a failed call returns it with .degraded set.
+    """
+    return await llm_gateway.invoke(prompt, call_site=call_site, fallback=fallback)
+
+# --- Admission control (see admission.py) ---
+# Token buckets per client IP and per session (RATE_LIMIT_*_RPS=0 disables
+# one), answered with 429. At most MAX_IN_FLIGHT_TURNS turns run at once and
+# MAX_QUEUED_TURNS wait; a turn that can't finish within TURN_DEADLINE_SECONDS
+# is answered with 503 right away. MAX_IN_FLIGHT_TURNS=0 disables the limit.
+ip_limiter = RateLimiter(
+    rate=float(os.environ.get("RATE_LIMIT_IP_RPS", "5")),
+    burst=float(os.environ.get("RATE_LIMIT_IP_BURST", "30"))
+)
+session_limiter = RateLimiter(
+    rate=float(os.environ.get("RATE_LIMIT_SESSION_RPS", "1")),
+    burst=float(os.environ.get("RATE_LIMIT_SESSION_BURST", "5"))
 )
+admission = AdmissionController(
+    max_in_flight=int(os.environ.get("MAX_IN_FLIGHT_TURNS", "32")),
+    max_queue=int(os.environ.get("MAX_QUEUED_TURNS", "64")),
+    deadline=float(os.environ.get("TURN_DEADLINE_SECONDS", "20"))
+)
+RATE_LIMITED_ANSWER = "You're sending messages faster than I can answer. Please wait a moment and try again."
+BUSY_ANSWER = "We're getting a lot of messages right now. Please try again in a few seconds, or call us at {phone}."
+
+# --- Retrieval micro-batching (see batcher.py) ---
+# Queries arriving within RETRIEVAL_BATCH_WAIT_MS of each other are embedded and
+# searched together. RETRIEVAL_BATCH_MAX=1 turns batching off.
+RETRIEVAL_BATCH_MAX = int(os.environ.get("RETRIEVAL_BATCH_MAX", "32"))
+RETRIEVAL_BATCH_WAIT_MS = float(os.environ.get("RETRIEVAL_BATCH_WAIT_MS", "2"))
+
+def embed_batch(queries):
+    return embeddings.embed_documents(queries)
+
+# Chunks sent to Gemini per question. Hybrid retrieval is precise enough that
+# 3 replace the 4 pure dense search needed.
+RAG_TOP_K = int(os.environ.get("RAG_TOP_K", "3"))
+# HYBRID_RETRIEVAL=0 uses dense search only
+HYBRID_RETRIEVAL = os.environ.get("HYBRID_RETRIEVAL", "1") == "1"
+
+def search_index(index, requests):
+    """
+    requests: list of (query, vector, k) against one index. Runs one batched
+    hybrid search when the index supports it (the legacy FAISS index is
+    searched per query).
+    """
+    k = max(k for _, _, k in requests)
+    queries = [query for query, _, _ in requests]
+    vectors = [vector for _, vector, _ in requests]
+    if HYBRID_RETRIEVAL and hasattr(index, "hybrid_search"):
+        results = index.hybrid_search(queries, vectors, k=k)
+    elif hasattr(index, "similarity_search_by_vectors"):
+        results = [(docs, "dense") for docs in index.similarity_search_by_vectors(vectors, k=k)]
+    else:
+        results = [(index.similarity_search_by_vector(vector, k=k), "dense") for vector in vectors]
+    for _, mode in results:
+        metrics.retrievals.inc(mode=mode)
+    return [docs[:wanted] for (docs, _), (_, _, wanted) in zip(results, requests)]
+
+def search_batch(requests):
+    """
+    requests: list of (query, vector, k, index). A batch can mix tenants;
+    requests for the same index are searched together.
+    """
+    groups = {}
+    for position, (query, vector, k, index) in enumerate(requests):
+        groups.setdefault(id(index), (index, []))[1].append((position, (query, vector, k)))
+    results = [None] * len(requests)
+    for index, items in groups.values():
+        for (position, _), docs in zip(items, search_index(index, [request for _, request in items])):
+            results[position] = docs
+    return results
+
+embed_batcher = MicroBatcher(
+    embed_batch, retrieval_executor, max_batch=RETRIEVAL_BATCH_MAX, max_wait_ms=RETRIEVAL_BATCH_WAIT_MS, name="embedding"
+)
+search_batcher = MicroBatcher(
+    search_batch, retrieval_executor, max_batch=RETRIEVAL_BATCH_MAX, max_wait_ms=RETRIEVAL_BATCH_WAIT_MS, name="similarity_search"
+)
+
+# Normalized query text -> embedding (see cache.py). EMBED_CACHE_MB=0 disables it;
+# EMBED_CACHE_PATH makes it persist across restarts.
+embedding_cache = EmbeddingCache(
+    budget_mb=float(os.environ.get("EMBED_CACHE_MB", "16")),
+    ttl_seconds=float(os.environ.get("EMBED_CACHE_TTL", "86400")),
+    path=os.environ.get("EMBED_CACHE_PATH") or None,
+    model=EMBEDDING_MODEL
+)
+
+async def embed_query(query: str):
+    """
+    Embeds the query on the dedicated retrieval executor, batched with
+    concurrent queries. Repeated queries come from the embedding cache.
+    """
+    vector = embedding_cache.get(query)
+    if vector is not None:
+        return vector
+    with span("embedding"):
+        vector = await embed_batcher.submit(query)
+    embedding_cache.put(query, vector)
+    return vector
+
+async def retrieve(query: str, vector, k: int = RAG_TOP_K):
+    """
+    Runs the hybrid (BM25 + vector) search of the current tenant's index on
+    the dedicated retrieval executor, batched with concurrent searches.
+    """
+    index = (await wait_for_index()).index
+    with span("similarity_search"):
+        return await search_batcher.submit((query, vector, k, index))
+
+async def run_blocking(func, *args):
+    """
+    Runs blocking file I/O (e.g. appointment writes) off the event loop, in
+    the caller's context so it sees the current tenant.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(contextvars.copy_context().run, func, *args))
+
+# Seconds between checks for a newly published index version (0 disables hot reload)
+INDEX_POLL_SECONDS = float(os.environ.get("INDEX_POLL_SECONDS", "5"))
+
+async def reload_index_loop():
+    """
+    Polls vectors/CURRENT of every resident tenant index and swaps in newly
+    published versions without a restart. In-flight searches keep the old
+    index object.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(INDEX_POLL_SECONDS)
+        for key, _ in index_pool.resident():
+            try:
+                entry = await loop.run_in_executor(retrieval_executor, index_pool.reload, key, tenants.get(key).vectors_path)
+                if entry is not None:
+                    print(f"Loaded index version {entry.version} of tenant {key}")
+            except Exception as e:
+                print(f"Index reload error ({key}): {e}")
+
+@app.on_event("startup")
+async def start_background_tasks():
+    start_warmup()
+    if INDEX_POLL_SECONDS > 0:
+        asyncio.create_task(reload_index_loop())
+
+@app.on_event("shutdown")
+async def shutdown_executors():
+    retrieval_executor.shutdown(wait=False)
+    embedding_cache.save()
+    for t in tenants.loaded():
+        t.store.close()
+    metrics.close_trace_log()
+    if hasattr(llm, "aclose"):
+        await llm.aclose()
+
+@app.get("/health")
+def health():
+    """
+    Liveness: the process is up and accepting requests.
+    """
+    return {"status": "ok"}
+
+@app.get("/ready")
+def ready():
+    """
+    Readiness: 200 once the embedding model and index are loaded, else 503.
+    """
+    entry = index_pool.get(DEFAULT_TENANT)
+    is_ready = readiness["index"] == "ready" and embeddings is not None
+    body = {"ready": is_ready, "components": readiness, "index_version": entry.version if entry else None}
+    return JSONResponse(body, status_code=200 if is_ready else 503)
 
 class Query(BaseModel):
     message: str
     session_id: str = "default"
+    # Clinic the chat belongs to (see tenants.py)
+    tenant: str = DEFAULT_TENANT
 
 # --- Booking Logic ---
 
@@ -64,63 +466,209 @@ class BookingState:
     ASK_EDIT_FIELD = "ASK_EDIT_FIELD"
     ASK_CANCEL_REASON = "ASK_CANCEL_REASON"
 
-# In-memory session store: session_id -> {state: ..., data: {...}}
-sessions = {}
+# The state that asks for each booking detail, and the reverse
+FIELD_STATES = {
+    "name": BookingState.ASK_NAME,
+    "phone": BookingState.ASK_PHONE,
+    "email": BookingState.ASK_EMAIL,
+    "service": BookingState.ASK_SERVICE,
+    "date": BookingState.ASK_DATE,
+}
+STATE_FIELDS = {state: field for field, state in FIELD_STATES.items()}
+
+# Session store: session_id -> {state: ..., data: {...}} (see sessions.py).
+# Every turn runs inside session_turn().
+sessions = open_session_store()
+
+@asynccontextmanager
+async def session_turn(session_id: str):
+    """
+    Loads the session for a turn and flushes it when the turn ends, however
+    it ends. The SQLite store's reads and writes run off the event loop.
+    """
+    if sessions.blocking:
+        await run_blocking(sessions.load, session_id)
+    else:
+        sessions.load(session_id)
+    try:
+        yield
+    finally:
+        with span("session_flush"):
+            if sessions.blocking:
+                await run_blocking(sessions.flush, session_id)
+            else:
+                sessions.flush(session_id)
+
+# Free slots suggested after a rejected time, and offered by the date picker
+SUGGESTED_SLOTS = 3
+PICKER_SLOTS = int(os.environ.get("PICKER_SLOTS", "80"))
+
+# Cancellation analytics (see rollups.py), served by GET /stats/cancellations
+reason_clusters = ReasonClusters(
+    lambda texts: load_embeddings().embed_documents(texts),
+    min_similarity=float(os.environ.get("CANCEL_REASON_MIN_SIMILARITY", "0.3"))
+)
 
-APPOINTMENTS_FILE = os.path.join(project_root, "data", "appointments.json")
-CANCELLATIONS_FILE = os.path.join(project_root, "data", "cancellations.json")
+def canonical_service(service):
+    # "botox", "Botox please" and "botox cosmetic" are one service, for the
+    # calendar's overlap check and the cancellation rollups alike
+    found = intent_classifier.find_services(str(service))
+    return found[0] if found else plain_service(service)
+
+# --- Tenants (see tenants.py) ---
+# The default tenant is the data/ directory; every data/tenants/<key>/ with
+# its own site.txt / facts.json and vectors/ is another clinic.
+TENANTS_DIR = os.environ.get("TENANTS_DIR", os.path.join(project_root, "data", "tenants"))
+
+def build_tenant(key, data_dir):
+    """
+    Loads a clinic's facts and opens its appointment storage (see db.py),
+    which imports legacy appointments.json / cancellations.json on first
+    start, then indexes its upcoming requests and catches up its
+    cancellation rollups.
+    """
+    if key == DEFAULT_TENANT:
+        facts = load_facts(SITE_PATH, URLS, baseline_hours=CLINIC_HOURS)
+        store = open_store()
+    else:
+        facts = load_facts(os.path.join(data_dir, "site.txt"), (), path=os.path.join(data_dir, "facts.json"))
+        store = open_store(data_dir=data_dir)
+
+    # Interval index of upcoming requests, for date validation and the date
+    # picker's free slots (see availability.py)
+    calendar = Calendar(
+        facts.hours,
+        slot_minutes=int(os.environ.get("APPOINTMENT_SLOT_MINUTES", "30")),
+        capacity=int(os.environ.get("APPOINTMENT_CAPACITY", "2")),
+        horizon_days=int(os.environ.get("BOOKING_HORIZON_DAYS", "60")),
+        service_key=canonical_service
+    )
+    # Requests are validated against the horizon, so one made longer ago than
+    # that can't be upcoming; the store reads only the rest
+    now = datetime.now()
+    calendar.load(store.upcoming_appointments(
+        now.isoformat(timespec="minutes"),
+        (now - timedelta(days=calendar.horizon_days)).isoformat()
+    ), now)
+
+    rollups = CancellationRollups(
+        keep_days=int(os.environ.get("CANCEL_ROLLUP_DAYS", "90")),
+        service_key=canonical_service
+    )
+    rollups.catch_up(store)
+
+    return Tenant(
+        key,
+        data_dir,
+        facts=facts,
+        system_prompt=SYSTEM_PROMPT.format(hours=facts.hours_markdown(), phone=facts.phone),
+        degraded_answer=DEGRADED_ANSWER.format(phone=facts.phone),
+        store=store,
+        calendar=calendar,
+        rollups=rollups,
+        semantic_cache=new_semantic_cache()
+    )
+
+tenants = TenantRegistry(os.path.join(project_root, "data"), TENANTS_DIR, build_tenant)
+# Built at import, like the single clinic was; other tenants on first use
+tenants.get(DEFAULT_TENANT)
+
+# Tenant of the request being handled; set by the chat endpoints
+_current_tenant = contextvars.ContextVar("cnbot_tenant", default=DEFAULT_TENANT)
+
+def tenant() -> Tenant:
+    return tenants.get(_current_tenant.get())
+
+def session_key(tenant_key: str, session_id: str) -> str:
+    """
+    The session store key of a client's session_id at a tenant.
+    """
+    return f"{tenant_key}:{session_id}"
+
+async def enter_tenant(q: Query):
+    """
+    Makes q's tenant current for this request. Sessions are per tenant: the
+    same session_id at two clinics is two conversations, so every session_id
+    is keyed by its tenant and a client-supplied one can't contain ":".
+    Raises 404 for an unknown tenant.
+    """
+    if ":" in q.session_id:
+        raise HTTPException(status_code=400, detail="session_id can't contain ':'")
+    if tenants.cached(q.tenant) is None:
+        try:
+            await run_blocking(tenants.get, q.tenant)
+        except UnknownTenant:
+            raise HTTPException(status_code=404, detail=f"Unknown tenant: {q.tenant}")
+    _current_tenant.set(q.tenant)
+    q.session_id = session_key(q.tenant, q.session_id)
+
+def get_tenant(key: str) -> Tenant:
+    """
+    The tenant named by a read endpoint's ?tenant= parameter.
+    """
+    try:
+        return tenants.get(key)
+    except UnknownTenant:
+        raise HTTPException(status_code=404, detail=f"Unknown tenant: {key}")
+
+def free_slots(service, n=PICKER_SLOTS, t=None):
+    return [
+        {"start": dt.isoformat(timespec="minutes"), "label": format_slot(dt)}
+        for dt in (t or tenant()).calendar.next_free(service, n)
+    ]
 
 def save_appointment(data, ip_address=None):
-    appointments = []
-    if os.path.exists(APPOINTMENTS_FILE):
-        with open(APPOINTMENTS_FILE, "r") as f:
-            try:
-                appointments = json.load(f)
-            except:
-                pass
-    
     data["created_at"] = datetime.now().isoformat()
     if ip_address:
         data["ip_address"] = ip_address
-        
-    appointments.append(data)
-    
-    # Ensure directory exists just in case
-    os.makedirs(os.path.dirname(APPOINTMENTS_FILE), exist_ok=True)
-    
-    with open(APPOINTMENTS_FILE, "w") as f:
-        json.dump(appointments, f, indent=4)
 
-def save_cancellation(data, reason, ip_address=None):
-    cancellations = []
-    if os.path.exists(CANCELLATIONS_FILE):
-        with open(CANCELLATIONS_FILE, "r") as f:
-            try:
-                cancellations = json.load(f)
-            except:
-                pass
-    
+    # The time is already reserved in the calendar (see the CONFIRM step)
+    tenant().store.save_appointment(data)
+
+def save_cancellation(data, reason, ip_address=None, state=None, reason_cluster=UNCLASSIFIED):
+    """
+    state: the booking step the user cancelled at.
+    """
     entry = {
         "data": data,
         "reason": reason,
+        "reason_cluster": reason_cluster,
+        "state": state,
         "cancelled_at": datetime.now().isoformat()
     }
     if ip_address:
         entry["ip_address"] = ip_address
 
-    cancellations.append(entry)
-    
-    os.makedirs(os.path.dirname(CANCELLATIONS_FILE), exist_ok=True)
-    
-    with open(CANCELLATIONS_FILE, "w") as f:
-        json.dump(cancellations, f, indent=4)
+    t = tenant()
+    t.store.save_cancellation(entry)
+    t.rollups.add(entry)
+
+async def classify_reason(reason: str) -> str:
+    """
+    The reason cluster of a cancellation reason. Doesn't wait for the
+    embedding model if it isn't loaded yet.
+    """
+    if embeddings is None or not reason.strip():
+        return UNCLASSIFIED
+    try:
+        vector = await embed_query(reason)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(retrieval_executor, reason_clusters.assign, vector)
+    except Exception as e:
+        print(f"Reason clustering failed: {e}")
+        return UNCLASSIFIED
 
-def extract_booking_details(message: str, context: str = ""):
+async def extract_booking_details(message: str, context: str = ""):
     """
     Uses LLM to extract booking details from the message, using context if available.
     Returns a dict with keys: name, phone, email, service, date.
     Values are None if not found.
     """
+    if INTENT_FAST_PATH:
+        decision = intent_classifier.extract(message, context)
+        if decision.value is not None:
+            return decision.value
+
     schema = {
         "properties": {
             "name": {"type": "string"},
@@ -153,7 +701,7 @@ def extract_booking_details(message: str, context: str = ""):
     try:
         # Simple invocation - better structured output handling could be done with tools/functions
         # but for this simple use case, we ask for JSON directly.
-        res = llm.invoke(extraction_prompt + "\n\nReturn ONLY JSON.")
+        res = await llm_ainvoke(extraction_prompt + "\n\nReturn ONLY JSON.", call_site="extract_booking_details")
         content = res.content.strip()
         # Clean up code blocks if present
         if "```json" in content:
@@ -217,9 +765,20 @@ def get_next_question(session_id):
             sessions[session_id]["state"] = BookingState.ASK_DATE
             state = BookingState.ASK_DATE
         else:
-            return {"message": f"Thanks {name}. What service are you interested in?", "resume_message": "Which service were you interested in?"}
+            return {
+                "message": f"Thanks {name}. What service are you interested in?",
+                "resume_message": "Which service were you interested in?",
+                "ui_action": "service_picker"
+            }
 
     if state == BookingState.ASK_DATE:
+        if data.get("date") and not data.get("starts_at"):
+            # Extracted from an earlier message; keep it only if it can be requested
+            starts_at, _ = validate_appointment_time(data["date"], service)
+            if starts_at:
+                accept_date(data, starts_at)
+            else:
+                del data["date"]
         if data.get("date"):
             sessions[session_id]["state"] = BookingState.CONFIRM
             state = BookingState.CONFIRM
@@ -230,7 +789,8 @@ def get_next_question(session_id):
              return {
                 "message": msg,
                 "resume_message": "When would you prefer to come in?",
-                "ui_action": "date_picker"
+                "ui_action": "date_picker",
+                "slots": free_slots(service)
             }
 
     if state == BookingState.CONFIRM:
@@ -243,9 +803,10 @@ def get_next_question(session_id):
 
     return {"message": "Something went wrong."}
 
-def is_interruption(message: str, current_state: str) -> bool:
+async def local_interruption(message: str, current_state: str):
     """
-    Determines if the user's message is an interruption/question rather than an answer to the booking question.
+    Heuristics and the local classifier. Returns True/False, or None when
+    only the LLM can decide.
     """
     # Heuristics for obvious cases
     msg = message.lower()
@@ -254,7 +815,23 @@ def is_interruption(message: str, current_state: str) -> bool:
     # If the message is very short (like a name or number), likely not an interruption
     if len(msg.split()) < 3 and current_state not in [BookingState.ASK_SERVICE, BookingState.ASK_EDIT_FIELD, BookingState.ASK_CANCEL_REASON]:
          return False
-         
+
+    # Local classifier first; only ambiguous messages go to the LLM
+    if INTENT_FAST_PATH:
+        loop = asyncio.get_running_loop()
+        with span("intent_classifier"):
+            decision = await loop.run_in_executor(
+                retrieval_executor, intent_classifier.interruption, message, current_state, embeddings is not None
+            )
+        if decision.value is not None:
+            return decision.value
+    return None
+
+async def llm_interruption(message: str, current_state: str) -> bool:
+    """
+    Determines if the user's message is an interruption/question rather than an answer to the booking question.
+    Used when local_interruption() can't decide.
+    """
     # Use LLM for smarter detection
     prompt = f"""
     Context: The bot is currently asking the user a question to book an appointment.
@@ -272,68 +849,147 @@ def is_interruption(message: str, current_state: str) -> bool:
     Return ONLY "True" if it is an interruption, or "False" if it is an answer.
     """
     try:
-        res = llm.invoke(prompt)
+        res = await llm_ainvoke(prompt, call_site="is_interruption")
         return "True" in res.content
-    except:
+    except Exception as e:
+        # Treat the message as an answer; the booking flow re-asks if it wasn't
+        print(f"Interruption check error: {e}")
         return False
 
-def is_valid_appointment_time(date_str: str) -> tuple[bool, str]:
+# --- Speculative RAG ---
+# While the LLM decides whether an in-flow message is an interruption, the RAG
+# work for it can already run: SPECULATIVE_RAG=retrieve embeds and retrieves,
+# =generate also generates the answer. If the message was an answer after all,
+# the speculation is cancelled and counted as wasted.
+SPECULATIVE_RAG = os.environ.get("SPECULATIVE_RAG", "off")
+
+# session_id -> (answer, prompt, vector) prepared during the booking turn,
+# consumed by the RAG fallback of the same request
+prepared_rag = {}
+
+async def speculate_rag(message: str, timing: dict):
+    try:
+        answer, prompt, vector = await prepare_rag(message)
+        generated = False
+        if answer is None and SPECULATIVE_RAG == "generate":
+            res = await llm_ainvoke(prompt, call_site="speculative_rag_answer", fallback=tenant().degraded_answer)
+            answer, prompt, generated = res.content, None, not getattr(res, "degraded", False)
+        return answer, prompt, vector, generated
+    finally:
+        timing["finished"] = time.perf_counter()
+
+async def speculative_interruption(session_id: str, message: str, current_state: str) -> bool:
     """
-    Validates if the date_str falls within business hours.
-    Returns (is_valid, error_message).
-    Business Hours:
-    Monday: 10 AM - 5 PM
-    Tuesday: 10 AM - 5 PM
-    Wednesday: 10 AM - 5 PM
-    Thursday: 11 AM - 7 PM
-    Friday: 10 AM - 5 PM
-    Saturday: 9 AM - 3 PM
-    Sunday: Closed
+    llm_interruption, with the RAG work for the message running alongside it.
+    On an interruption the result goes to prepared_rag for the RAG fallback.
     """
+    timing = {}
+    started = time.perf_counter()
+    task = asyncio.ensure_future(speculate_rag(message, timing))
+    interrupted = await llm_interruption(message, current_state)
+
+    if interrupted:
+        answer, prompt, vector, generated = await task
+        if generated:
+            tenant().semantic_cache.put(message, vector, answer)
+        prepared_rag[session_id] = (answer, prompt, vector)
+        metrics.record_speculation(SPECULATIVE_RAG, "used")
+        return True
+
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        # Retrieve the exception, if any, so it isn't logged as unhandled
+        task.exception()
+    wasted = timing.get("finished", time.perf_counter()) - started
+    metrics.record_speculation(SPECULATIVE_RAG, "wasted", wasted)
+    return False
+
+# --- Turn planner (see planner.py) ---
+# TURN_PLANNER=1 replaces llm_interruption + the RAG answer with one structured
+# Gemini call for in-flow messages the local fast path can't decide.
+TURN_PLANNER = os.environ.get("TURN_PLANNER", "0") == "1"
+
+async def plan_turn(message: str, state_data: dict):
+    """
+    Asks the LLM what an in-flow message is, with retrieved context so an
+    interruption comes back already answered. Returns a TurnPlan, or None to
+    fall back to the sequential path.
+    """
+    state = state_data.get("state")
+    chunks = []
     try:
-        # Expected format from frontend: "Mon, Jan 1, 2026, 10:00 AM"
-        # We can try to parse it flexibly
-        from dateutil import parser
-        dt = parser.parse(date_str)
-        
-        day = dt.weekday() # 0=Mon, 6=Sun
-        hour = dt.hour
-        minute = dt.minute
-        
-        # Check Sunday
-        if day == 6:
-            return False, "We are closed on Sundays. Please choose another day."
-            
-        # Define hours (start_hour, end_hour) - exclusive of end_hour for simplicity or inclusive?
-        # Let's say 5 PM is the last slot? or closing time? Usually closing time means last appointment must finish by then or start before.
-        # Let's assume these are opening hours.
-        
-        hours = {
-            0: (10, 17), # Mon
-            1: (10, 17), # Tue
-            2: (10, 17), # Wed
-            3: (11, 19), # Thu
-            4: (10, 17), # Fri
-            5: (9, 15),  # Sat
-        }
-        
-        start_h, end_h = hours[day]
-        
-        # Check simple hour bounds
-        if hour < start_h or hour >= end_h:
-            # Format times for friendly error
-            def fmt(h): return f"{h-12} PM" if h > 12 else f"{h} AM" if h < 12 else "12 PM"
-            return False, f"On {dt.strftime('%A')}s we are open from {fmt(start_h)} to {fmt(end_h)}."
-            
-        return True, ""
+        with span("wait_for_index"):
+            await wait_for_index()
+        vector = await embed_query(message)
+        chunks = [d.page_content for d in await retrieve(message, vector)]
+    except IndexNotReady:
+        # Plan without context; an interruption then goes to the RAG path
+        pass
+    rag_prompt, raw_tokens, sent_tokens = build_rag_prompt(tenant().system_prompt, chunks, message, PROMPT_TOKEN_BUDGET)
+    metrics.record_prompt("turn_planner", raw_tokens, sent_tokens)
+    prompt = build_planner_prompt(
+        state, STATE_FIELDS.get(state), state_data.get("data", {}), conversation_context(state_data), message, rag_prompt
+    )
+    try:
+        res = await llm_ainvoke(prompt, call_site="turn_planner")
     except Exception as e:
-        # If parsing fails, we might just let it pass or ask to retry.
-        # For now, let's treat it as valid to avoid blocking on format issues, 
-        # or log validation error.
-        print(f"Date validation error: {e}")
-        return True, ""
+        print(f"Turn planner error: {e}")
+        return None
+    plan = parse_plan(res.content)
+    metrics.turn_plans.inc(intent=plan.intent if plan else "invalid")
+    return plan
+
+def start_edit(session_id: str, data: dict, target_field: str):
+    # Clear the field so get_next_question prompts for it
+    if target_field in data:
+        del data[target_field]
+    if target_field == "date":
+        data.pop("starts_at", None)
+
+    # Transition to the appropriate state
+    sessions[session_id]["state"] = FIELD_STATES[target_field]
+
+    # Update session data reference (mutable dict)
+    sessions[session_id]["data"] = data
+    return get_next_question(session_id)
+
+def start_cancel(session_id: str, state: str):
+    # Remembered for the cancellation rollups' per-state counts
+    sessions[session_id]["cancelled_at_state"] = state
+    sessions[session_id]["state"] = BookingState.ASK_CANCEL_REASON
+    return get_next_question(session_id)
+
+def validate_appointment_time(date_str: str, service=None):
+    """
+    Normalizes date_str and checks it against opening hours and existing
+    requests. Returns (starts_at, error_message); starts_at is None if the
+    time can't be requested, and the message then lists the nearest free slots.
+    """
+    t = tenant()
+    dt = normalize(date_str)
+    if dt is None:
+        error = "I couldn't find a date and time in that."
+    else:
+        is_open, error = t.facts.check_open(dt)
+        if is_open:
+            is_free, error = t.calendar.check(dt, service)
+            if is_free:
+                return dt, ""
+    suggestions = t.calendar.next_free(service, SUGGESTED_SLOTS, after=dt)
+    if suggestions:
+        error += " The nearest available times are: " + "; ".join(format_slot(s) for s in suggestions) + "."
+    else:
+        error += " Please choose a different time."
+    return None, error
+
+def accept_date(data: dict, starts_at):
+    data["date"] = format_slot(starts_at)
+    data["starts_at"] = starts_at.isoformat(timespec="minutes")
 
-def process_booking(session_id: str, message: str, state_data: dict):
+BOOKING_KEYWORDS = ["book", "appointment", "schedule", "visit", "reservation"]
+
+async def process_booking(session_id: str, message: str, state_data: dict):
     state = state_data.get("state", BookingState.IDLE)
     data = state_data.get("data", {})
     ip_address = state_data.get("ip", None)
@@ -344,15 +1000,45 @@ def process_booking(session_id: str, message: str, state_data: dict):
         # Check for Cancellation FIRST
         cancel_keywords = ["cancel", "stop", "exit", "quit", "abort", "no booking"]
         if any(k in msg for k in cancel_keywords) and state != BookingState.ASK_CANCEL_REASON:
-             sessions[session_id]["state"] = BookingState.ASK_CANCEL_REASON
-             return get_next_question(session_id)
+             return start_cancel(session_id, state)
 
         # Check for Interruption
-        if is_interruption(message, state):
-            return None # Treat as RAG query
+        interrupted = await local_interruption(message, state)
+        plan = None
+        if interrupted is None and TURN_PLANNER:
+            plan = await plan_turn(message, state_data)
+
+        if plan is None:
+            if interrupted is None and SPECULATIVE_RAG in ("retrieve", "generate"):
+                interrupted = await speculative_interruption(session_id, message, state)
+            elif interrupted is None:
+                interrupted = await llm_interruption(message, state)
+            if interrupted:
+                return None # Treat as RAG query
+        elif plan.intent == "interruption":
+            # handle_booking_turn replies with the planned answer, or RAG answers it
+            if plan.answer:
+                sessions[session_id]["planned_answer"] = plan.answer
+            return None
+        elif plan.intent == "cancel" and state != BookingState.ASK_CANCEL_REASON:
+            return start_cancel(session_id, state)
+        elif plan.intent == "edit" and state != BookingState.ASK_CANCEL_REASON:
+            if plan.field:
+                return start_edit(session_id, data, plan.field)
+            sessions[session_id]["state"] = BookingState.ASK_EDIT_FIELD
+            return get_next_question(session_id)
+        else:
+            # An answer: take the planner's value for the detail being asked,
+            # and keep any other details the user volunteered
+            slots = plan.slots.found()
+            if STATE_FIELDS.get(state) in slots:
+                message = slots.pop(STATE_FIELDS[state])
+            # get_next_question validates a volunteered date before accepting it
+            for field, value in slots.items():
+                data.setdefault(field, value)
 
         edit_keywords = ["edit", "change", "modify", "update", "correct", "wrong"]
-        if any(k in msg for k in edit_keywords) and state not in [BookingState.ASK_EDIT_FIELD, BookingState.ASK_CANCEL_REASON]:
+        if plan is None and any(k in msg for k in edit_keywords) and state not in [BookingState.ASK_EDIT_FIELD, BookingState.ASK_CANCEL_REASON]:
             
             # Identify field to edit using regex for whole word matching
             target_field = None
@@ -363,20 +1049,7 @@ def process_booking(session_id: str, message: str, state_data: dict):
             elif re.search(r'\b(date|time)\b', msg): target_field = "date"
             
             if target_field:
-                # Clear the field so get_next_question prompts for it
-                if target_field in data:
-                    del data[target_field]
-                
-                # Transition to the appropriate state
-                if target_field == "name": sessions[session_id]["state"] = BookingState.ASK_NAME
-                elif target_field == "phone": sessions[session_id]["state"] = BookingState.ASK_PHONE
-                elif target_field == "email": sessions[session_id]["state"] = BookingState.ASK_EMAIL
-                elif target_field == "service": sessions[session_id]["state"] = BookingState.ASK_SERVICE
-                elif target_field == "date": sessions[session_id]["state"] = BookingState.ASK_DATE
-                
-                # Update session data reference (mutable dict)
-                sessions[session_id]["data"] = data
-                return get_next_question(session_id)
+                return start_edit(session_id, data, target_field)
             else:
                 # Ambiguous edit
                 sessions[session_id]["state"] = BookingState.ASK_EDIT_FIELD
@@ -385,14 +1058,12 @@ def process_booking(session_id: str, message: str, state_data: dict):
     if state == BookingState.IDLE:
         # Check for booking intent
         # Relaxed condition: check for any strong booking keyword
-        booking_keywords = ["book", "appointment", "schedule", "visit", "reservation"]
-        if any(k in msg for k in booking_keywords):
+        if any(k in msg for k in BOOKING_KEYWORDS):
             # Smart extraction
             # Smart extraction
             # Retrieve context (last bot response) from session data if available
-            history = state_data.get("history", [])
-            context = "\n".join(history[-5:]) # Use last 5 turns
-            extracted = extract_booking_details(message, context)
+            context = conversation_context(state_data)
+            extracted = await extract_booking_details(message, context)
             
             # Merge extracted data
             initial_data = {}
@@ -413,7 +1084,11 @@ def process_booking(session_id: str, message: str, state_data: dict):
         return None  # Fallback to RAG
 
     if state == BookingState.ASK_CANCEL_REASON:
-        save_cancellation(data, message, ip_address)
+        reason_cluster = await classify_reason(message)
+        with span("storage_write"):
+            await run_blocking(
+                save_cancellation, data, message, ip_address, state_data.get("cancelled_at_state"), reason_cluster
+            )
         sessions[session_id] = {"state": BookingState.IDLE, "data": {}}
         return {"message": "Thank you for your feedback. Your booking has been cancelled."}
 
@@ -427,17 +1102,7 @@ def process_booking(session_id: str, message: str, state_data: dict):
         elif "date" in msg or "time" in msg: target_field = "date"
         
         if target_field:
-            if target_field in data:
-                del data[target_field]
-            
-            if target_field == "name": sessions[session_id]["state"] = BookingState.ASK_NAME
-            elif target_field == "phone": sessions[session_id]["state"] = BookingState.ASK_PHONE
-            elif target_field == "email": sessions[session_id]["state"] = BookingState.ASK_EMAIL
-            elif target_field == "service": sessions[session_id]["state"] = BookingState.ASK_SERVICE
-            elif target_field == "date": sessions[session_id]["state"] = BookingState.ASK_DATE
-            
-            sessions[session_id]["data"] = data
-            return get_next_question(session_id)
+            return start_edit(session_id, data, target_field)
         else:
              return {"message": "I didn't catch that. Please tell me which field to update (Name, Phone, Email, Service, or Date)."}
 
@@ -463,17 +1128,36 @@ def process_booking(session_id: str, message: str, state_data: dict):
 
     if state == BookingState.ASK_DATE:
         # Validate date before accepting
-        is_valid, error_msg = is_valid_appointment_time(message)
-        if not is_valid:
-            return {"message": f"{error_msg} Please choose a different time."}
-            
-        sessions[session_id]["data"]["date"] = message
+        starts_at, error_msg = validate_appointment_time(message, data.get("service"))
+        if starts_at is None:
+            return {
+                "message": error_msg,
+                "ui_action": "date_picker",
+                "slots": free_slots(data.get("service"))
+            }
+
+        accept_date(sessions[session_id]["data"], starts_at)
         sessions[session_id]["state"] = BookingState.CONFIRM
         return get_next_question(session_id)
 
     if state == BookingState.CONFIRM:
         if msg in ["yes", "y", "confirm", "ok", "submit"]:
-            save_appointment(sessions[session_id]["data"], ip_address)
+            # Another session may have requested the same time meanwhile; the
+            # reservation is taken before the write awaits, so only one gets it
+            calendar = tenant().calendar
+            starts_at = datetime.fromisoformat(data["starts_at"]) if data.get("starts_at") else None
+            if starts_at and not calendar.reserve(starts_at, data.get("service")):
+                del data["date"], data["starts_at"]
+                sessions[session_id]["state"] = BookingState.ASK_DATE
+                next_q = get_next_question(session_id)
+                return dict(next_q, message="Sorry, that time was just requested by someone else. " + next_q["message"])
+            try:
+                with span("storage_write"):
+                    await run_blocking(save_appointment, sessions[session_id]["data"], ip_address)
+            except Exception:
+                if starts_at:
+                    calendar.release(starts_at, data.get("service"))
+                raise
             sessions[session_id] = {"state": BookingState.IDLE, "data": {}}
             return {"message": "Your appointment request has been submitted. Please note your appointment is not booked until the office sends you a confirmation text."}
         elif msg in ["no", "cancel", "stop"]:
@@ -485,17 +1169,20 @@ def process_booking(session_id: str, message: str, state_data: dict):
 
     return None
 
-@app.post("/chat")
-def chat(q: Query, request: Request):
+async def handle_booking_turn(q: Query, client_ip: str):
+    """
+    Runs everything in a turn that comes before the RAG fallback.
+    Returns the response dict if the booking flow handled the message, else None.
+    """
     session_id = q.session_id
-    client_ip = request.client.host
-    
+
     # Initialize session if not exists
-    if session_id not in sessions:
-        sessions[session_id] = {"state": BookingState.IDLE, "data": {}, "history": [], "ip": client_ip, "last_fallback": False}
-    else:
-        # Update IP just in case it changed (though unlikely for same session)
-        sessions[session_id]["ip"] = client_ip
+    with span("session_lookup"):
+        if session_id not in sessions:
+            sessions[session_id] = {"state": BookingState.IDLE, "data": {}, "history": [], "ip": client_ip, "last_fallback": False}
+        else:
+            # Update IP just in case it changed (though unlikely for same session)
+            sessions[session_id]["ip"] = client_ip
     
     # Check if user is saying "yes" after receiving the fallback message
     msg_lower = q.message.strip().lower()
@@ -504,48 +1191,104 @@ def chat(q: Query, request: Request):
     if sessions[session_id].get("last_fallback", False) and any(keyword in msg_lower for keyword in yes_keywords):
         # User agreed to arrange a call - initiate booking with context
         history = sessions[session_id].get("history", [])
-        context = "\n".join(history[-5:])  # Use last 5 turns
+        summary = sessions[session_id].get("summary", [])
+        context = conversation_context(sessions[session_id])
         
         # Extract service from context
-        extracted = extract_booking_details(q.message, context)
+        extracted = await extract_booking_details(q.message, context)
         
         initial_data = {}
         if extracted.get("service"):
             initial_data["service"] = extracted["service"]
         
         # Start booking flow
-        sessions[session_id] = {"state": BookingState.ASK_NAME, "data": initial_data, "history": history, "ip": client_ip, "last_fallback": False}
+        sessions[session_id] = {"state": BookingState.ASK_NAME, "data": initial_data, "history": history, "summary": summary, "ip": client_ip, "last_fallback": False}
         
+        metrics.set_path("booking")
         return {
             "reply": get_next_question(session_id)["message"],
             "ui_action": get_next_question(session_id).get("ui_action")
         }
     
     # Try to process booking flow
-    booking_response = process_booking(session_id, q.message, sessions[session_id])
+    booking_response = await process_booking(session_id, q.message, sessions[session_id])
     if booking_response:
         # Clear fallback flag when in active booking
         sessions[session_id]["last_fallback"] = False
-        return {
+        metrics.set_path("booking")
+        response = {
             "reply": booking_response["message"],
             "ui_action": booking_response.get("ui_action")
         }
+        if booking_response.get("slots"):
+            response["slots"] = booking_response["slots"]
+        return response
 
-    # Fallback to RAG
-    docs = db.similarity_search(q.message, k=4)
-    context = "\n".join([d.page_content for d in docs])
+    # An interruption the turn planner already answered
+    planned_answer = sessions[session_id].pop("planned_answer", None)
+    if planned_answer is not None:
+        metrics.set_path("planner")
+        return finish_rag_turn(session_id, q.message, planned_answer)
 
-    prompt = f"""
-{SYSTEM_PROMPT}
+    return None
+
+# History lines kept verbatim per session; older user turns are folded into a summary
+HISTORY_RECENT_LINES = int(os.environ.get("HISTORY_RECENT_LINES", "4"))
+
+# Estimated token budget for a RAG prompt (system prompt + context + question)
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "1200"))
 
-Context:
-{context}
+def format_rag_prompt(message: str, docs) -> str:
+    """
+    Builds the RAG prompt with overlapping chunks merged and the context cut
+    to PROMPT_TOKEN_BUDGET (see context.py).
+    """
+    prompt, raw_tokens, sent_tokens = build_rag_prompt(
+        tenant().system_prompt, [d.page_content for d in docs], message, PROMPT_TOKEN_BUDGET
+    )
+    metrics.record_prompt("rag_answer", raw_tokens, sent_tokens)
+    return prompt
+
+async def prepare_rag(message: str):
+    """
+    Looks the question up in the semantic cache, retrieving context on a miss.
+    Returns (cached_answer, prompt, query_vector); cached_answer is None on a miss.
+    Raises IndexNotReady if the index is still loading after READY_WAIT_SECONDS.
+    """
+    t = tenant()
+    if FACTS_ANSWERS:
+        answer = t.facts.answer(message)
+        if answer is not None:
+            metrics.set_path("facts")
+            return answer, None, None
+
+    entry = index_pool.get(t.key)
+    if entry is not None:
+        t.semantic_cache.check_version(entry.version)
+    cached = t.semantic_cache.get_text(message)
+    if cached is not None:
+        metrics.set_path("cache")
+        return cached, None, None
 
-Question: {q.message}
-"""
+    with span("wait_for_index"):
+        entry = await wait_for_index()
+    t.semantic_cache.check_version(entry.version)
+    vector = await embed_query(message)
+    cached = t.semantic_cache.get_vector(vector)
+    if cached is not None:
+        metrics.set_path("cache")
+        return cached, None, vector
 
-    res = llm.invoke(prompt)
-    bot_reply = res.content
+    metrics.set_path("rag")
+    docs = await retrieve(message, vector)
+    return None, format_rag_prompt(message, docs), vector
+
+def finish_rag_turn(session_id: str, message: str, answer: str):
+    """
+    Post-processes a generated RAG answer: fallback tracking, booking resume and history.
+    Returns the response dict.
+    """
+    bot_reply = answer
 
     # Check if the fallback message was sent
     fallback_trigger = "Shall I arrange a quick call?"
@@ -580,15 +1323,361 @@ Question: {q.message}
             bot_reply += f"\n\n{transition} {next_q}"
             
             if "ui_action" in resume_data:
-                return {
+                response = {
                     "reply": bot_reply,
                     "ui_action": resume_data.get("ui_action")
                 }
+                if resume_data.get("slots"):
+                    response["slots"] = resume_data["slots"]
+                return response
     
     # Update context with the latest Q&A for future reference
     if "history" not in sessions[session_id]:
         sessions[session_id]["history"] = []
-    sessions[session_id]["history"].append(f"User: {q.message}")
-    sessions[session_id]["history"].append(f"Bot: {res.content}")
+    sessions[session_id]["history"].append(f"User: {message}")
+    sessions[session_id]["history"].append(f"Bot: {answer}")
+    fold_history(sessions[session_id], keep_lines=HISTORY_RECENT_LINES)
     
     return {"reply": bot_reply}
+
+def check_rate_limits(q: Query, client_ip: str):
+    """
+    Takes a token from the client IP's and the session's bucket. Raises 429
+    with Retry-After if either is empty.
+    """
+    for outcome, limiter, key in (("rate_limited_ip", ip_limiter, client_ip),
+                                  ("rate_limited_session", session_limiter, q.session_id)):
+        wait = limiter.take(key)
+        if wait:
+            metrics.admissions.inc(outcome=outcome)
+            raise HTTPException(status_code=429, detail=RATE_LIMITED_ANSWER, headers={"Retry-After": retry_after_header(wait)})
+
+def busy_error(e: Overloaded):
+    return HTTPException(
+        status_code=503,
+        detail=BUSY_ANSWER.format(phone=tenant().facts.phone),
+        headers={"Retry-After": retry_after_header(e.retry_after)}
+    )
+
+def shed_answer(q: Query):
+    """
+    While admission is saturated, answers q without taking a slot if it can
+    be answered without retrieval or the LLM: from the clinic facts or the
+    semantic cache (by text, or by vector when the query's embedding is
+    cached). Returns None for anything else, including every turn of a
+    booking in progress, which then queues for a slot as usual. Shed
+    answers are not added to the session history.
+    """
+    if not admission.saturated or any(k in q.message.lower() for k in BOOKING_KEYWORDS):
+        return None
+    # Read-only: a shed turn doesn't load or write the session
+    session = sessions.peek(q.session_id)
+    if session is not None:
+        if session.get("state", BookingState.IDLE) != BookingState.IDLE or session.get("last_fallback"):
+            return None
+    t = tenant()
+    answer = t.facts.answer(q.message) if FACTS_ANSWERS else None
+    if answer is None:
+        answer = t.semantic_cache.get_text(q.message)
+    if answer is None:
+        vector = embedding_cache.get(q.message)
+        if vector is not None:
+            answer = t.semantic_cache.get_vector(vector)
+    if answer is not None:
+        metrics.set_path("shed")
+        metrics.admissions.inc(outcome="shed")
+    return answer
+
+@app.post("/chat")
+async def chat(q: Query, request: Request):
+    await enter_tenant(q)
+    check_rate_limits(q, request.client.host)
+    metrics.start_trace("chat", q.session_id)
+    start_warmup()
+    try:
+        answer = shed_answer(q)
+        if answer is not None:
+            return {"reply": answer, "degraded": True}
+
+        async with admission.slot(), session_turn(q.session_id):
+            booking_response = await handle_booking_turn(q, request.client.host)
+            if booking_response:
+                return booking_response
+
+            # Fallback to RAG
+            answer, prompt, vector = prepared_rag.pop(q.session_id, None) or await prepare_rag(q.message)
+            if answer is None:
+                res = await llm_ainvoke(prompt, fallback=tenant().degraded_answer)
+                answer = res.content
+                if getattr(res, "degraded", False):
+                    metrics.set_path("degraded")
+                else:
+                    tenant().semantic_cache.put(q.message, vector, answer)
+            return finish_rag_turn(q.session_id, q.message, answer)
+    except Overloaded as e:
+        metrics.set_path("rejected")
+        raise busy_error(e)
+    except IndexNotReady:
+        metrics.set_path("not_ready")
+        raise HTTPException(
+            status_code=503,
+            detail="The assistant is still starting up. Please try again in a moment.",
+            headers={"Retry-After": "5"}
+        )
+    finally:
+        prepared_rag.pop(q.session_id, None)
+        metrics.end_trace()
+
+@app.get("/cache/stats")
+def cache_stats(tenant: str = DEFAULT_TENANT):
+    return get_tenant(tenant).semantic_cache.stats()
+
+@app.get("/intent/stats")
+def intent_stats():
+    return intent_classifier.stats()
+
+@app.get("/retrieval/stats")
+def retrieval_stats():
+    return {
+        "embedding": embed_batcher.stats(),
+        "similarity_search": search_batcher.stats(),
+        "embedding_cache": embedding_cache.stats(),
+    }
+
+@app.get("/llm/stats")
+def llm_stats():
+    return llm_gateway.stats()
+
+@app.get("/availability")
+def availability(service: str = "", n: int = 10, tenant: str = DEFAULT_TENANT):
+    """
+    The next n free appointment slots for a service.
+    """
+    t = get_tenant(tenant)
+    return dict(t.calendar.stats(), slots=free_slots(service or None, max(1, min(n, 200)), t))
+
+# --- Records API (front desk) ---
+
+# Required as "Authorization: Bearer <token>"; the records API is off without it
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+RECORDS_PAGE_MAX = 500
+
+def require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Records API is disabled; set ADMIN_TOKEN to enable it.")
+    if not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {ADMIN_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid or missing admin token.")
+
+def record_filters(since, until, phone, email, service):
+    """
+    Query parameters to store filters. since/until are ISO dates or
+    datetimes; a date-only `until` includes that whole day.
+    """
+    filters = {"phone": phone or None, "email": email or None, "service": service or None}
+    try:
+        if since:
+            filters["since"] = datetime.fromisoformat(since).isoformat()
+        if until:
+            end = datetime.fromisoformat(until)
+            if len(until) == 10:
+                end += timedelta(days=1)
+            filters["before"] = end.isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since/until must be ISO dates, e.g. 2026-02-17")
+    return filters
+
+def list_records(kind, request, tenant, since, until, phone, email, service, cursor, limit):
+    require_admin(request)
+    store = get_tenant(tenant).store
+    filters = record_filters(since, until, phone, email, service)
+    try:
+        records, next_cursor = store.query(kind, filters, cursor, max(1, min(limit, RECORDS_PAGE_MAX)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return {kind: records, "next_cursor": next_cursor}
+
+def export_records(kind, request, tenant, since, until, phone, email, service, format):
+    require_admin(request)
+    store = get_tenant(tenant).store
+    filters = record_filters(since, until, phone, email, service)
+    if format == "csv":
+        lines, media_type = csv_lines(kind, store.export(kind, filters)), "text/csv"
+    elif format == "ndjson":
+        lines, media_type = ndjson_lines(store.export(kind, filters)), "application/x-ndjson"
+    else:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    return StreamingResponse(
+        lines,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{tenant}-{kind}.{format}"'}
+    )
+
+@app.get("/appointments")
+def get_appointments(request: Request, since: str = "", until: str = "", phone: str = "", email: str = "",
+                     service: str = "", cursor: str = "", limit: int = 50, tenant: str = DEFAULT_TENANT):
+    """
+    A page of appointment requests, oldest first; pass next_cursor back as
+    `cursor` for the next page.
+    """
+    return list_records("appointments", request, tenant, since, until, phone, email, service, cursor, limit)
+
+@app.get("/appointments/export")
+def appointments_export(request: Request, since: str = "", until: str = "", phone: str = "", email: str = "",
+                        service: str = "", format: str = "ndjson", tenant: str = DEFAULT_TENANT):
+    return export_records("appointments", request, tenant, since, until, phone, email, service, format)
+
+@app.get("/cancellations")
+def get_cancellations(request: Request, since: str = "", until: str = "", phone: str = "", email: str = "",
+                      service: str = "", cursor: str = "", limit: int = 50, tenant: str = DEFAULT_TENANT):
+    return list_records("cancellations", request, tenant, since, until, phone, email, service, cursor, limit)
+
+@app.get("/cancellations/export")
+def cancellations_export(request: Request, since: str = "", until: str = "", phone: str = "", email: str = "",
+                         service: str = "", format: str = "ndjson", tenant: str = DEFAULT_TENANT):
+    return export_records("cancellations", request, tenant, since, until, phone, email, service, format)
+
+@app.get("/stats/cancellations")
+def cancellation_stats(tenant: str = DEFAULT_TENANT):
+    """
+    Cancellation counts per reason cluster, service, booking state and day,
+    from the incrementally maintained rollups.
+    """
+    return get_tenant(tenant).rollups.stats()
+
+@app.get("/facts")
+def facts(tenant: str = DEFAULT_TENANT):
+    """
+    Hours, phone, address and services catalog, for the date and service pickers.
+    """
+    clinic_facts = get_tenant(tenant).facts
+    return dict(clinic_facts.to_dict(), answered=clinic_facts.stats())
+
+@app.get("/tenants/stats")
+def tenant_stats():
+    """
+    Known and loaded tenants, and the index pool.
+    """
+    return {
+        "tenants": tenants.keys(),
+        "loaded": [t.key for t in tenants.loaded()],
+        "index_pool": index_pool.stats(),
+    }
+
+@app.get("/admission/stats")
+def admission_stats():
+    return admission.stats()
+
+@app.get("/sessions/stats")
+def session_stats():
+    return sessions.stats()
+
+metrics.registry.gauge("cnbot_sessions", "Sessions held by the session store.", lambda: sessions.stats()["sessions"])
+metrics.registry.gauge(
+    "cnbot_semantic_cache_entries", "Answers in the semantic cache.",
+    lambda: {(t.key,): t.semantic_cache.stats()["entries"] for t in tenants.loaded()}, labels=("tenant",)
+)
+metrics.registry.gauge(
+    "cnbot_semantic_cache_hit_rate", "Semantic cache hit rate since start.",
+    lambda: {(t.key,): t.semantic_cache.stats()["hit_rate"] for t in tenants.loaded()}, labels=("tenant",)
+)
+metrics.registry.gauge("cnbot_index_pool_bytes", "Footprint of the tenant indexes held by the index pool.",
+                       lambda: sum(e.nbytes for _, e in index_pool.resident()))
+metrics.registry.gauge("cnbot_index_pool_indexes", "Tenant indexes held by the index pool.", lambda: len(index_pool.resident()))
+metrics.registry.gauge("cnbot_turns_in_flight", "Chat turns holding an admission slot.", lambda: admission.in_flight)
+metrics.registry.gauge("cnbot_turns_queued", "Chat turns waiting for an admission slot.", lambda: admission.queued)
+metrics.registry.gauge("cnbot_embedding_cache_hit_rate", "Query embedding cache hit rate since start.", lambda: embedding_cache.stats()["hit_rate"])
+metrics.registry.gauge(
+    "cnbot_llm_circuit_open", "1 while the LLM circuit breaker is open or half-open.", lambda: int(llm_gateway.breaker.state != "closed")
+)
+metrics.registry.gauge(
+    "cnbot_intent_decisions",
+    "Intent classifier decisions by task and outcome.",
+    lambda: {(task, outcome): n for task, c in intent_classifier.counts.items() for outcome, n in c.items()},
+    labels=("task", "outcome")
+)
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(q: Query, request: Request):
+    """
+    Same turn logic as /chat, but streams RAG tokens as Server-Sent Events.
+    Events: "token" ({"text"}) while generating, then one "done" with the final
+    reply (including any booking resume transition) and ui_action.
+    """
+    client_ip = request.client.host
+    await enter_tenant(q)
+    check_rate_limits(q, client_ip)
+    # Reject before the 200 goes out, so an overloaded server answers with a
+    # 503 the client can back off from; a turn admitted here can still time
+    # out waiting for its slot, which ends the stream with an "error" event.
+    shed = shed_answer(q)
+    if shed is None:
+        try:
+            admission.check()
+        except Overloaded as e:
+            raise busy_error(e)
+
+    async def events():
+        _current_tenant.set(q.tenant)
+        metrics.start_trace("chat_stream", q.session_id)
+        start_warmup()
+        try:
+            if shed is not None:
+                metrics.set_path("shed")
+                yield sse_event("token", {"text": shed})
+                yield sse_event("done", {"reply": shed, "degraded": True})
+                return
+
+            async with admission.slot(), session_turn(q.session_id):
+                booking_response = await handle_booking_turn(q, client_ip)
+                if booking_response:
+                    yield sse_event("done", booking_response)
+                    return
+
+                answer, prompt, vector = prepared_rag.pop(q.session_id, None) or await prepare_rag(q.message)
+                if answer is not None:
+                    yield sse_event("token", {"text": answer})
+                    yield sse_event("done", finish_rag_turn(q.session_id, q.message, answer))
+                    return
+
+                parts = []
+                degraded = False
+                async for chunk in llm_gateway.stream(prompt, call_site="rag_answer", fallback=tenant().degraded_answer):
+                    degraded = getattr(chunk, "degraded", False)
+                    text = chunk.content if isinstance(chunk.content, str) else "".join(
+                        p.get("text", "") if isinstance(p, dict) else str(p) for p in chunk.content
+                    )
+                    if text:
+                        parts.append(text)
+                        yield sse_event("token", {"text": text})
+
+                answer = "".join(parts)
+                if degraded:
+                    metrics.set_path("degraded")
+                else:
+                    tenant().semantic_cache.put(q.message, vector, answer)
+                yield sse_event("done", finish_rag_turn(q.session_id, q.message, answer))
+        except Overloaded as e:
+            metrics.set_path("rejected")
+            yield sse_event("error", {"reply": BUSY_ANSWER.format(phone=tenant().facts.phone), "retry_after": int(retry_after_header(e.retry_after))})
+        except IndexNotReady:
+            metrics.set_path("not_ready")
+            yield sse_event("error", {"reply": "I'm still starting up. Please try again in a moment.", "retry_after": 5})
+        except Exception as e:
+            print(f"Stream error: {e}")
+            yield sse_event("error", {"reply": "Sorry, something went wrong."})
+        finally:
+            prepared_rag.pop(q.session_id, None)
+            metrics.end_trace()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,304 @@
+"""
+Latency tracing and Prometheus-style metrics.
+
+Each /chat turn gets a trace (held in a contextvar, so concurrent turns don't
+mix). `with span("similarity_search"):` times a stage into the
+`cnbot_stage_seconds` histogram and appends it to the current trace. When the
+turn ends, the per-turn totals are recorded and, if TRACE_LOG is set, the whole
+trace is queued as one JSON line for a writer thread, so the event loop never
+waits on the disk.
+"""
+import os
+import json
+import time
+import queue
+import threading
+import contextvars
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _labels(names, values, extra=""):
+    pairs = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _fmt(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, key)} {_fmt(value)}")
+        return lines
+
+class Gauge(Metric):
+    """
+    Gauge read from a callback at scrape time. The callback returns a number,
+    or a dict of {label value tuple: number} for labelled gauges.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn, labels=()):
+        super().__init__(name, help_text, labels)
+        self.fn = fn
+
+    def render(self):
+        lines = self.header()
+        try:
+            value = self.fn()
+        except Exception as e:
+            print(f"Gauge {self.name} error: {e}")
+            return lines
+        if isinstance(value, dict):
+            for key, v in sorted(value.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, key)} {_fmt(v)}")
+        else:
+            lines.append(f"{self.name} {_fmt(value)}")
+        return lines
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        # label values -> [bucket counts..., sum, count]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = self.header()
+        for key, state in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, state):
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {count}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {state[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {state[-2]!r}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {state[-1]}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, fn, labels=()):
+        return self.register(Gauge(name, help_text, fn, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+turn_seconds = registry.histogram("cnbot_turn_seconds", "End-to-end latency of a chat turn.", labels=("endpoint", "path"))
+stage_seconds = registry.histogram("cnbot_stage_seconds", "Latency of each stage of a chat turn.", labels=("stage",))
+llm_calls = registry.counter("cnbot_llm_calls_total", "LLM calls by call site and outcome.", labels=("call_site", "outcome"))
+llm_attempts = registry.counter(
+    "cnbot_llm_attempts_total", "LLM requests sent by the gateway, by call site, kind (primary / retry / hedge) and outcome.",
+    labels=("call_site", "kind", "outcome")
+)
+llm_tokens = registry.counter("cnbot_llm_tokens_total", "LLM tokens by call site and direction.", labels=("call_site", "direction"))
+llm_calls_per_turn = registry.histogram(
+    "cnbot_llm_calls_per_turn", "LLM calls made while handling one chat turn.", buckets=(0, 1, 2, 3, 4, 5, 8)
+)
+turns = registry.counter("cnbot_turns_total", "Chat turns by how they were answered.", labels=("endpoint", "path"))
+retrievals = registry.counter("cnbot_retrievals_total", "Chunk retrievals by mode (exact, hybrid, dense).", labels=("mode",))
+prompt_tokens = registry.counter(
+    "cnbot_prompt_tokens_total", "Estimated prompt tokens before (raw) and after (sent) context budgeting.", labels=("call_site", "kind")
+)
+turn_plans = registry.counter(
+    "cnbot_turn_plans_total", "Turn planner results by intent (invalid when the reply failed validation).", labels=("intent",)
+)
+speculations = registry.counter(
+    "cnbot_speculations_total", "Speculative RAG runs during booking turns by stage and outcome (used / wasted).", labels=("stage", "outcome")
+)
+speculation_wasted_seconds = registry.counter(
+    "cnbot_speculation_wasted_seconds_total", "Time spent on speculative RAG work that was discarded.", labels=("stage",)
+)
+index_pool_loads = registry.counter("cnbot_index_pool_loads_total", "Tenant indexes loaded into the index pool.", labels=("tenant",))
+index_pool_load_seconds = registry.counter(
+    "cnbot_index_pool_load_seconds_total", "Time spent loading tenant indexes.", labels=("tenant",)
+)
+index_pool_evictions = registry.counter(
+    "cnbot_index_pool_evictions_total", "Tenant indexes evicted to stay within the pool's memory budget.", labels=("tenant",)
+)
+admissions = registry.counter(
+    "cnbot_admissions_total", "Chat turns by admission outcome (admitted, shed, rate limited, rejected).", labels=("outcome",)
+)
+batch_size = registry.histogram(
+    "cnbot_batch_size", "Items per retrieval micro-batch.", labels=("stage",), buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+
+# --- Per-turn tracing ---
+
+TRACE_LOG = os.environ.get("TRACE_LOG")
+_trace_lock = threading.Lock()
+_trace_queue = queue.Queue()
+_trace_writer = None
+_current = contextvars.ContextVar("cnbot_trace", default=None)
+
+def _write_traces():
+    with open(TRACE_LOG, "a") as f:
+        while True:
+            # Lines queued meanwhile go out in the same write; None stops the writer
+            lines = [_trace_queue.get()]
+            while not _trace_queue.empty():
+                lines.append(_trace_queue.get_nowait())
+            f.write("".join(line + "\n" for line in lines if line is not None))
+            f.flush()
+            if None in lines:
+                return
+
+def _queue_trace(line):
+    global _trace_writer
+    with _trace_lock:
+        if _trace_writer is None:
+            _trace_writer = threading.Thread(target=_write_traces, name="trace-log", daemon=True)
+            _trace_writer.start()
+    _trace_queue.put(line)
+
+def close_trace_log():
+    """
+    Writes the queued trace lines and stops the writer (at shutdown).
+    """
+    global _trace_writer
+    with _trace_lock:
+        writer, _trace_writer = _trace_writer, None
+    if writer is not None:
+        _trace_queue.put(None)
+        writer.join(timeout=5)
+
+def start_trace(endpoint, session_id):
+    trace = {
+        "endpoint": endpoint,
+        "session_id": session_id,
+        "started_at": time.time(),
+        "spans": [],
+        "llm_calls": 0,
+        "tokens": {"input": 0, "output": 0},
+        "prompt_tokens_saved": 0,
+        "speculation": None,
+        "path": "unknown",
+    }
+    _current.set(trace)
+    return trace
+
+def set_path(path):
+    """
+    Records how the turn was answered (booking / rag / cache / ...).
+    """
+    trace = _current.get()
+    if trace is not None:
+        trace["path"] = path
+
+def end_trace():
+    trace = _current.get()
+    if trace is None:
+        return
+    _current.set(None)
+    total = time.time() - trace["started_at"]
+    turn_seconds.observe(total, endpoint=trace["endpoint"], path=trace["path"])
+    turns.inc(endpoint=trace["endpoint"], path=trace["path"])
+    llm_calls_per_turn.observe(trace["llm_calls"])
+    if TRACE_LOG:
+        trace["total_ms"] = round(total * 1000, 2)
+        _queue_trace(json.dumps(trace))
+
+@contextmanager
+def span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage=stage)
+        trace = _current.get()
+        if trace is not None:
+            trace["spans"].append({"stage": stage, "ms": round(elapsed * 1000, 2)})
+
+def record_llm_call(call_site, outcome="ok", response=None):
+    """
+    Counts one LLM call and, when the response carries usage metadata, its tokens.
+    """
+    llm_calls.inc(call_site=call_site, outcome=outcome)
+    trace = _current.get()
+    if trace is not None:
+        trace["llm_calls"] += 1
+    usage = getattr(response, "usage_metadata", None) or {}
+    for direction, key in (("input", "input_tokens"), ("output", "output_tokens")):
+        count = usage.get(key) or 0
+        if count:
+            llm_tokens.inc(count, call_site=call_site, direction=direction)
+            if trace is not None:
+                trace["tokens"][direction] += count
+
+def record_prompt(call_site, raw_tokens, sent_tokens):
+    """
+    Counts the estimated prompt tokens saved by context budgeting.
+    """
+    prompt_tokens.inc(raw_tokens, call_site=call_site, kind="raw")
+    prompt_tokens.inc(sent_tokens, call_site=call_site, kind="sent")
+    trace = _current.get()
+    if trace is not None:
+        trace["prompt_tokens_saved"] += raw_tokens - sent_tokens
+
+def record_speculation(stage, outcome, wasted_seconds=0.0):
+    """
+    Counts one speculative RAG run and, when discarded, the time it spent.
+    """
+    speculations.inc(stage=stage, outcome=outcome)
+    if wasted_seconds:
+        speculation_wasted_seconds.inc(wasted_seconds, stage=stage)
+    trace = _current.get()
+    if trace is not None:
+        trace["speculation"] = outcome
@@ -0,0 +1,100 @@
+"""
+Single-call turn planner for messages sent during a booking.
+
+When the local fast path can't tell whether an in-flow message answers the
+bot's question, the sequential path makes up to two Gemini round trips:
+llm_interruption, then the RAG answer if it was an interruption. With
+TURN_PLANNER=1, main.py makes one call instead and asks for a JSON plan,
+validated against TurnPlan:
+
+    intent   "answer" | "interruption" | "cancel" | "edit"
+    slots    booking details found in the message (name, phone, email, service, date)
+    field    the detail to change, for "edit"
+    answer   the reply to the user's question, for "interruption"
+
+The retrieved context goes into the same prompt, so an interruption is
+answered without a second call. parse_plan() returns None for a reply that
+isn't valid JSON or doesn't match the schema; the caller then falls back to
+the sequential path.
+"""
+import json
+from typing import Literal, Optional
+
+from pydantic import BaseModel, ValidationError
+
+FIELDS = ("name", "phone", "email", "service", "date")
+
+class Slots(BaseModel):
+    name: Optional[str] = None
+    phone: Optional[str] = None
+    email: Optional[str] = None
+    service: Optional[str] = None
+    date: Optional[str] = None
+
+    def found(self):
+        """
+        The non-empty slots, as a dict.
+        """
+        return {k: v.strip() for k, v in self.model_dump().items() if v and v.strip()}
+
+class TurnPlan(BaseModel):
+    intent: Literal["answer", "interruption", "cancel", "edit"]
+    slots: Slots = Slots()
+    field: Optional[Literal["name", "phone", "email", "service", "date"]] = None
+    answer: Optional[str] = None
+
+PLANNER_PROMPT = """
+You are handling one message in an appointment booking conversation.
+The bot just asked the user for their {field} (state {state}).
+Booking details collected so far: {collected}
+
+Recent conversation:
+{history}
+
+User message: "{message}"
+
+Classify the message:
+- "answer": it gives the requested information, or otherwise continues the booking.
+- "interruption": it is a separate question. Reply to it in "answer", following the assistant instructions and context below.
+- "cancel": the user no longer wants to book.
+- "edit": the user wants to change a detail they already gave. Put that detail in "field" (name, phone, email, service or date).
+
+Put any booking details stated in the message in "slots", exactly as the user wrote them; use null for the rest.
+
+Return ONLY a JSON object of this form:
+{{"intent": "answer", "slots": {{"name": null, "phone": null, "email": null, "service": null, "date": null}}, "field": null, "answer": null}}
+
+Assistant instructions and context, for answering questions:
+{rag_prompt}
+"""
+
+def build_planner_prompt(state, field, collected, history, message, rag_prompt):
+    return PLANNER_PROMPT.format(
+        state=state,
+        field=field or "reply",
+        collected=json.dumps(collected) if collected else "none",
+        history=history or "(none)",
+        message=message,
+        rag_prompt=rag_prompt,
+    )
+
+def _json_block(content: str) -> str:
+    # Strip code fences if present
+    if "```json" in content:
+        return content.split("```json")[1].split("```")[0]
+    if "```" in content:
+        return content.split("```")[1].split("```")[0]
+    return content
+
+def parse_plan(content: str):
+    """
+    Returns the TurnPlan in an LLM reply, or None if it doesn't validate.
+    """
+    try:
+        plan = TurnPlan.model_validate(json.loads(_json_block(content.strip())))
+    except (ValueError, ValidationError) as e:
+        print(f"Turn plan rejected: {e}")
+        return None
+    if plan.answer is not None and not plan.answer.strip():
+        plan.answer = None
+    return plan
@@ -1,13 +1,13 @@
 import os
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+import argparse
+from indexer import build_index
+from scrapper import PAGES_PATH, SITE_PATH, URLS, load_pages
+from facts import load_facts
 
-# Construct absolute path to data/site.txt
+# Construct absolute path to data/
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(current_dir)
-data_path = os.path.join(project_root, "data", "site.txt")
-vectors_path = os.path.join(project_root, "data", "vectors")
+data_dir = os.path.join(project_root, "data")
 
 from dotenv import load_dotenv
 load_dotenv(os.path.join(project_root, ".env"))
@@ -15,18 +15,35 @@ load_dotenv(os.path.join(project_root, ".env"))
 if not os.environ.get("GOOGLE_API_KEY") and os.environ.get("GEMINI_API_KEY"):
     os.environ["GOOGLE_API_KEY"] = os.environ.get("GEMINI_API_KEY")
 
-text = open(data_path).read()
-
-splitter = RecursiveCharacterTextSplitter(
-    chunk_size=500,
-    chunk_overlap=100
-)
-
-chunks = splitter.split_text(text)
-
-embeddings = HuggingFaceEmbeddings(
-    model_name="all-MiniLM-L6-v2"
-)
-
-db = FAISS.from_texts(chunks, embeddings)
-db.save_local(vectors_path)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally (re)build the FAISS index from the scraped pages")
+    parser.add_argument("--full", action="store_true", help="Re-embed every chunk instead of only new/changed ones")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("INDEX_WORKERS", "1")), help="Embedding processes")
+    parser.add_argument("--batch-size", type=int, default=64, help="Chunks per embedding batch")
+    parser.add_argument("--data-dir", default=data_dir, help="Clinic data directory, e.g. data/tenants/<key> for another tenant")
+    args = parser.parse_args()
+
+    # Prefer per-page documents so chunks carry their source URL and only
+    # changed pages produce new chunks; fall back to the concatenated site.txt.
+    pages_path = os.path.join(args.data_dir, os.path.basename(PAGES_PATH))
+    if os.path.exists(pages_path):
+        documents = [(page["text"], {"source": page["url"]}) for page in load_pages(pages_path)]
+    else:
+        documents = [(open(os.path.join(args.data_dir, "site.txt")).read(), {"source": "site.txt"})]
+
+    # Service and product names for BM25 exact matching (see lexical.py)
+    if os.path.abspath(args.data_dir) == os.path.abspath(data_dir):
+        facts = load_facts(SITE_PATH, URLS)
+    else:
+        facts = load_facts(os.path.join(args.data_dir, "site.txt"), (), path=os.path.join(args.data_dir, "facts.json"))
+    known_names = [service for category in facts.catalog for service in category["services"]]
+
+    summary = build_index(
+        documents,
+        vectors_path=os.path.join(args.data_dir, "vectors"),
+        full=args.full,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        known_names=known_names
+    )
+    print(summary)
@@ -0,0 +1,164 @@
+"""
+Cancellation analytics, maintained on every write.
+
+ReasonClusters maps a free-text cancellation reason to one of a few reason
+clusters: the nearest prototype centroid over the MiniLM embeddings we
+already load, or "other" below min_similarity. The cluster is stored on
+the cancellation record, so it is computed once per reason.
+
+CancellationRollups keeps counters per reason cluster, service, booking
+state reached and day. add() is called for each new cancellation and
+stats() copies bounded dicts (days older than keep_days are dropped), so
+reading the rollups costs the same however long the history is. At startup
+catch_up() restores the counters from a checkpoint in the store and counts
+only the cancellations written after it, then saves a new checkpoint; after
+that they are updated by this worker's own writes. With several workers,
+each counts what it wrote since its last restart.
+"""
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+import numpy as np
+
+UNCLASSIFIED = "unclassified"
+CHECKPOINT = "cancellation_rollups"
+# Bump when the counters change meaning (e.g. how services are keyed), so
+# old checkpoints are ignored and the history is counted again
+CHECKPOINT_FORMAT = 1
+
+REASON_PROTOTYPES = {
+    "price": [
+        "it's too expensive", "found a cheaper option", "I can't afford it right now",
+        "the price is higher than I expected", "insurance doesn't cover it",
+    ],
+    "schedule": [
+        "the times don't work for me", "I'm too busy this week", "I have a scheduling conflict",
+        "I need to check my calendar first", "I'll be out of town",
+    ],
+    "went_elsewhere": [
+        "I booked with another clinic", "I'm going somewhere else", "my friend recommended another place",
+        "I already have a provider",
+    ],
+    "not_ready": [
+        "I changed my mind", "I need to think about it", "I'm not ready yet", "just browsing for now",
+        "I'll come back later",
+    ],
+    "health": [
+        "I'm sick", "my doctor advised against it", "I'm pregnant", "I'm worried about side effects",
+        "I'm on medication",
+    ],
+    "prefers_contact": [
+        "I'd rather call the clinic", "I want to talk to a person", "this chat is confusing",
+        "it's taking too long", "I'll email instead",
+    ],
+}
+
+class ReasonClusters:
+    def __init__(self, embed_documents, min_similarity=0.3):
+        self.embed_documents = embed_documents
+        self.min_similarity = min_similarity
+        self.labels = list(REASON_PROTOTYPES)
+        self._centroids = None
+        self._lock = threading.Lock()
+
+    def _ensure_centroids(self):
+        if self._centroids is None:
+            with self._lock:
+                if self._centroids is None:
+                    centroids = []
+                    for label in self.labels:
+                        vectors = np.asarray(self.embed_documents(REASON_PROTOTYPES[label]), dtype=np.float32)
+                        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+                        centroid = vectors.mean(axis=0)
+                        centroids.append(centroid / np.linalg.norm(centroid))
+                    self._centroids = np.stack(centroids)
+        return self._centroids
+
+    def warm(self):
+        self._ensure_centroids()
+
+    def assign(self, vector) -> str:
+        """
+        The reason cluster for an embedded reason.
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return "other"
+        similarities = self._ensure_centroids() @ (vector / norm)
+        best = int(np.argmax(similarities))
+        return self.labels[best] if similarities[best] >= self.min_similarity else "other"
+
+class CancellationRollups:
+    def __init__(self, keep_days=90, service_key=None):
+        """
+        service_key: maps a booking's service text to the name it is counted
+        under (default: lowercased).
+        """
+        self.keep_days = keep_days
+        self.service_key = service_key or (lambda service: " ".join(str(service).lower().split()))
+        self.total = 0
+        self.by_reason = Counter()
+        self.by_service = Counter()
+        self.by_state = Counter()
+        self.by_day = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        data = record.get("data") or {}
+        service = self.service_key(data["service"]) if data.get("service") else "none"
+        day = (record.get("cancelled_at") or "")[:10] or "unknown"
+        with self._lock:
+            self.total += 1
+            self.by_reason[record.get("reason_cluster") or UNCLASSIFIED] += 1
+            self.by_service[service or "none"] += 1
+            self.by_state[record.get("state") or "unknown"] += 1
+            if day not in self.by_day:
+                self.by_day[day] = 0
+                self._prune_days()
+            self.by_day[day] += 1
+
+    def _prune_days(self):
+        cutoff = (datetime.now() - timedelta(days=self.keep_days)).date().isoformat()
+        for day in [d for d in self.by_day if d < cutoff]:
+            del self.by_day[day]
+
+    def catch_up(self, store):
+        """
+        Restores the counters checkpointed in store (see db.py), adds the
+        cancellations written since, and checkpoints the result.
+        """
+        state = store.load_checkpoint(CHECKPOINT)
+        cursor = None
+        if state and state.get("format") == CHECKPOINT_FORMAT and state.get("keep_days") == self.keep_days:
+            with self._lock:
+                self.total = state["total"]
+                for name in ("by_reason", "by_service", "by_state", "by_day"):
+                    setattr(self, name, Counter(state[name]))
+                self._prune_days()
+            cursor = state["cursor"]
+        for record, cursor in store.tail("cancellations", cursor):
+            self.add(record)
+        with self._lock:
+            state = {
+                "format": CHECKPOINT_FORMAT,
+                "keep_days": self.keep_days,
+                "cursor": cursor,
+                "total": self.total,
+                "by_reason": dict(self.by_reason),
+                "by_service": dict(self.by_service),
+                "by_state": dict(self.by_state),
+                "by_day": dict(self.by_day),
+            }
+        store.save_checkpoint(CHECKPOINT, state)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "total": self.total,
+                "by_reason": dict(self.by_reason.most_common()),
+                "by_service": dict(self.by_service.most_common()),
+                "by_state": dict(self.by_state.most_common()),
+                "by_day": dict(sorted(self.by_day.items())),
+            }
@@ -1,7 +1,33 @@
+"""
+Site crawler for the clinic knowledge base.
+
+Fetches URLS concurrently over a pooled requests.Session with timeouts and
+retries. Each page is cached on disk with its ETag/Last-Modified validators, so
+refreshes send conditional requests and unchanged pages cost a 304. The output
+is one document per page (data/pages.jsonl, with the source URL and a content
+hash) plus the concatenated data/site.txt used before.
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
 
-import re
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+CACHE_DIR = os.path.join(project_root, "data", "cache", "pages")
+PAGES_PATH = os.path.join(project_root, "data", "pages.jsonl")
+SITE_PATH = os.path.join(project_root, "data", "site.txt")
+
+# (connect, read) seconds
+TIMEOUT = (5, 20)
 
 URLS = [
     "https://mycnmedical.com/",
@@ -53,30 +79,145 @@ URLS = [
     "https://mycnmedical.com/services/facials-and-skin-treatments/chemical-peels/"
 ]
 
+def make_session(concurrency=8, retries=3):
+    """
+    requests.Session with a connection pool sized for the crawl concurrency and
+    exponential-backoff retries on connection errors and 429/5xx responses.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+    )
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = "cn-bot-crawler/1.0"
+    return session
+
+def html_to_text(html):
+    soup = BeautifulSoup(html, "html.parser")
+    # Use simple separator and strip whitespace
+    text = soup.get_text(separator="\n", strip=True)
+    # Collapse multiple newlines into one
+    return re.sub(r'\n+', '\n', text)
+
+def _cache_path(cache_dir, url):
+    return os.path.join(cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+def _read_cache(cache_dir, url):
+    if not cache_dir:
+        return None
+    path = _cache_path(cache_dir, url)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError:
+            return None
+
+def _write_cache(cache_dir, entry):
+    if not cache_dir:
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _cache_path(cache_dir, entry["url"])
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(entry, f)
+    os.replace(tmp, path)
+
+def fetch_page(session, url, cache_dir=CACHE_DIR):
+    """
+    Fetches one page, revalidating the cached copy when there is one.
+    Returns {"url", "text", "hash", "status"} where status is "new",
+    "changed", "unchanged" (304 or same content) or "error" (cached text, if any).
+    """
+    cached = _read_cache(cache_dir, url)
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    try:
+        response = session.get(url, headers=headers, timeout=TIMEOUT)
+        if response.status_code == 304 and cached:
+            return {"url": url, "text": cached["text"], "hash": cached["hash"], "status": "unchanged"}
+        response.raise_for_status()
+    except requests.RequestException as e:
+        print(f"Fetch error for {url}: {e}")
+        if cached:
+            return {"url": url, "text": cached["text"], "hash": cached["hash"], "status": "error"}
+        return {"url": url, "text": "", "hash": None, "status": "error"}
+
+    text = html_to_text(response.text)
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    if cached is None:
+        status = "new"
+    elif cached.get("hash") == digest:
+        status = "unchanged"
+    else:
+        status = "changed"
+
+    _write_cache(cache_dir, {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "text": text,
+        "hash": digest,
+        "fetched_at": time.time(),
+    })
+    return {"url": url, "text": text, "hash": digest, "status": status}
+
+def crawl(urls=URLS, concurrency=8, cache_dir=CACHE_DIR, session=None):
+    """
+    Fetches all urls with at most `concurrency` requests in flight.
+    Returns the page documents in the order of urls.
+    """
+    session = session or make_session(concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="crawl") as pool:
+        return list(pool.map(lambda url: fetch_page(session, url, cache_dir), urls))
+
+def write_pages(pages, pages_path=PAGES_PATH, site_path=SITE_PATH):
+    os.makedirs(os.path.dirname(pages_path), exist_ok=True)
+    with open(pages_path, "w") as f:
+        for page in pages:
+            if page["text"]:
+                f.write(json.dumps({"url": page["url"], "hash": page["hash"], "text": page["text"]}) + "\n")
+    # Concatenated copy for anything still reading site.txt
+    with open(site_path, "w") as f:
+        f.write("\n\n".join(page["text"] for page in pages if page["text"]))
+
+def load_pages(pages_path=PAGES_PATH):
+    with open(pages_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
 def scrape():
-    texts = []
-    for url in URLS:
-        html = requests.get(url).text
-        soup = BeautifulSoup(html, "html.parser")
-        # Use simple separator and strip whitespace
-        text = soup.get_text(separator="\n", strip=True)
-        # Collapse multiple newlines into one
-        clean_text = re.sub(r'\n+', '\n', text)
-        texts.append(clean_text)
-    return "\n\n".join(texts)
+    return "\n\n".join(page["text"] for page in crawl() if page["text"])
 
 if __name__ == "__main__":
-    text = scrape()
-    import os
-    # Get the directory of the current script (backend/)
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    # Go up one level to the project root
-    project_root = os.path.dirname(current_dir)
-    # Construct absolute path to data/site.txt
-    data_path = os.path.join(project_root, "data", "site.txt")
-    
-    # Ensure data directory exists
-    os.makedirs(os.path.dirname(data_path), exist_ok=True)
-    
-    with open(data_path, "w") as f:
-        f.write(text)
+    parser = argparse.ArgumentParser(description="Crawl the clinic site into data/pages.jsonl and data/site.txt")
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get("SCRAPE_CONCURRENCY", "8")))
+    parser.add_argument("--no-cache", action="store_true", help="Ignore the on-disk page cache")
+    args = parser.parse_args()
+
+    started = time.time()
+    pages = crawl(concurrency=args.concurrency, cache_dir=None if args.no_cache else CACHE_DIR)
+    write_pages(pages)
+
+    # Hours, phone, address and services catalog for deterministic answers
+    from facts import CLINIC_HOURS, build_facts, write_facts
+    conflicts = []
+    with open(SITE_PATH) as f:
+        write_facts(build_facts(f.read(), URLS, CLINIC_HOURS, conflicts))
+    for conflict in conflicts:
+        print(f"Hours: {conflict}")
+
+    counts = {}
+    for page in pages:
+        counts[page["status"]] = counts.get(page["status"], 0) + 1
+    print(f"Crawled {len(pages)} pages in {time.time() - started:.1f}s: {counts}")
@@ -0,0 +1,296 @@
+"""
+Chat session stores.
+
+main.py uses a store like the old module-level dict (`sid in sessions`,
+`sessions[sid]`, `sessions[sid] = {...}`), between `load(sid)` at the start of
+a turn and `flush(sid)` at its end (see session_turn() in main.py). Flushing
+is where TTL refresh, history trimming, eviction and (for the SQLite
+backend) persistence happen. `peek(sid)` is a read-only lookup for code
+outside a turn. Stores with `blocking = True` do file I/O in load() and
+flush(), which main.py runs off the event loop.
+
+- MemorySessionStore: per-process LRU + TTL, bounded by SESSION_MAX.
+- SQLiteSessionStore: one shared SQLite file, so several uvicorn workers can
+  serve the same conversation.
+"""
+import os
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from itertools import islice
+from collections import OrderedDict
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+
+SESSION_FORMAT_VERSION = 1
+# Payloads larger than this are zlib-compressed
+COMPRESS_OVER_BYTES = 256
+
+def encode_session(session: dict) -> bytes:
+    """
+    Compact, versioned encoding: one version byte, one codec byte ("j" plain
+    JSON / "z" zlib JSON), then the payload.
+    """
+    raw = json.dumps(session, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if len(raw) > COMPRESS_OVER_BYTES:
+        return bytes([SESSION_FORMAT_VERSION]) + b"z" + zlib.compress(raw)
+    return bytes([SESSION_FORMAT_VERSION]) + b"j" + raw
+
+def decode_session(payload: bytes):
+    """
+    Returns the session dict, or None if the payload was written by an
+    incompatible format version (the conversation simply starts over).
+    """
+    if not payload or payload[0] != SESSION_FORMAT_VERSION:
+        return None
+    body = payload[2:]
+    if payload[1:2] == b"z":
+        body = zlib.decompress(body)
+    return json.loads(body)
+
+class SessionStore:
+    blocking = False
+
+    def __init__(self, ttl_seconds=7200, max_history=20):
+        self.ttl_seconds = ttl_seconds
+        self.max_history = max_history
+
+    def load(self, session_id):
+        """
+        Called once at the start of every turn, before the session is used.
+        """
+
+    def peek(self, session_id):
+        """
+        The session, or None; doesn't refresh, load or keep anything.
+        """
+        raise NotImplementedError
+
+    def __contains__(self, session_id):
+        raise NotImplementedError
+
+    def __getitem__(self, session_id):
+        raise NotImplementedError
+
+    def __setitem__(self, session_id, session):
+        raise NotImplementedError
+
+    def flush(self, session_id):
+        """
+        Called once at the end of every turn.
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+    def _trim(self, session):
+        history = session.get("history")
+        if history and len(history) > self.max_history:
+            session["history"] = history[-self.max_history:]
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, max_sessions=10000, **kwargs):
+        super().__init__(**kwargs)
+        self.max_sessions = max_sessions
+        # session_id -> session dict, least recently used first
+        self._sessions = OrderedDict()
+        self._expires = {}
+        # Encoded size at the last flush, as a cheap memory estimate
+        self._sizes = {}
+        self.evictions = 0
+        self.expirations = 0
+
+    def _drop(self, session_id):
+        self._sessions.pop(session_id, None)
+        self._expires.pop(session_id, None)
+        self._sizes.pop(session_id, None)
+
+    def _expired(self, session_id):
+        expires = self._expires.get(session_id)
+        if expires is not None and expires < time.time():
+            self._drop(session_id)
+            self.expirations += 1
+            return True
+        return False
+
+    def peek(self, session_id):
+        expires = self._expires.get(session_id)
+        if expires is not None and expires < time.time():
+            return None
+        return self._sessions.get(session_id)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions and not self._expired(session_id)
+
+    def __getitem__(self, session_id):
+        if self._expired(session_id):
+            raise KeyError(session_id)
+        self._sessions.move_to_end(session_id)
+        return self._sessions[session_id]
+
+    def __setitem__(self, session_id, session):
+        self._sessions[session_id] = session
+        self._sessions.move_to_end(session_id)
+        self._expires.setdefault(session_id, time.time() + self.ttl_seconds)
+
+    def flush(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            return
+        self._trim(session)
+        self._expires[session_id] = time.time() + self.ttl_seconds
+        self._sizes[session_id] = len(encode_session(session))
+        self._evict()
+
+    def _evict(self):
+        now = time.time()
+        # Expired sessions sit among the least recently used, so scan from the front
+        for session_id in list(islice(self._sessions, 100)):
+            if self._expires.get(session_id, now) < now:
+                self._drop(session_id)
+                self.expirations += 1
+        while len(self._sessions) > self.max_sessions:
+            oldest = next(iter(self._sessions))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "approx_bytes": sum(self._sizes.values()),
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions persisted in a SQLite file shared by all worker processes. A turn
+    works on an in-process copy that load() reads and flush() writes back and
+    releases, so memory only holds the sessions with a turn in flight.
+    Concurrent turns of one session share the copy, which is released when
+    the last of them flushes. Outside a turn, lookups read the file and keep
+    nothing.
+    """
+    blocking = True
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._local = threading.local()
+        # session_id -> [session or None, turns in flight]
+        self._active = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.expirations = 0
+        self._connect().executescript("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            payload BLOB NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions(expires_at);
+        """)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def _load(self, session_id):
+        row = self._connect().execute(
+            "SELECT payload FROM sessions WHERE id = ? AND expires_at > ?", (session_id, time.time())
+        ).fetchone()
+        return decode_session(row[0]) if row else None
+
+    def load(self, session_id):
+        with self._lock:
+            entry = self._active.get(session_id)
+            if entry is not None:
+                entry[1] += 1
+                return
+        session = self._load(session_id)
+        with self._lock:
+            entry = self._active.setdefault(session_id, [session, 0])
+            entry[1] += 1
+
+    def peek(self, session_id):
+        with self._lock:
+            entry = self._active.get(session_id)
+        if entry is not None:
+            return entry[0]
+        return self._load(session_id)
+
+    def __contains__(self, session_id):
+        return self.peek(session_id) is not None
+
+    def __getitem__(self, session_id):
+        session = self.peek(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return session
+
+    def __setitem__(self, session_id, session):
+        with self._lock:
+            self._active.setdefault(session_id, [None, 0])[0] = session
+
+    def flush(self, session_id):
+        with self._lock:
+            entry = self._active.get(session_id)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._active[session_id]
+        session = entry[0]
+        if session is None:
+            return
+        self._trim(session)
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (id, payload, expires_at) VALUES (?, ?, ?)",
+            (session_id, encode_session(session), time.time() + self.ttl_seconds),
+        )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            cur = conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+            self.expirations += cur.rowcount
+
+    def stats(self):
+        count, size = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM sessions WHERE expires_at > ?", (time.time(),)
+        ).fetchone()
+        return {
+            "backend": "sqlite",
+            "sessions": count,
+            "active_in_process": len(self._active),
+            "stored_bytes": size,
+            "expirations": self.expirations,
+        }
+
+def open_session_store(backend=None):
+    """
+    Opens the store selected by SESSION_BACKEND ("memory" default, or "sqlite").
+    """
+    backend = (backend or os.environ.get("SESSION_BACKEND", "memory")).lower()
+    options = {
+        "ttl_seconds": float(os.environ.get("SESSION_TTL", "7200")),
+        "max_history": int(os.environ.get("SESSION_MAX_HISTORY", "20")),
+    }
+    if backend == "memory":
+        return MemorySessionStore(max_sessions=int(os.environ.get("SESSION_MAX", "10000")), **options)
+    if backend == "sqlite":
+        path = os.environ.get("SESSION_DB", os.path.join(project_root, "data", "sessions.db"))
+        return SQLiteSessionStore(path, **options)
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
@@ -0,0 +1,208 @@
+"""
+Multi-clinic tenancy: one deployment serving several clinic sites.
+
+Each tenant has its own data directory:
+
+    data/                   "default", the single-clinic layout
+    data/tenants/<key>/     any other clinic: site.txt and/or facts.json,
+                            vectors/ (built with `rag.py --data-dir`), and
+                            its appointment storage
+
+A chat request picks its tenant with Query.tenant; the read endpoints take
+?tenant=. TenantRegistry builds a tenant's small per-clinic state (facts,
+prompt, store, calendar, rollups, semantic cache) on first use, through the
+factory main.py passes in.
+
+Indexes are the large part, so they live in IndexPool instead: loaded on
+first use, kept in LRU order, and evicted least recently used first once
+the resident total exceeds the memory budget. A tenant's footprint is the
+size of its index version directory: the mmap store maps those files and
+the legacy FAISS index reads them into memory, so either way that is what
+keeping the index resident costs. The index just loaded is never evicted,
+even if it alone exceeds the budget.
+"""
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+import metrics
+from indexer import current_version
+
+DEFAULT_TENANT = "default"
+TENANT_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+
+class UnknownTenant(Exception):
+    pass
+
+class Tenant:
+    """
+    Everything scoped to one clinic except its index (see IndexPool).
+    """
+    def __init__(self, key, data_dir, facts, system_prompt, degraded_answer, store, calendar, rollups, semantic_cache):
+        self.key = key
+        self.data_dir = data_dir
+        self.vectors_path = os.path.join(data_dir, "vectors")
+        self.facts = facts
+        self.system_prompt = system_prompt
+        self.degraded_answer = degraded_answer
+        self.store = store
+        self.calendar = calendar
+        self.rollups = rollups
+        self.semantic_cache = semantic_cache
+
+class TenantRegistry:
+    def __init__(self, data_dir, tenants_dir, build):
+        """
+        build(key, data_dir) -> Tenant, called once per tenant on first use.
+        """
+        self.default_dir = data_dir
+        self.tenants_dir = tenants_dir
+        self.build = build
+        self._tenants = {}
+        self._lock = threading.Lock()
+
+    def data_dir(self, key: str) -> str:
+        if key == DEFAULT_TENANT:
+            return self.default_dir
+        if not TENANT_RE.match(key or ""):
+            raise UnknownTenant(key)
+        directory = os.path.join(self.tenants_dir, key)
+        if not os.path.isdir(directory):
+            raise UnknownTenant(key)
+        return directory
+
+    def get(self, key: str) -> Tenant:
+        """
+        The tenant for `key`; raises UnknownTenant if it has no data directory.
+        """
+        tenant = self._tenants.get(key)
+        if tenant is None:
+            directory = self.data_dir(key)
+            with self._lock:
+                tenant = self._tenants.get(key)
+                if tenant is None:
+                    tenant = self._tenants[key] = self.build(key, directory)
+        return tenant
+
+    def cached(self, key: str):
+        """
+        The tenant if it is already built, else None.
+        """
+        return self._tenants.get(key)
+
+    def loaded(self):
+        return list(self._tenants.values())
+
+    def keys(self):
+        """
+        Every tenant with a data directory, loaded or not.
+        """
+        keys = [DEFAULT_TENANT]
+        if os.path.isdir(self.tenants_dir):
+            keys += sorted(k for k in os.listdir(self.tenants_dir)
+                           if TENANT_RE.match(k) and os.path.isdir(os.path.join(self.tenants_dir, k)))
+        return keys
+
+def directory_bytes(directory: str) -> int:
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+class PoolEntry:
+    def __init__(self, index, version, nbytes):
+        self.index = index
+        self.version = version
+        self.nbytes = nbytes
+
+class IndexPool:
+    def __init__(self, open_index, budget_mb=1024, footprint=directory_bytes):
+        """
+        open_index(directory) -> index. footprint(directory) -> bytes charged
+        against the budget.
+        """
+        self.open_index = open_index
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.footprint = footprint
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def get(self, key):
+        """
+        The resident PoolEntry for `key` (marked most recently used), or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def load(self, key, vectors_path):
+        """
+        Loads the published index of `key` if it isn't resident. Blocking;
+        concurrent loads of the same tenant wait for the first one.
+        """
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            entry = self.get(key)
+            if entry is not None:
+                return entry
+            version, directory = current_version(vectors_path)
+            return self._open(key, version, directory)
+
+    def reload(self, key, vectors_path):
+        """
+        Swaps in a newly published version of a resident index. Returns the
+        new PoolEntry, or None if the index isn't resident or is current.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        version, directory = current_version(vectors_path)
+        if version == entry.version:
+            return None
+        return self._open(key, version, directory)
+
+    def _open(self, key, version, directory):
+        started = time.perf_counter()
+        entry = PoolEntry(self.open_index(directory), version, self.footprint(directory))
+        metrics.index_pool_loads.inc(tenant=key)
+        metrics.index_pool_load_seconds.inc(time.perf_counter() - started, tenant=key)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict(keep=key)
+        return entry
+
+    def _evict(self, keep):
+        total = sum(e.nbytes for e in self._entries.values())
+        for key in list(self._entries):
+            if total <= self.budget_bytes:
+                break
+            if key == keep:
+                continue
+            # In-flight searches keep their reference; the index is freed after them
+            total -= self._entries.pop(key).nbytes
+            metrics.index_pool_evictions.inc(tenant=key)
+            print(f"Evicted index of tenant {key}")
+
+    def resident(self):
+        with self._lock:
+            return list(self._entries.items())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "budget_mb": round(self.budget_bytes / 1024 / 1024, 1),
+                "resident_mb": round(sum(e.nbytes for e in self._entries.values()) / 1024 / 1024, 1),
+                "indexes": {key: {"version": e.version, "mb": round(e.nbytes / 1024 / 1024, 2)} for key, e in self._entries.items()},
+            }
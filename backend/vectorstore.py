@@ -0,0 +1,161 @@
+"""
+Memory-mapped vector store for the published index.
+
+A version directory holds plain arrays instead of a pickled FAISS docstore:
+
+    vectors.f32     float32 rows (count x dim), raw, C order
+    norms.f32       squared L2 norm of each row
+    texts.bin       UTF-8 chunk texts, concatenated
+    offsets.i64     count + 1 byte offsets into texts.bin
+    metadata.json   one metadata dict per row
+    bm25_*          lexical inverted index over the texts (see lexical.py)
+    manifest.json   format, model, dim, count and the chunk id of each row
+
+Everything is opened with np.memmap, so loading is O(1), nothing is
+deserialized with pickle, and every worker process serving the same version
+shares one copy of the pages through the OS page cache. Search is an exact
+L2 scan (the same ranking as the IndexFlatL2 it replaces) and accepts a batch
+of queries at once. hybrid_search() fuses it with BM25 by reciprocal rank.
+"""
+import os
+import json
+
+import numpy as np
+from langchain_core.documents import Document
+
+from lexical import BM25Index, has_bm25, write_bm25
+
+FORMAT = "mmap-v1"
+# Reciprocal rank fusion constant: score = sum over rankings of 1 / (RRF_K + rank)
+RRF_K = 60
+
+def write_store(directory, ids, texts, metadatas, vectors, model, known_names=()):
+    """
+    Writes rows to directory in the layout above. manifest.json is written
+    last, so a directory without it is incomplete. known_names: the clinic's
+    service and product names, for BM25 exact matching (see lexical.py).
+    """
+    os.makedirs(directory, exist_ok=True)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+    vectors.tofile(os.path.join(directory, "vectors.f32"))
+    np.einsum("ij,ij->i", vectors, vectors).astype(np.float32).tofile(os.path.join(directory, "norms.f32"))
+
+    encoded = [text.encode("utf-8") for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    offsets.tofile(os.path.join(directory, "offsets.i64"))
+    with open(os.path.join(directory, "texts.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+
+    with open(os.path.join(directory, "metadata.json"), "w") as f:
+        json.dump(list(metadatas), f)
+    write_bm25(directory, texts, known_names)
+    manifest = {"format": FORMAT, "model": model, "dim": int(vectors.shape[1]), "count": len(ids), "ids": list(ids)}
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+    return manifest
+
+def is_mmap_store(directory) -> bool:
+    path = os.path.join(directory, "manifest.json")
+    if not os.path.exists(path):
+        return False
+    with open(path) as f:
+        return json.load(f).get("format") == FORMAT
+
+def _map(path, dtype, shape):
+    # np.memmap refuses zero-length files
+    if not shape[0]:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+class MmapVectorStore:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(directory, "metadata.json")) as f:
+            self.metadatas = json.load(f)
+        self.ids = self.manifest["ids"]
+        count, dim = self.manifest["count"], self.manifest["dim"]
+        self.vectors = _map(os.path.join(directory, "vectors.f32"), np.float32, (count, dim))
+        self.norms = _map(os.path.join(directory, "norms.f32"), np.float32, (count,))
+        self.offsets = _map(os.path.join(directory, "offsets.i64"), np.int64, (count + 1,))
+        self._texts = _map(os.path.join(directory, "texts.bin"), np.uint8, (int(self.offsets[-1]),))
+        self.lexical = BM25Index(directory, count) if has_bm25(directory) else None
+
+    @classmethod
+    def load(cls, directory):
+        return cls(directory)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def text(self, row: int) -> str:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return bytes(self._texts[start:end]).decode("utf-8")
+
+    def document(self, row: int) -> Document:
+        return Document(page_content=self.text(row), metadata=dict(self.metadatas[row]))
+
+    def search_batch(self, vectors, k: int = 4):
+        """
+        Returns, for each query vector, the (row, squared L2 distance) pairs of
+        its k nearest rows, nearest first.
+        """
+        queries = np.asarray(vectors, dtype=np.float32).reshape(-1, self.vectors.shape[1])
+        if not len(self.ids):
+            return [[] for _ in queries]
+        k = min(k, len(self.ids))
+        distances = self.norms[None, :] - 2 * (queries @ self.vectors.T) + np.einsum("ij,ij->i", queries, queries)[:, None]
+        results = []
+        for row_distances in distances:
+            top = np.argpartition(row_distances, k - 1)[:k]
+            top = top[np.argsort(row_distances[top])]
+            results.append([(int(i), float(row_distances[i])) for i in top])
+        return results
+
+    def similarity_search_by_vector(self, vector, k: int = 4):
+        return [self.document(row) for row, _ in self.search_batch([vector], k)[0]]
+
+    def similarity_search_by_vectors(self, vectors, k: int = 4):
+        """
+        Batched similarity_search_by_vector: one matrix product for all queries.
+        """
+        return [[self.document(row) for row, _ in hits] for hits in self.search_batch(vectors, k)]
+
+    def hybrid_search(self, queries, vectors, k: int = 4):
+        """
+        Returns one (documents, mode) pair per query. mode is "exact" when the
+        query names a product ("Jeuveau") mentioned by at least k chunks, which
+        are then returned alone, best BM25 first; otherwise "hybrid", the dense
+        and BM25 rankings fused by reciprocal rank, with any exact hits first.
+        Without a BM25 index this is plain dense search ("dense").
+        """
+        if self.lexical is None:
+            return [(docs, "dense") for docs in self.similarity_search_by_vectors(vectors, k)]
+
+        depth = max(4 * k, 20)
+        results = []
+        for query, dense_hits in zip(queries, self.search_batch(vectors, depth)):
+            scores = self.lexical.scores(query)
+            exact = self.lexical.name_rows(query, scores)
+            if len(exact) >= k:
+                results.append(([self.document(row) for row in exact[:k]], "exact"))
+                continue
+
+            fused = {}
+            lexical_hits = np.flatnonzero(scores)
+            lexical_hits = lexical_hits[np.argsort(-scores[lexical_hits])][:depth]
+            for ranking in ([row for row, _ in dense_hits], lexical_hits):
+                for rank, row in enumerate(ranking):
+                    fused[int(row)] = fused.get(int(row), 0.0) + 1.0 / (RRF_K + rank + 1)
+            ordered = exact + [row for row in sorted(fused, key=fused.get, reverse=True) if row not in exact]
+            results.append(([self.document(row) for row in ordered[:k]], "hybrid"))
+        return results
+
+    def rows(self):
+        """
+        Yields (id, text, metadata, vector) for every row, in order.
+        """
+        for row, cid in enumerate(self.ids):
+            yield cid, self.text(row), self.metadatas[row], np.array(self.vectors[row])
@@ -0,0 +1,70 @@
+"""
+Checks admission.py: rate limiting, queue and deadline rejections, and
+that a burst of slow turns doesn't leave an idle server rejecting turns.
+Needs no API key.
+
+    python verify_admission.py
+"""
+import time
+import asyncio
+
+from admission import RateLimiter, AdmissionController, Overloaded
+
+def check(name, ok, detail=""):
+    print(f"{'PASS' if ok else 'FAIL'}: {name}{f' ({detail})' if detail else ''}")
+    return ok
+
+async def turn(controller, seconds):
+    async with controller.slot():
+        await asyncio.sleep(seconds)
+
+async def rejection(controller):
+    """
+    The reason a turn arriving now is turned away, or None if it runs.
+    """
+    try:
+        await turn(controller, 0)
+        return None
+    except Overloaded as e:
+        return e.reason
+
+def check_rate_limiter():
+    limiter = RateLimiter(rate=1, burst=2)
+    waits = [limiter.take("ip", now=100.0) for _ in range(3)]
+    return [
+        check("burst is allowed, then limited", waits[:2] == [0.0, 0.0] and waits[2] > 0, str(waits)),
+        check("tokens refill", limiter.take("ip", now=101.0) == 0.0),
+    ]
+
+async def check_admission():
+    results = []
+
+    controller = AdmissionController(max_in_flight=1, max_queue=1, deadline=5.0, initial_turn_seconds=0.1)
+    running = asyncio.ensure_future(turn(controller, 0.3))
+    await asyncio.sleep(0.05)
+    queued = asyncio.ensure_future(turn(controller, 0))
+    await asyncio.sleep(0.05)
+    results.append(check("full queue is rejected", await rejection(controller) == "queue_full"))
+    await asyncio.gather(running, queued)
+
+    # One slow turn pushes the average past the deadline
+    controller = AdmissionController(max_in_flight=1, max_queue=8, deadline=0.5, initial_turn_seconds=0.4)
+    await turn(controller, 1.5)
+    results.append(check("slow turn raises the average past the deadline", controller.turn_seconds > controller.deadline,
+                         f"{controller.turn_seconds:.2f}s"))
+    running = asyncio.ensure_future(turn(controller, 0.2))
+    await asyncio.sleep(0.05)
+    results.append(check("saturated: a turn that can't make the deadline is rejected", await rejection(controller) == "deadline"))
+    await running
+    results.append(check("idle: the next turn is still admitted", await rejection(controller) is None, str(controller.stats()["counts"])))
+
+    # The same average, left alone, decays back under the deadline
+    controller = AdmissionController(max_in_flight=1, max_queue=8, deadline=0.5, initial_turn_seconds=0.4)
+    await turn(controller, 1.5)
+    time.sleep(1.0)
+    results.append(check("idle average decays", controller.turn_seconds < controller.deadline, f"{controller.turn_seconds:.2f}s"))
+    return results
+
+if __name__ == "__main__":
+    results = check_rate_limiter() + asyncio.run(check_admission())
+    print(f"\n{sum(results)}/{len(results)} checks passed")
@@ -0,0 +1,106 @@
+"""
+Checks availability.py and the booking confirmation against it: date
+normalization, slot formatting, reservations, and two sessions confirming
+the same time at once. Runs the app in-process with a temporary
+STORAGE_DIR; needs no API key.
+
+    python verify_availability.py
+"""
+import os
+import asyncio
+import tempfile
+from datetime import datetime, timedelta
+
+os.environ.setdefault("STORAGE_DIR", tempfile.mkdtemp(prefix="cnbot-verify-"))
+os.environ.setdefault("SESSION_BACKEND", "memory")
+os.environ.setdefault("GOOGLE_API_KEY", "verify-offline")
+
+import httpx
+
+from availability import Calendar, normalize, format_slot
+
+HOURS = [[540, 1140]] * 6 + [None]
+
+# (text, expected datetime with now = Mon, Feb 16, 2026, 9:00 AM; None = asked again)
+NORMALIZE_CASES = [
+    ("tomorrow at 5", datetime(2026, 2, 17, 17, 0)),
+    ("Tue, Feb 17, 2026, 10:30 AM", datetime(2026, 2, 17, 10, 30)),
+    ("tomorrow in the afternoon at 3", datetime(2026, 2, 17, 15, 0)),
+    ("tomorrow morning at 7", datetime(2026, 2, 17, 7, 0)),
+    ("in two days at 3pm", None),
+    ("3 days from now at 4pm", None),
+    ("next Tuesday at 3", None),
+    ("the day after tomorrow at 3", None),
+]
+
+FORMAT_CASES = [
+    (datetime(2026, 2, 7, 9, 5), "Sat, Feb 7, 2026, 9:05 AM"),
+    (datetime(2026, 2, 17, 0, 30), "Tue, Feb 17, 2026, 12:30 AM"),
+    (datetime(2026, 12, 1, 12, 0), "Tue, Dec 1, 2026, 12:00 PM"),
+]
+
+def check(name, ok, detail=""):
+    print(f"{'PASS' if ok else 'FAIL'}: {name}{f' ({detail})' if detail else ''}")
+    return ok
+
+def check_calendar():
+    results = []
+    now = datetime(2026, 2, 16, 9, 0)  # a Monday
+    for text, expected in NORMALIZE_CASES:
+        got = normalize(text, now)
+        results.append(check(f"normalize: {text!r}", got == expected, str(got)))
+    for dt, expected in FORMAT_CASES:
+        results.append(check(f"format_slot: {expected}", format_slot(dt) == expected, format_slot(dt)))
+
+    calendar = Calendar(HOURS, slot_minutes=30, capacity=2)
+    slot = datetime(2026, 2, 17, 10, 0)
+    results.append(check("reserve a free time", calendar.reserve(slot, "botox")))
+    results.append(check("reserve a taken time", not calendar.reserve(slot, "botox")))
+    calendar.release(slot, "botox")
+    results.append(check("release frees it again", calendar.is_free(slot, "botox") and calendar.requests == 0))
+    calendar.release(slot, "botox")
+    calendar.release(slot + timedelta(hours=1), "botox")
+    results.append(check("releasing what isn't there changes nothing", calendar.requests == 0, str(calendar.requests)))
+    return results
+
+def check_service_keys():
+    import main
+
+    calendar = Calendar(HOURS, slot_minutes=30, capacity=2, service_key=main.canonical_service)
+    slot = datetime(2026, 2, 17, 10, 0)
+    calendar.add(slot, "botox please")
+    return [
+        check("same treatment, other wording, overlaps", not calendar.is_free(slot + timedelta(minutes=15), "Botox Cosmetic")),
+        check("another treatment doesn't", calendar.is_free(slot + timedelta(minutes=15), "dysport")),
+    ]
+
+async def check_concurrent_confirm():
+    import main
+
+    service = "botox"
+    slot = main.tenant().calendar.next_free(service, 1, after=datetime.now() + timedelta(days=2))[0]
+
+    def confirming(session_id, name):
+        data = {"name": name, "phone": "5551234567", "email": f"{name.lower()}@example.com", "service": service}
+        main.accept_date(data, slot)
+        main.sessions[main.session_key(main.DEFAULT_TENANT, session_id)] = {"state": main.BookingState.CONFIRM, "data": data, "history": [], "ip": "127.0.0.1"}
+
+    confirming("confirm-a", "Ann")
+    confirming("confirm-b", "Bob")
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://verify") as client:
+        replies = await asyncio.gather(*[
+            client.post("/chat", json={"message": "yes", "session_id": sid}) for sid in ("confirm-a", "confirm-b")
+        ])
+    texts = [r.json()["reply"] for r in replies]
+    submitted = sum("has been submitted" in t for t in texts)
+    refused = sum("just requested by someone else" in t for t in texts)
+    stored = [r for r in main.tenant().store.appointments() if r.get("starts_at") == slot.isoformat(timespec="minutes")]
+    return [
+        check("concurrent confirms: one submitted, one asked again", submitted == 1 and refused == 1, str(texts)),
+        check("concurrent confirms: one record stored", len(stored) == 1, f"{len(stored)} stored"),
+    ]
+
+if __name__ == "__main__":
+    results = check_calendar() + check_service_keys() + asyncio.run(check_concurrent_confirm())
+    print(f"\n{sum(results)}/{len(results)} checks passed")
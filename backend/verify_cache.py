@@ -0,0 +1,50 @@
+"""
+Checks the text keys of cache.py (answers and query embeddings): questions
+in any script get keys of their own, and text without letters or digits is
+never cached by text.
+Needs no API key or model.
+
+    python verify_cache.py
+"""
+import numpy as np
+
+from cache import SemanticCache, EmbeddingCache, normalize_text
+
+def check(name, ok, detail=""):
+    print(f"{'PASS' if ok else 'FAIL'}: {name}{f' ({detail})' if detail else ''}")
+    return ok
+
+def vector(seed):
+    return np.random.default_rng(seed).normal(size=8).astype(np.float32)
+
+def check_normalize():
+    return [
+        check("case and punctuation are ignored", normalize_text("What are your HOURS?") == normalize_text("what are your hours")),
+        check("non-ASCII letters are kept", normalize_text("你好吗") == "你好吗" and normalize_text("¿Qué tal?") == "qué tal"),
+        check("emoji-only text has no key", normalize_text("😀😀") == ""),
+    ]
+
+def check_semantic_cache():
+    cache = SemanticCache(max_entries=10)
+    cache.put("你好吗", vector(1), "answer to 你好吗")
+    cache.put("😀", vector(2), "answer to 😀")
+    return [
+        check("another non-ASCII question misses", cache.get_text("营业时间是几点") is None),
+        check("the same non-ASCII question hits", cache.get_text("你好吗？") == "answer to 你好吗"),
+        check("another emoji-only question misses", cache.get_text("🙂") is None),
+    ]
+
+def check_embedding_cache():
+    cache = EmbeddingCache(budget_mb=1)
+    cache.put("你好吗", vector(1))
+    cache.put("😀", vector(2))
+    hit = cache.get("你好吗")
+    return [
+        check("embedding: another non-ASCII query misses", cache.get("营业时间是几点") is None),
+        check("embedding: the same query hits", hit is not None and np.allclose(hit, vector(1))),
+        check("embedding: emoji-only text isn't cached", cache.get("😀") is None and cache.stats()["entries"] == 1),
+    ]
+
+if __name__ == "__main__":
+    results = check_normalize() + check_semantic_cache() + check_embedding_cache()
+    print(f"\n{sum(results)}/{len(results)} checks passed")
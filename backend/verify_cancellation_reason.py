@@ -3,9 +3,9 @@ import uuid
 import json
 import os
 import time
+from db import open_store
 
 BASE_URL = "http://64.227.171.48:8000"
-CANCELLATIONS_FILE = "../data/cancellations.json"
 
 def send_message(session_id, message):
     print(f"\nUser: {message}")
@@ -47,24 +47,21 @@ def test_cancellation_reason():
     else:
         print("FAIL: Cancellation confirmation missing.")
 
-    # 4. Check File
+    # 4. Check Storage
     print("\n[Checking Storage]")
-    if os.path.exists(CANCELLATIONS_FILE):
-        with open(CANCELLATIONS_FILE, "r") as f:
-            data = json.load(f)
-            # Check last entry
-            last_entry = data[-1]
-            if last_entry.get("reason") == reason:
-                print("PASS: Reason saved correctly to file.")
-            else:
-                print(f"FAIL: Reason mismatch. Saved: {last_entry.get('reason')}")
-            
-            if "ip_address" in last_entry:
-                print(f"PASS: IP Address saved: {last_entry['ip_address']}")
-            else:
-                print("FAIL: IP Address NOT saved.")
+    last_entry = open_store(migrate=False).last_cancellation()
+    if last_entry:
+        if last_entry.get("reason") == reason:
+            print("PASS: Reason saved correctly to storage.")
+        else:
+            print(f"FAIL: Reason mismatch. Saved: {last_entry.get('reason')}")
+        
+        if "ip_address" in last_entry:
+            print(f"PASS: IP Address saved: {last_entry['ip_address']}")
+        else:
+            print("FAIL: IP Address NOT saved.")
     else:
-        print("FAIL: cancellations.json not found.")
+        print("FAIL: No cancellations found in storage.")
 
 if __name__ == "__main__":
     test_cancellation_reason()
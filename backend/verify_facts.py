@@ -0,0 +1,54 @@
+"""
+Checks the deterministic answers in facts.py against data/facts.json:
+which questions are answered from the facts and which are left to
+retrieval. Also checks that scraped hours only replace the clinic's known
+hours when every page agrees. Needs no API key.
+
+    python verify_facts.py
+"""
+from facts import CLINIC_HOURS, load_facts, parse_hours
+from scrapper import URLS, SITE_PATH
+
+# (message, kind of answer expected; None = left to retrieval)
+ANSWER_CASES = [
+    ("What are your hours?", "hours"),
+    ("hours?", "hours"),
+    ("What are your Saturday hours?", "hours"),
+    ("Are you open on Sunday?", "hours"),
+    ("What are your hours of operation", "hours"),
+    ("What's your phone number?", "phone"),
+    ("Where are you located?", "location"),
+    ("What services do you offer?", "services"),
+    ("How many hours does a facial take?", None),
+    ("How long are the results good for, in hours?", None),
+    ("Can I work out a few hours after botox?", None),
+]
+
+def check(name, ok, detail=""):
+    print(f"{'PASS' if ok else 'FAIL'}: {name}{f' ({detail})' if detail else ''}")
+    return ok
+
+def check_answers():
+    facts = load_facts(SITE_PATH, URLS)
+    results = []
+    for message, expected in ANSWER_CASES:
+        before = dict(facts.answered)
+        reply = facts.answer(message)
+        kinds = [kind for kind in facts.answered if facts.answered[kind] != before.get(kind, 0)]
+        got = kinds[0] if kinds else None
+        results.append(check(f"{message!r} -> {expected}", got == expected and (reply is None) == (expected is None), str(got)))
+    return results
+
+def check_hours():
+    day = "Monday: 10 AM – 5 PM\nThursday: {} – 7 PM\n"
+    split = day.format("10 AM") * 3 + day.format("11 AM")
+    conflicts = []
+    kept = parse_hours(split, CLINIC_HOURS, conflicts)
+    return [
+        check("a split scrape keeps the known hours", kept[3] == CLINIC_HOURS[3] and len(conflicts) == 1, str(conflicts)),
+        check("an agreed scrape replaces them", parse_hours(day.format("10 AM"), CLINIC_HOURS)[3] == [600, 1140]),
+    ]
+
+if __name__ == "__main__":
+    results = check_answers() + check_hours()
+    print(f"\n{sum(results)}/{len(results)} checks passed")
@@ -0,0 +1,69 @@
+"""
+Checks the intent fast path (intent.py) on in-flow messages: side questions
+vs. answers and edit / cancel requests phrased as questions, then runs the
+edit requests through the booking flow in-process. Needs no API key.
+
+    python verify_intent.py
+"""
+import os
+import asyncio
+import tempfile
+
+os.environ.setdefault("STORAGE_DIR", tempfile.mkdtemp(prefix="cnbot-verify-"))
+os.environ.setdefault("SESSION_BACKEND", "memory")
+os.environ.setdefault("GOOGLE_API_KEY", "verify-offline")
+
+import httpx
+
+from intent import IntentClassifier
+from scrapper import URLS
+
+# (message, state, expected interruption decision; None = left to the model)
+INTERRUPTION_CASES = [
+    ("What are your hours?", "ASK_NAME", True),
+    ("Do you take insurance?", "ASK_PHONE", True),
+    ("555-123-4567", "ASK_PHONE", False),
+    ("Can I change the date?", "CONFIRM", False),
+    ("could you update my email please", "CONFIRM", False),
+    ("Is it ok to change the service?", "ASK_EDIT_FIELD", False),
+    ("Can I change the date?", "ASK_EMAIL", False),
+    ("Could I cancel this?", "ASK_SERVICE", False),
+    ("Is the clinic open on Sunday?", "CONFIRM", None),
+]
+
+# (message at CONFIRM, text the reply should contain)
+EDIT_FLOW_CASES = [
+    ("Can I change the date?", "when would you like"),
+    ("could you update my email please", "email"),
+]
+
+def check(name, ok, detail=""):
+    print(f"{'PASS' if ok else 'FAIL'}: {name}{f' ({detail})' if detail else ''}")
+    return ok
+
+def check_classifier():
+    classifier = IntentClassifier(lambda texts: [], service_urls=URLS)
+    results = []
+    for message, state, expected in INTERRUPTION_CASES:
+        decision = classifier.interruption(message, state, use_embeddings=False)
+        value = decision.value if decision.source != "model_cold" else None
+        results.append(check(f"{state}: {message!r}", value == expected, f"{decision.value}, {decision.source}"))
+    return results
+
+async def check_edit_flow():
+    import main
+
+    results = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://verify") as client:
+        for i, (message, expected) in enumerate(EDIT_FLOW_CASES):
+            session_id = f"edit-{i}"
+            data = {"name": "Ann", "phone": "5551234567", "email": "ann@example.com", "service": "botox", "date": "Tomorrow at 3 PM"}
+            main.sessions[main.session_key(main.DEFAULT_TENANT, session_id)] = {"state": main.BookingState.CONFIRM, "data": data, "history": [], "ip": "127.0.0.1"}
+            reply = (await client.post("/chat", json={"message": message, "session_id": session_id})).json()["reply"]
+            results.append(check(f"CONFIRM edit: {message!r}", expected in reply.lower(), reply))
+    return results
+
+if __name__ == "__main__":
+    results = check_classifier() + asyncio.run(check_edit_flow())
+    print(f"\n{sum(results)}/{len(results)} checks passed")
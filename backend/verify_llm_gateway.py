@@ -0,0 +1,145 @@
+"""
+Checks llm_gateway.py against a local fake Gemini server: retries, deadlines,
+hedging, the circuit breaker and streaming. Needs no API key.
+
+    python verify_llm_gateway.py
+"""
+import json
+import time
+import asyncio
+import threading
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from llm_gateway import LLMGateway, GeminiClient, CircuitBreaker, LLMUnavailable
+
+PORT = 8765
+MODEL = "gemini-2.5-flash"
+
+# --- Fake server ---
+# fail: how many upcoming requests return `status`; delays: per-request
+# delays (seconds) for upcoming requests, then `delay`.
+fake = {"requests": 0, "fail": 0, "status": 503, "delays": [], "delay": 0.0}
+app = FastAPI()
+
+def reply(text):
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}],
+        "usageMetadata": {"promptTokenCount": 10, "candidatesTokenCount": 3},
+    }
+
+async def fake_request():
+    fake["requests"] += 1
+    await asyncio.sleep(fake["delays"].pop(0) if fake["delays"] else fake["delay"])
+    if fake["fail"]:
+        fake["fail"] -= 1
+        return JSONResponse({"error": {"code": fake["status"]}}, status_code=fake["status"])
+    return None
+
+@app.post("/v1beta/models/{model}:generateContent")
+async def generate(model: str, request: Request):
+    error = await fake_request()
+    if error:
+        return error
+    body = await request.json()
+    return reply("echo: " + body["contents"][0]["parts"][0]["text"])
+
+@app.post("/v1beta/models/{model}:streamGenerateContent")
+async def stream(model: str, request: Request):
+    error = await fake_request()
+    if error:
+        return error
+
+    async def events():
+        for word in ["Hello", " from", " the", " fake"]:
+            yield f"data: {json.dumps(reply(word))}\r\n\r\n"
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+def reset(**config):
+    fake.update({"requests": 0, "fail": 0, "status": 503, "delays": [], "delay": 0.0})
+    fake.update(config)
+
+def start_server():
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+# --- Checks ---
+
+def check(name, ok, detail=""):
+    print(f"{'PASS' if ok else 'FAIL'}: {name}{f' ({detail})' if detail else ''}")
+    return ok
+
+def gateway(client, **kwargs):
+    kwargs.setdefault("backoff", 0.01)
+    return LLMGateway(lambda: client, **kwargs)
+
+async def run():
+    client = GeminiClient(MODEL, "test-key", base_url=f"http://127.0.0.1:{PORT}")
+    results = []
+
+    reset()
+    res = await gateway(client).invoke("hi", call_site="test")
+    results.append(check("plain call", res.content == "echo: hi" and res.usage_metadata["input_tokens"] == 10))
+
+    reset(fail=2)
+    res = await gateway(client, retries=2).invoke("hi", call_site="test")
+    results.append(check("retries transient 503s", res.content == "echo: hi" and fake["requests"] == 3, f"{fake['requests']} requests"))
+
+    reset(fail=1, status=400)
+    try:
+        await gateway(client, retries=2).invoke("hi", call_site="test")
+        results.append(check("400 is not retried", False))
+    except Exception:
+        results.append(check("400 is not retried", fake["requests"] == 1, f"{fake['requests']} requests"))
+
+    reset(delay=2.0)
+    started = time.perf_counter()
+    res = await gateway(client, deadline=0.5, retries=2).invoke("hi", call_site="test", fallback="canned")
+    elapsed = time.perf_counter() - started
+    results.append(check("deadline returns the fallback", res.content == "canned" and res.degraded and elapsed < 1.0, f"{elapsed:.2f}s"))
+
+    # Prime the p95 with fast calls, then make the next request slow
+    reset()
+    hedged = gateway(client, hedge=True, hedge_min_samples=20)
+    for _ in range(20):
+        await hedged.invoke("hi", call_site="test")
+    reset(delays=[1.5])
+    started = time.perf_counter()
+    res = await hedged.invoke("hi", call_site="test")
+    elapsed = time.perf_counter() - started
+    results.append(check("hedged request wins over a slow one", res.content == "echo: hi" and elapsed < 0.5 and fake["requests"] == 2, f"{elapsed:.2f}s"))
+
+    reset(fail=100)
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=0.5)
+    guarded = gateway(client, retries=1, breaker=breaker)
+    for _ in range(2):
+        await guarded.invoke("hi", call_site="test", fallback="canned")
+    sent = fake["requests"]
+    res = await guarded.invoke("hi", call_site="test", fallback="canned")
+    results.append(check("open circuit short-circuits", breaker.state == "open" and res.degraded and fake["requests"] == sent, f"{sent} requests sent"))
+    try:
+        await guarded.invoke("hi", call_site="test")
+        results.append(check("open circuit raises without a fallback", False))
+    except LLMUnavailable:
+        results.append(check("open circuit raises without a fallback", True))
+
+    reset()
+    await asyncio.sleep(0.6)
+    res = await guarded.invoke("hi", call_site="test")
+    results.append(check("half-open probe closes the circuit", res.content == "echo: hi" and breaker.state == "closed"))
+
+    reset(fail=1)
+    text = "".join([chunk.content async for chunk in gateway(client).stream("hi", call_site="test")])
+    results.append(check("stream retries before the first chunk", text == "Hello from the fake" and fake["requests"] == 2, repr(text)))
+
+    await client.aclose()
+    print(f"\n{sum(results)}/{len(results)} checks passed")
+
+if __name__ == "__main__":
+    start_server()
+    asyncio.run(run())
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from scrapper import crawl, make_session, write_pages, load_pages
+
+# Offline fixture site: path -> (html, etag)
+PAGES = {
+    "/": ("<html><body><h1>CN Medical</h1><p>Park Ridge, IL</p></body></html>", '"home-v1"'),
+    "/services/botox/": ("<html><body><h1>BOTOX</h1><p>Smooths lines.</p></body></html>", '"botox-v1"'),
+    "/services/kybella/": ("<html><body><h1>Kybella</h1><p>Chin fat.</p></body></html>", '"kybella-v1"'),
+}
+REQUESTS = []
+FLAKY = {"/services/kybella/": 1}  # fail this many times before answering
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        REQUESTS.append((self.path, self.headers.get("If-None-Match")))
+        if FLAKY.get(self.path, 0) > 0:
+            FLAKY[self.path] -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+        if self.path not in PAGES:
+            self.send_response(404)
+            self.end_headers()
+            return
+        html, etag = PAGES[self.path]
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = html.encode("utf-8")
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def check(condition, message):
+    print(("PASS: " if condition else "FAIL: ") + message)
+
+def test_crawler():
+    print("=== Test: Concurrent cached crawler (offline) ===")
+    server = HTTPServer(("127.0.0.1", 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    urls = [base + path for path in PAGES]
+    workdir = tempfile.mkdtemp()
+    cache_dir = os.path.join(workdir, "cache")
+
+    try:
+        session = make_session(concurrency=4)
+        pages = crawl(urls, concurrency=4, cache_dir=cache_dir, session=session)
+        check([p["status"] for p in pages] == ["new", "new", "new"], "first crawl fetches every page")
+        check("Chin fat." in pages[2]["text"], "retry recovered the flaky page")
+
+        REQUESTS.clear()
+        pages = crawl(urls, concurrency=4, cache_dir=cache_dir, session=session)
+        check(all(p["status"] == "unchanged" for p in pages), "second crawl is served by 304s")
+        check(all(etag for _, etag in REQUESTS), "conditional requests carry If-None-Match")
+
+        PAGES["/services/botox/"] = ("<html><body><h1>BOTOX</h1><p>Now on special.</p></body></html>", '"botox-v2"')
+        pages = crawl(urls, concurrency=4, cache_dir=cache_dir, session=session)
+        check([p["status"] for p in pages] == ["unchanged", "changed", "unchanged"], "only the edited page is reported changed")
+
+        pages_path = os.path.join(workdir, "pages.jsonl")
+        write_pages(pages, pages_path, os.path.join(workdir, "site.txt"))
+        docs = load_pages(pages_path)
+        check([d["url"] for d in docs] == urls, "per-page documents carry their source URL")
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    test_crawler()
@@ -1,6 +1,18 @@
 // Generate a new session ID every time the page loads (including reloads)
 const sessionId = 'sess_' + Math.random().toString(36).substr(2, 9);
 
+// Hours, phone and services catalog from GET /facts (null until loaded)
+let clinicFacts = null;
+// Used by the date picker if /facts can't be loaded; indexed by Date.getDay()
+const DEFAULT_HOURS = [null, [600, 1020], [600, 1020], [600, 1020], [660, 1140], [600, 1020], [540, 900]];
+
+function formatMinutes(minutes) {
+    const hour = Math.floor(minutes / 60);
+    const minute = minutes % 60;
+    const suffix = hour < 12 ? 'AM' : 'PM';
+    return `${hour % 12 || 12}:${String(minute).padStart(2, '0')} ${suffix}`;
+}
+
 const chatMessages = document.getElementById('chat-messages');
 const userInput = document.getElementById('user-input');
 const sendBtn = document.getElementById('send-btn');
@@ -39,6 +51,52 @@ function removeTypingIndicator() {
     }
 }
 
+const API_BASE = 'http://64.227.171.48:8000';
+// Clinic this page belongs to; a multi-clinic deployment sets <html data-tenant="...">
+const TENANT = document.documentElement.dataset.tenant || 'default';
+
+// Parses a Server-Sent Events stream from a fetch Response and calls
+// onEvent(eventName, data) for every complete event.
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let eventName = 'message';
+            let data = '';
+            frame.split('\n').forEach(line => {
+                if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+            if (data) onEvent(eventName, JSON.parse(data));
+        }
+    }
+}
+
+// A 429/503, or an "error" event with retry_after, means the server didn't
+// process the turn (rate limited, overloaded or still starting up), so the
+// same message is resent after the Retry-After delay, up to MAX_BUSY_RETRIES times.
+const MAX_BUSY_RETRIES = 3;
+
+function retryAfterSeconds(value) {
+    const seconds = Number(value);
+    return Number.isFinite(seconds) && seconds > 0 ? Math.min(seconds, 30) : 5;
+}
+
+function sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+}
+
 async function sendMessage(text = null) {
     const message = text || userInput.value.trim();
     if (!message) return;
@@ -54,30 +112,82 @@ async function sendMessage(text = null) {
 
     showTypingIndicator(); // Show indicator
 
+    // Bot bubble is created on the first streamed token and updated in place
+    let botDiv = null;
+    let streamed = '';
+
+    function renderBot(content) {
+        if (!botDiv) {
+            removeTypingIndicator();
+            botDiv = document.createElement('div');
+            botDiv.classList.add('message', 'bot');
+            chatMessages.appendChild(botDiv);
+        }
+        botDiv.innerHTML = marked.parse(content);
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    }
+
     try {
-        const response = await fetch(`http://64.227.171.48:8000/chat`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                message: message,
-                session_id: sessionId
-            })
-        });
+        let finalData = null;
+        for (let attempt = 0; ; attempt++) {
+            const response = await fetch(`${API_BASE}/chat/stream`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    message: message,
+                    session_id: sessionId,
+                    tenant: TENANT
+                })
+            });
+
+            let busy = null;
+            if (response.status === 429 || response.status === 503) {
+                const body = await response.json().catch(() => ({}));
+                busy = { reply: body.detail, retry_after: response.headers.get('Retry-After') };
+            } else if (!response.ok) {
+                throw new Error('Network response was not ok');
+            } else {
+                finalData = null;
+                await readEventStream(response, (eventName, data) => {
+                    if (eventName === 'token') {
+                        streamed += data.text;
+                        renderBot(streamed);
+                    } else if (eventName === 'done' || eventName === 'error') {
+                        finalData = data;
+                    }
+                });
+                if (finalData && finalData.retry_after && !streamed) busy = finalData;
+            }
+
+            if (!busy) break;
+            if (attempt >= MAX_BUSY_RETRIES) {
+                finalData = { reply: busy.reply || 'Sorry, we are very busy right now. Please try again later.' };
+                break;
+            }
+            const wait = retryAfterSeconds(busy.retry_after);
+            if (attempt === 0) {
+                removeTypingIndicator();
+                addMessage(`${busy.reply || 'We are a little busy right now.'} I'll try again in ${wait} seconds.`, 'bot');
+                showTypingIndicator();
+            }
+            await sleep(wait * 1000);
+        }
 
         removeTypingIndicator(); // Hide indicator
-
-        if (!response.ok) {
-            throw new Error('Network response was not ok');
+        if (!finalData) {
+            throw new Error('Stream ended without a reply');
         }
 
-        const data = await response.json();
-        addMessage(data.reply, 'bot');
+        // The final reply may differ from the streamed text (e.g. booking resume)
+        renderBot(finalData.reply);
 
         // Handle UI Actions
-        if (data.ui_action === 'date_picker') {
-            showDatePicker();
+        if (finalData.ui_action === 'date_picker') {
+            showDatePicker(finalData.slots);
+        } else if (finalData.ui_action === 'service_picker') {
+            showServicePicker();
         }
     } catch (error) {
         removeTypingIndicator(); // Ensure indicator is hidden on error
@@ -87,10 +197,16 @@ async function sendMessage(text = null) {
 }
 
 // Date Picker Function
-function showDatePicker() {
+function showDatePicker(slots) {
     // Check if one already exists to avoid duplicates
     if (document.querySelector('.date-picker-container')) return;
 
+    // The server sends the free slots with date_picker; offer only those
+    if (slots && slots.length) {
+        showSlotPicker(slots);
+        return;
+    }
+
     const container = document.createElement('div');
     container.className = 'date-picker-container';
 
@@ -116,34 +232,12 @@ function showDatePicker() {
         
         // Business Hours Validation
         const day = selectedDate.getDay(); // 0 = Sunday, 1 = Monday, ...
-        const hour = selectedDate.getHours();
-        
-        // Hours:
-        // Mon-Wed, Fri: 10am - 5pm (17)
-        // Thu: 11am - 7pm (19)
-        // Sat: 9am - 3pm (15)
-        // Sun: Closed
-
-        let isOpen = false;
-        let openTime = "";
-        
-        if (day === 0) {
-            // Sunday
-            isOpen = false;
-            openTime = "Closed";
-        } else if (day === 6) {
-            // Saturday: 9-15
-            isOpen = hour >= 9 && hour < 15;
-            openTime = "9:00 AM - 3:00 PM";
-        } else if (day === 4) {
-             // Thursday: 11-19
-             isOpen = hour >= 11 && hour < 19;
-             openTime = "11:00 AM - 7:00 PM";
-        } else {
-            // Mon, Tue, Wed, Fri: 10-17
-            isOpen = hour >= 10 && hour < 17;
-            openTime = "10:00 AM - 5:00 PM";
-        }
+        const minutes = selectedDate.getHours() * 60 + selectedDate.getMinutes();
+
+        // clinicFacts.hours is Monday-first: [openMinutes, closeMinutes] or null
+        const hours = clinicFacts ? clinicFacts.hours[(day + 6) % 7] : DEFAULT_HOURS[day];
+        const isOpen = !!hours && minutes >= hours[0] && minutes < hours[1];
+        const openTime = hours ? `${formatMinutes(hours[0])} - ${formatMinutes(hours[1])}` : "Closed";
 
         if (!isOpen) {
              const days = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday'];
@@ -173,6 +267,106 @@ function showDatePicker() {
     chatMessages.scrollTop = chatMessages.scrollHeight;
 }
 
+// Day + time selects over the free slots ({start, label}) from the server
+function showSlotPicker(slots) {
+    const container = document.createElement('div');
+    container.className = 'date-picker-container';
+
+    const daySelect = document.createElement('select');
+    daySelect.className = 'date-picker-input';
+    const timeSelect = document.createElement('select');
+    timeSelect.className = 'date-picker-input';
+
+    const days = new Map();
+    slots.forEach(slot => {
+        const day = slot.start.slice(0, 10);
+        if (!days.has(day)) days.set(day, []);
+        days.get(day).push(slot);
+    });
+
+    days.forEach((daySlots, day) => {
+        const option = document.createElement('option');
+        option.value = day;
+        // "Tue, Feb 17, 2026, 10:30 AM" -> "Tue, Feb 17, 2026"
+        option.textContent = daySlots[0].label.split(', ').slice(0, 3).join(', ');
+        daySelect.appendChild(option);
+    });
+
+    function fillTimes() {
+        timeSelect.innerHTML = '';
+        days.get(daySelect.value).forEach(slot => {
+            const option = document.createElement('option');
+            option.value = slot.label;
+            option.textContent = slot.label.split(', ').pop();
+            timeSelect.appendChild(option);
+        });
+    }
+    daySelect.onchange = fillTimes;
+    fillTimes();
+
+    const confirmBtn = document.createElement('button');
+    confirmBtn.className = 'date-picker-confirm-btn';
+    confirmBtn.textContent = 'Confirm Date';
+
+    confirmBtn.onclick = () => {
+        sendMessage(timeSelect.value);
+        container.remove();
+    };
+
+    container.appendChild(daySelect);
+    container.appendChild(timeSelect);
+    container.appendChild(confirmBtn);
+
+    chatMessages.appendChild(container);
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+}
+
+// Service Picker Function
+function showServicePicker() {
+    if (!clinicFacts || document.querySelector('.service-picker-container')) return;
+
+    const container = document.createElement('div');
+    container.className = 'date-picker-container service-picker-container';
+
+    const select = document.createElement('select');
+    select.className = 'date-picker-input';
+    const placeholder = document.createElement('option');
+    placeholder.value = '';
+    placeholder.textContent = 'Choose a service';
+    select.appendChild(placeholder);
+
+    clinicFacts.catalog.forEach(category => {
+        const group = document.createElement('optgroup');
+        group.label = category.category;
+        category.services.forEach(service => {
+            const option = document.createElement('option');
+            option.value = service;
+            option.textContent = service;
+            group.appendChild(option);
+        });
+        select.appendChild(group);
+    });
+
+    const confirmBtn = document.createElement('button');
+    confirmBtn.className = 'date-picker-confirm-btn';
+    confirmBtn.textContent = 'Choose Service';
+
+    confirmBtn.onclick = () => {
+        if (!select.value) {
+            alert('Please choose a service.');
+            return;
+        }
+        sendMessage(select.value);
+        container.remove();
+    };
+
+    container.appendChild(select);
+    container.appendChild(confirmBtn);
+
+    chatMessages.appendChild(container);
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+}
+
 // Quick Replies Function
 function addQuickReplies(options) {
     const container = document.createElement('div');
@@ -198,6 +392,11 @@ userInput.addEventListener('keypress', (e) => {
     }
 });
 
+fetch(`${API_BASE}/facts?tenant=${encodeURIComponent(TENANT)}`)
+    .then(response => response.ok ? response.json() : null)
+    .then(data => { clinicFacts = data; })
+    .catch(error => console.error('Could not load clinic facts:', error));
+
 // Initial greeting
 const welcomeMsg = `Hello, I am the CN Medical Assistant.
 